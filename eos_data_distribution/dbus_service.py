@@ -34,6 +34,7 @@ from gi.repository import Notify
 
 from eos_data_distribution import utils
 from eos_data_distribution.ndn.dbus.base import Consumer, Interest
+from eos_data_distribution.ndn.iopool import get_default_io_pool
 from eos_data_distribution.names import Name, SUBSCRIPTIONS_INSTALLED
 
 IFACE = '''<node>
@@ -86,7 +87,11 @@ def apply_subscription_update(subscription_id, src_manifest_path, shards):
 
 class DBusService(object):
 
-    def __init__(self):
+    def __init__(self, io_pool=None):
+        # If given an IOPool, subscription updates are copied into place
+        # from it rather than on the main loop.
+        self._io_pool = io_pool
+
         self.con = Gio.bus_get_sync(Gio.BusType.SESSION, None)
 
         Gio.bus_own_name_on_connection(
@@ -109,9 +114,18 @@ class DBusService(object):
     def _on_data(self, consumer, interest, response):
         response_text = response.getContent().toBytes()
         subscription_reply = json.loads(response_text)
-        apply_subscription_update(subscription_reply['subscription_id'], subscription_reply[
-                                  'manifest_path'], subscription_reply['shards'])
+        args = (subscription_reply['subscription_id'],
+                subscription_reply['manifest_path'],
+                subscription_reply['shards'])
+
+        if self._io_pool is None:
+            apply_subscription_update(*args)
+            self._on_update_applied()
+        else:
+            self._io_pool.submit(apply_subscription_update, args,
+                                 lambda result: self._on_update_applied())
 
+    def _on_update_applied(self):
         self._notification.update(
             "La actualización ha finalizado la descarga.", "")
         self._notification.show()
@@ -133,7 +147,7 @@ def main():
     utils.parse_args(include_name=False)
     Notify.init("Content Updates")
 
-    service = DBusService()
+    service = DBusService(io_pool=get_default_io_pool())
     GLib.MainLoop().run()
 
 if __name__ == '__main__':
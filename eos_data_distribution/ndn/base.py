@@ -17,7 +17,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # A copy of the GNU Lesser General Public License is in the file COPYING.
 
+import errno
+import heapq
+import itertools
 import logging
+import socket
+from collections import OrderedDict, deque
 from os import path
 from functools import partial
 
@@ -30,44 +35,229 @@ from gi.repository import GLib
 from pyndn.security import KeyChain
 from pyndn.transport.unix_transport import UnixTransport
 from pyndn import Name, Node, Data, Face, Interest, InterestFilter, ControlParameters
+from pyndn import ContentType
 
 from . import command
+from .sendmsg import sendmsg, IOV_MAX
 from utils import singleton
 
 logger = logging.getLogger(__name__)
 
+# Retransmission timeout bounds for Consumer interests, in milliseconds, and
+# the number of times an interest is re-expressed before giving up.
+INITIAL_RTO = 1000.0
+MIN_RTO = 200.0
+MAX_RTO = 60000.0
+MAX_RETRIES = 10
+
+# Maximum number of reads GLibUnixTransport does each time its socket becomes
+# readable before returning to the main loop, so that other sources get a
+# chance to run under sustained load.
+RECV_BUDGET = 64
+# Size of the buffer GLibUnixTransport reads into, and of the kernel receive
+# buffer it asks for on its socket.
+RECV_BUFFER_SIZE = 256 * 1024
+SOCKET_RCVBUF = 1024 * 1024
+# Bytes GLibUnixTransport queues for sending before it stops waiting for the
+# socket to become writable and blocks until the queue is flushed.
+SEND_QUEUE_SIZE = 4 * 1024 * 1024
+
+# Lifetime assumed for interests which do not set one, as the forwarder does
+# (in milliseconds); PIT entries are dropped this long after their interest
+# should have expired, if nothing removed them before.
+DEFAULT_INTEREST_LIFETIME = 4000.0
+PIT_GRACE_PERIOD = 1000.0
+# Maximum number of entries in a Base's pending interest table.
+PIT_MAX_SIZE = 65536
+
 
 class GLibUnixTransport(UnixTransport):
+
+    """
+    ``UnixTransport`` driven by a watch on the GLib main context.
+
+    Each time the socket becomes readable, it is drained without blocking
+    until it would block, or `recv_budget` reads have been done.
+
+    Packets to send are queued, and flushed once per main loop iteration
+    with a single gathered ``sendmsg()``. If the socket is full, the rest is
+    sent once an ``IO_OUT`` watch reports it writable again; only if more
+    than `send_queue_size` bytes pile up does ``send()`` block.
+
+    ``reads`` and ``bytes_received`` count the reads done and the bytes they
+    returned; ``writes`` and ``bytes_sent`` likewise for sending.
+    """
+
     _watch_id = 0
+    _io_channel = None
+
+    def __init__(self, recv_budget=RECV_BUDGET,
+                 recv_buffer_size=RECV_BUFFER_SIZE, rcvbuf=SOCKET_RCVBUF,
+                 send_queue_size=SEND_QUEUE_SIZE):
+        super(GLibUnixTransport, self).__init__()
+        assert recv_budget > 0
+        self._recv_budget = recv_budget
+        self._rcvbuf = rcvbuf
+        self._buffer = bytearray(recv_buffer_size)
+        self._bufferView = memoryview(self._buffer)
+        self._send_queue_size = send_queue_size
+        self._send_queue = deque()
+        self._send_queue_bytes = 0
+        self._flush_id = 0
+        self._out_watch_id = 0
+        self.reads = 0
+        self.bytes_received = 0
+        self.writes = 0
+        self.bytes_sent = 0
 
     def connect(self, connectionInfo, elementListener, onConnected):
         super(GLibUnixTransport, self).connect(
             connectionInfo, elementListener, onConnected)
 
+        if self._rcvbuf:
+            try:
+                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                        self._rcvbuf)
+            except socket.error as e:
+                logger.warning('Could not set the receive buffer size to %d: '
+                               '%s', self._rcvbuf, e)
+
         fd = self._socket.fileno()
-        io_channel = GLib.IOChannel.unix_new(fd)
+        self._io_channel = GLib.IOChannel.unix_new(fd)
         self._watch_id = GLib.io_add_watch(
-            io_channel, GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._socket_ready)
+            self._io_channel, GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+            self._socket_ready)
 
     def _socket_ready(self, channel, cond):
-        nBytesRead = self._socket.recv_into(self._buffer)
-        if nBytesRead <= 0:
-            # Since we checked for data ready, we don't expect this.
-            return
+        for i in xrange(self._recv_budget):
+            # The element reader may have closed us.
+            if self._socket is None:
+                return GLib.SOURCE_REMOVE
+
+            try:
+                nBytesRead = self._socket.recv_into(self._buffer, 0,
+                                                    socket.MSG_DONTWAIT)
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            if nBytesRead <= 0:
+                # The other end has closed the connection.
+                logger.warning('Connection to the forwarder closed')
+                self._watch_id = 0
+                return GLib.SOURCE_REMOVE
+
+            self.reads += 1
+            self.bytes_received += nBytesRead
+            self._elementReader.onReceivedData(self._bufferView[0:nBytesRead])
 
-        self._elementReader.onReceivedData(self._bufferView[0:nBytesRead])
         return GLib.SOURCE_CONTINUE
 
+    def send(self, data):
+        # Node hands us memoryviews into buffers it reuses: copy them.
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        else:
+            data = bytes(data)
+
+        self._send_queue.append(data)
+        self._send_queue_bytes += len(data)
+
+        if self._send_queue_bytes > self._send_queue_size:
+            self._flush(blocking=True)
+        elif self._flush_id == 0 and self._out_watch_id == 0:
+            self._flush_id = GLib.idle_add(self._on_flush,
+                                           priority=GLib.PRIORITY_DEFAULT)
+
+    def _on_flush(self):
+        self._flush_id = 0
+        self._flush()
+        if self._send_queue and self._out_watch_id == 0:
+            self._out_watch_id = GLib.io_add_watch(
+                self._io_channel, GLib.PRIORITY_DEFAULT, GLib.IO_OUT,
+                self._socket_writable)
+        return GLib.SOURCE_REMOVE
+
+    def _socket_writable(self, channel, cond):
+        self._flush()
+        if self._send_queue:
+            return GLib.SOURCE_CONTINUE
+
+        self._out_watch_id = 0
+        return GLib.SOURCE_REMOVE
+
+    def _flush(self, blocking=False):
+        # Send as much of the queue as the socket takes without blocking, or
+        # all of it if blocking.
+        flags = 0 if blocking else socket.MSG_DONTWAIT
+        while self._send_queue and self._socket is not None:
+            buffers = [self._send_queue[i]
+                       for i in xrange(min(len(self._send_queue), IOV_MAX))]
+            try:
+                sent = sendmsg(self._socket, buffers, flags)
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+            self.writes += 1
+            self.bytes_sent += sent
+            self._send_queue_bytes -= sent
+            while sent > 0:
+                data = self._send_queue.popleft()
+                if sent < len(data):
+                    self._send_queue.appendleft(data[sent:])
+                sent -= len(data)
+
     def close(self):
+        if self._send_queue and self._socket is not None:
+            try:
+                self._flush(blocking=True)
+            except socket.error as e:
+                logger.warning('Could not send %d queued bytes: %s',
+                               self._send_queue_bytes, e)
+        self._send_queue.clear()
+        self._send_queue_bytes = 0
+
         super(GLibUnixTransport, self).close()
 
-        if self._watch_id != 0:
-            GLib.source_remove(self._watch_id)
-            self._watch_id = 0
+        for source_id in (self._watch_id, self._flush_id, self._out_watch_id):
+            if source_id != 0:
+                GLib.source_remove(source_id)
+        self._watch_id = self._flush_id = self._out_watch_id = 0
+        self._io_channel = None
+
+
+class AggregatedInterest(object):
+
+    __slots__ = ('key', 'upstream_id', 'waiters')
+
+    def __init__(self, key):
+        self.key = key
+        self.upstream_id = None
+        # Pending interest ID → (Interest, onData, onTimeout)
+        self.waiters = OrderedDict()
 
 
 class GLibUnixFace(Face):
 
+    """
+    ``Face`` connected to the local forwarder through a ``GLibUnixTransport``.
+
+    Interests expressed while an identical one (same name and freshness
+    requirement) is outstanding are not sent again: they wait for the same
+    Data, which is passed to all their ``onData`` callbacks, or time out
+    with it, as the first interest's lifetime governs. Each expression still
+    gets its own pending interest ID, and the interest is only removed from
+    the forwarder once all of them are removed. ``collapsed_interests``
+    counts the interests which were not sent.
+    """
+
     def __init__(self):
         transport = GLibUnixTransport()
         file_path = self._getUnixSocketFilePathForLocalhost()
@@ -76,6 +266,75 @@ class GLibUnixFace(Face):
         self._node = Node(transport, connection_info)
         self._commandKeyChain = None
         self._commandCertificateName = Name()
+        self._aggregates = dict()
+        self._waiters = dict()
+        self.collapsed_interests = 0
+
+    def expressInterest(self, interestOrName, arg2, arg3=None, arg4=None,
+                        arg5=None, arg6=None):
+        # Only the plain expressInterest(interest, onData[, onTimeout]) form
+        # is aggregated.
+        if (not isinstance(interestOrName, Interest) or
+                any(arg is not None for arg in (arg4, arg5, arg6)) or
+                (arg3 is not None and not callable(arg3))):
+            return super(GLibUnixFace, self).expressInterest(
+                interestOrName, arg2, arg3, arg4, arg5, arg6)
+
+        interest = interestOrName
+        key = (interest.getName().toUri(), interest.getMustBeFresh())
+        pending_id = self._node.getNextEntryId()
+
+        aggregate = self._aggregates.get(key)
+        is_new = aggregate is None
+        if is_new:
+            aggregate = self._aggregates[key] = AggregatedInterest(key)
+        else:
+            self.collapsed_interests += 1
+            logger.debug('Collapsing interest %s', key[0])
+
+        aggregate.waiters[pending_id] = (interest, arg2, arg3)
+        self._waiters[pending_id] = aggregate
+
+        if is_new:
+            aggregate.upstream_id = self._expressUpstream(
+                interest, partial(self._onAggregatedData, aggregate),
+                partial(self._onAggregatedTimeout, aggregate))
+        return pending_id
+
+    def _expressUpstream(self, interest, onData, onTimeout):
+        return super(GLibUnixFace, self).expressInterest(
+            interest, onData, onTimeout)
+
+    def _removeUpstream(self, pending_id):
+        super(GLibUnixFace, self).removePendingInterest(pending_id)
+
+    def _finishAggregate(self, aggregate):
+        if self._aggregates.get(aggregate.key) is aggregate:
+            del self._aggregates[aggregate.key]
+        for pending_id in aggregate.waiters:
+            self._waiters.pop(pending_id, None)
+        return list(aggregate.waiters.values())
+
+    def _onAggregatedData(self, aggregate, interest, data):
+        # Callbacks may express the same interest again: finish first.
+        for waiter_interest, onData, _ in self._finishAggregate(aggregate):
+            onData(waiter_interest, data)
+
+    def _onAggregatedTimeout(self, aggregate, interest):
+        for waiter_interest, _, onTimeout in self._finishAggregate(aggregate):
+            if onTimeout is not None:
+                onTimeout(waiter_interest)
+
+    def removePendingInterest(self, pendingInterestId):
+        aggregate = self._waiters.pop(pendingInterestId, None)
+        if aggregate is None:
+            return super(GLibUnixFace, self).removePendingInterest(
+                pendingInterestId)
+
+        del aggregate.waiters[pendingInterestId]
+        if not aggregate.waiters:
+            self._finishAggregate(aggregate)
+            self._removeUpstream(aggregate.upstream_id)
 
     @property
     def usesGLibMainContext(self):
@@ -105,8 +364,194 @@ def generate_keys(name):
     return (keyChain, certificateName)
 
 
+class SigningInfo(object):
+
+    """
+    Key chain and certificate to sign command interests with.
+
+    Opening the key chain (and creating a certificate if there is none) is
+    slow, so this is only done the first time ``get()`` is called; all the
+    later calls return the same pair.
+    """
+
+    def __init__(self):
+        self._keys = None
+
+    def get(self, name):
+        if self._keys is None:
+            self._keys = generate_keys(name)
+        return self._keys
+
+
+@singleton
+def get_default_signing_info():
+    return SigningInfo()
+
+
+class RttEstimator(object):
+
+    """
+    Estimate the round-trip time of interests, as TCP does (RFC 6298).
+
+    Keeps a smoothed RTT and RTT variance from the measurements given to
+    ``add_measurement()`` and derives a retransmission timeout (RTO) from
+    them. ``get_rto()`` returns the RTO to use for an interest which has
+    already timed out a number of times, backing off exponentially.
+
+    All times are in milliseconds.
+    """
+
+    ALPHA = 1 / 8.0
+    BETA = 1 / 4.0
+    K = 4
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO,
+                 max_rto=MAX_RTO):
+        assert 0 < min_rto <= max_rto
+        self.srtt = None
+        self.rttvar = None
+        self._min_rto = min_rto
+        self._max_rto = max_rto
+        self._rto = self._clamp(initial_rto)
+
+    def _clamp(self, rto):
+        return max(self._min_rto, min(rto, self._max_rto))
+
+    def add_measurement(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = ((1 - self.BETA) * self.rttvar +
+                           self.BETA * abs(self.srtt - rtt))
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+
+        self._rto = self._clamp(self.srtt + self.K * self.rttvar)
+
+    def get_rto(self, retries=0):
+        return self._clamp(self._rto * (2 ** retries))
+
+
+class PendingInterestEntry(object):
+
+    __slots__ = ('key', 'pending_id', 'expiry')
+
+    def __init__(self, key, expiry):
+        self.key = key
+        self.pending_id = None
+        self.expiry = expiry
+
+
+class PendingInterestTable(object):
+
+    """
+    Interests expressed through a face and not answered yet.
+
+    Entries are keyed by interest name URI, so expressing an interest again
+    replaces its entry. Each entry records the ID the face returned for the
+    interest, and when it expires: its lifetime plus ``PIT_GRACE_PERIOD``
+    after it was added. ``discard()`` removes an entry when its interest is
+    answered or times out; in case that never happens, a heap ordered by
+    expiry lets ``add()`` drop expired entries cheaply, and the oldest are
+    evicted if there are more than `max_size`.
+
+    Times are monotonic, in µs; `now` defaults to the current time.
+    """
+
+    def __init__(self, max_size=PIT_MAX_SIZE):
+        assert max_size > 0
+        self._max_size = max_size
+        self._entries = dict()
+        self._expiries = []
+        self._counter = itertools.count()
+
+    @staticmethod
+    def _key(name):
+        # Accept an Interest, a Name, or a URI.
+        if hasattr(name, 'getName'):
+            name = name.getName()
+        if hasattr(name, 'toUri'):
+            return name.toUri()
+        return str(name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return self._key(name) in self._entries
+
+    def __getitem__(self, name):
+        return self._entries[self._key(name)].pending_id
+
+    def __iter__(self):
+        # Iterate over a copy, so that entries can be removed meanwhile.
+        return iter(list(self._entries))
+
+    def add(self, interest, now=None):
+        """Add an entry for interest and return it."""
+        if now is None:
+            now = GLib.get_monotonic_time()
+
+        lifetime = interest.getInterestLifetimeMilliseconds()
+        if lifetime is None or lifetime < 0:
+            lifetime = DEFAULT_INTEREST_LIFETIME
+        entry = PendingInterestEntry(
+            self._key(interest),
+            now + int((lifetime + PIT_GRACE_PERIOD) * 1000))
+
+        self._entries[entry.key] = entry
+        heapq.heappush(self._expiries,
+                       (entry.expiry, next(self._counter), entry))
+
+        self.expire(now)
+        while len(self._entries) > self._max_size:
+            self._pop_oldest()
+
+        # Replaced and removed entries are left in the heap until they reach
+        # its top; rebuild it if they come to dominate it.
+        if len(self._expiries) > 2 * len(self._entries) + 64:
+            self._expiries = [item for item in self._expiries
+                              if self._is_current(item[2])]
+            heapq.heapify(self._expiries)
+
+        return entry
+
+    def _is_current(self, entry):
+        return self._entries.get(entry.key) is entry
+
+    def _pop_oldest(self):
+        expiry, _, entry = heapq.heappop(self._expiries)
+        if self._is_current(entry):
+            del self._entries[entry.key]
+            logger.debug('Dropping pending interest %s', entry.key)
+
+    def expire(self, now=None):
+        """Drop the entries which have expired by now."""
+        if now is None:
+            now = GLib.get_monotonic_time()
+        while self._expiries and self._expiries[0][0] <= now:
+            self._pop_oldest()
+
+    def discard(self, entry):
+        """Remove entry, unless it has been replaced or removed already."""
+        if self._is_current(entry):
+            del self._entries[entry.key]
+
+    def pop(self, name):
+        """Remove the entry for name and return its pending interest ID."""
+        return self._entries.pop(self._key(name)).pending_id
+
+
 class Base(GObject.GObject):
 
+    """
+    Common base of producers and consumers.
+
+    Interests expressed through ``expressInterest()`` are tracked in the
+    ``pit``, a ``PendingInterestTable``, until they are answered or time out;
+    ``pit_size`` is the number of entries in it.
+    """
+
     def __init__(self, name, face=None):
         GObject.GObject.__init__(self)
         self.name = Name(name)
@@ -120,15 +565,22 @@ class Base(GObject.GObject):
         self._responseCount = 0
         self._keyChain = None
         self._certificateName = None
-        self.pit = dict()
+        self.pit = PendingInterestTable()
+
+    @GObject.Property(type=int)
+    def pit_size(self):
+        return len(self.pit)
 
     def generateKeys(self, name=None):
         if not name:
             name = self.name
-        (self._keyChain, self._certificateName) = generate_keys(name)
+        (self._keyChain, self._certificateName) = \
+            get_default_signing_info().get(name)
         self.face.setCommandSigningInfo(self._keyChain, self._certificateName)
 
     def sign(self, data):
+        if not self._keyChain or not self._certificateName:
+            self.generateKeys()
         return self._keyChain.sign(data, self._certificateName)
 
     def expressInterest(self, interest=None, *args, **kwargs):
@@ -147,10 +599,21 @@ class Base(GObject.GObject):
             onTimeout = partial(self.onTimeout, try_again=try_again)
 
         logger.debug("Express Interest name: %s", interest)
-        self.pit[interest] = self.face.expressInterest(
-            interest, onData, onTimeout)
+        entry = self.pit.add(interest)
+        entry.pending_id = self.face.expressInterest(
+            interest, partial(self._onPendingData, entry, onData),
+            partial(self._onPendingTimeout, entry, onTimeout))
         return interest
 
+    def _onPendingData(self, entry, onData, interest, data):
+        # NACKs are delivered as Data, so this covers them too.
+        self.pit.discard(entry)
+        onData(interest, data)
+
+    def _onPendingTimeout(self, entry, onTimeout, interest):
+        self.pit.discard(entry)
+        onTimeout(interest)
+
     def expressCommandInterest(self, cmd, prefix=None,
                                onFailed=None, onTimeout=None, onSuccess=None,
                                *args, **kwargs):
@@ -189,18 +652,29 @@ class Base(GObject.GObject):
 
 
 class Producer(Base):
+
+    """
+    Answer interests for a name.
+
+    If given a `data_cache` (such as ``cache.get_default_data_cache()``,
+    shared by all producers in the process), the Data packets sent are kept
+    encoded in it, and ``_send_cached()`` can answer repeated interests with
+    them directly.
+    """
+
     __gsignals__ = {
         'register-failed': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
         'register-success': (GObject.SIGNAL_RUN_FIRST, None, (object, object)),
         'interest': (GObject.SIGNAL_RUN_FIRST, None, (object, object, object, object, object))
     }
 
-    def __init__(self, name=None, cost=None, *args, **kwargs):
+    def __init__(self, name=None, cost=None, data_cache=None, *args, **kwargs):
         self.cost = cost
+        self._data_cache = data_cache
 
         super(Producer, self).__init__(name=name, *args, **kwargs)
 
-        self.generateKeys()
+        # Keys are only loaded when the first command interest is made.
         self._prefixes = dict()
 
     def start(self):
@@ -218,7 +692,25 @@ class Producer(Base):
     def sendFinish(self, data):
         # self.sign(data)
         logger.debug('sending data: %s', data.getName())
-        self.face.putData(data)
+        if (self._data_cache is None or
+                data.getMetaInfo().getType() == ContentType.NACK):
+            self.face.putData(data)
+            return
+
+        encoding = data.wireEncode().toBytes()
+        self._data_cache.put(data.getName().toUri(), encoding)
+        self.face.send(encoding)
+
+    def _send_cached(self, name):
+        # Send the cached packet for name, if there is one.
+        if self._data_cache is None:
+            return False
+        encoding = self._data_cache.get(name.toUri())
+        if encoding is None:
+            return False
+        logger.debug('sending cached data: %s', name)
+        self.face.send(encoding)
+        return True
 
     def _onInterest(self, *args, **kwargs):
         self._responseCount += 1
@@ -311,33 +803,94 @@ class Producer(Base):
 
 
 class Consumer(Base):
+
+    """
+    Express interests and receive the matching data.
+
+    The lifetime of each interest is set from a per-consumer ``RttEstimator``
+    fed with the round-trip time of answered interests. Interests expressed
+    with `try_again` are re-expressed on timeout with an exponentially
+    backed-off lifetime, up to `max_retries` times (or forever if it is
+    None); after that the ``interest-failed`` signal is emitted and the
+    interest is dropped.
+    """
+
     __gsignals__ = {
         'data': (GObject.SIGNAL_RUN_FIRST, None, (object, object)),
         'interest-timeout': (GObject.SIGNAL_RUN_FIRST, None, (object, bool)),
+        'interest-failed': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
     }
 
-    def __init__(self, name=None, *args, **kwargs):
+    def __init__(self, name=None, max_retries=MAX_RETRIES, rtt_estimator=None,
+                 *args, **kwargs):
         super(Consumer, self).__init__(name=name, *args, **kwargs)
 
         #        self.generateKeys()
         self._prefixes = dict()
+        self._max_retries = max_retries
+        self._rtt_estimator = rtt_estimator or RttEstimator()
+        # Both keyed by interest name URI. _send_times holds the monotonic
+        # time (in µs) at which an interest was first expressed, or None once
+        # it has been re-expressed, as RTT samples from retransmitted
+        # interests are ambiguous (Karn's algorithm).
+        self._retries = dict()
+        self._send_times = dict()
 
     def start(self):
         self.expressInterest()
 
+    def _expressInterest(self, interest, try_again=False,
+                         onData=None, onTimeout=None):
+        key = interest.getName().toUri()
+        retries = self._retries.get(key, 0)
+        interest.setInterestLifetimeMilliseconds(
+            self._rtt_estimator.get_rto(retries))
+        self._send_times[key] = None if retries else GLib.get_monotonic_time()
+
+        return super(Consumer, self)._expressInterest(
+            interest, try_again=try_again, onData=onData, onTimeout=onTimeout)
+
+    def _forget_interest(self, interest):
+        key = PendingInterestTable._key(interest)
+        self._retries.pop(key, None)
+        return self._send_times.pop(key, None)
+
     def _onData(self, interest, data):
+        sent = self._forget_interest(interest)
+        if sent is not None:
+            self._rtt_estimator.add_measurement(
+                (GLib.get_monotonic_time() - sent) / 1000.0)
+
         self._callbackCount += 1
         self.emit('data', interest, data)
 
     def removePendingInterest(self, name):
-        self.face.removePendingInterest(self.pit[name])
-        del self.pit[name]
+        self._forget_interest(name)
+        self.face.removePendingInterest(self.pit.pop(name))
+
+    def removePendingInterests(self):
+        """Cancel all the interests not answered yet."""
+        for key in self.pit:
+            self.removePendingInterest(key)
 
     def onTimeout(self, interest, try_again=False):
         name = interest.getName()
         self._callbackCount += 1
         self.emit('interest-timeout', interest, try_again)
         logger.debug("Time out for interest: %s", name)
-        if try_again:
-            logger.info("Re-requesting Interest: %s", name)
-            self._expressInterest(interest, try_again=try_again)
+        if not try_again:
+            self._forget_interest(interest)
+            return
+
+        key = name.toUri()
+        retries = self._retries.get(key, 0) + 1
+        if self._max_retries is not None and retries > self._max_retries:
+            logger.warning("Giving up on Interest: %s after %d retries",
+                           name, retries - 1)
+            self._forget_interest(interest)
+            self.emit('interest-failed', interest)
+            return
+
+        self._retries[key] = retries
+        logger.info("Re-requesting Interest: %s (retry %d)", name, retries)
+        self._expressInterest(interest, try_again=try_again)
@@ -0,0 +1,130 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import logging
+from collections import OrderedDict
+
+from .utils import singleton
+
+logger = logging.getLogger(__name__)
+
+CHUNK_CACHE_SIZE = 32 * 1024 * 1024  # bytes
+DATA_CACHE_SIZE = 16 * 1024 * 1024  # bytes
+
+
+class LRUCache(object):
+
+    """
+    Least-recently-used cache bounded by the total size of its values.
+
+    Values must support ``len()``, which is taken as their size in bytes.
+    Once the total goes over `max_bytes`, the least recently used entries are
+    evicted. Values larger than the whole cache are never stored.
+
+    The ``hits``, ``misses`` and ``evictions`` counters can be read at any
+    time to judge how well the cache is doing; ``hit_rate`` sums them up.
+    """
+
+    def __init__(self, max_bytes):
+        assert max_bytes > 0
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def get(self, key):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # Re-insert to mark it as the most recently used.
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.remove(key)
+        if len(value) > self.max_bytes:
+            return
+
+        self._entries[key] = value
+        self.size += len(value)
+
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def remove(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.size -= len(value)
+        return value
+
+
+class ChunkCache(LRUCache):
+
+    """
+    Cache of file chunks, keyed by (file key, chunk number).
+
+    In addition to the ``LRUCache`` counters, ``readaheads`` counts the
+    number of read-ahead blocks which were read into the cache.
+    """
+
+    def __init__(self, max_bytes=CHUNK_CACHE_SIZE):
+        super(ChunkCache, self).__init__(max_bytes)
+        self.readaheads = 0
+
+
+class DataCache(LRUCache):
+
+    """
+    Cache of encoded Data packets, keyed by name URI.
+
+    Producers given one answer repeated interests for a name with the
+    packet they encoded the first time, without building it again.
+    """
+
+    def __init__(self, max_bytes=DATA_CACHE_SIZE):
+        super(DataCache, self).__init__(max_bytes)
+
+
+@singleton
+def get_default_chunk_cache():
+    return ChunkCache()
+
+
+@singleton
+def get_default_data_cache():
+    return DataCache()
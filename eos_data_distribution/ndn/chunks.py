@@ -25,12 +25,18 @@ from gi.repository import GObject
 from pyndn import Name, Interest, Data, MetaInfo, ContentType
 
 from . import base
+from .segments import SegmentMap
 from .. import defaults
 
 logger = logging.getLogger(__name__)
 
 CHUNK_SIZE = defaults.CHUNK_SIZE
 
+# Bounds on the interest window of chunks.Consumer: the number of interests
+# it keeps outstanding at once.
+MIN_WINDOW = 1
+MAX_WINDOW = 256
+
 def get_chunk_component(name):
     # The chunk component of a name is the last part...
     return name.get(-1)
@@ -45,6 +51,34 @@ def get_chunkless_name(name):
         chunkless_name = name
     return chunkless_name
 
+
+def get_segment(name):
+    # Return the segment number addressed by name, or None if it has none.
+    if name.size() == 0:
+        return None
+    chunk_component = get_chunk_component(name)
+    if not chunk_component.isSegment():
+        return None
+    return chunk_component.toSegment()
+
+
+def byte_range_to_segments(start, stop, chunk_size=CHUNK_SIZE):
+    # Return the segment range [first, last) holding the bytes [start, stop).
+    return (start // chunk_size, (stop + chunk_size - 1) // chunk_size)
+
+
+def _merge_ranges(ranges):
+    # Sort ranges of segments and merge those which overlap or touch.
+    merged = []
+    for start, stop in sorted(ranges):
+        if start < 0 or start >= stop:
+            raise ValueError('Invalid range [%d, %d)' % (start, stop))
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(r) for r in merged]
+
 class Producer(base.Producer):
 
     """
@@ -100,6 +134,9 @@ class Producer(base.Producer):
             seg = 0
             name.appendSegment(seg)
 
+        if self._send_cached(name):
+            return
+
         final_segment = self._get_final_segment()
         meta_info = MetaInfo()
         meta_info.setFinalBlockId(Name.Component.fromSegment(final_segment))
@@ -112,34 +149,89 @@ class Producer(base.Producer):
 
 
 class Consumer(base.Consumer):
+
+    """
+    Retrieve all the chunks of some named content.
+
+    The number of interests kept outstanding is governed by an AIMD
+    congestion window, similar to TCP Reno: it starts at `pipeline`, grows
+    by one per received chunk until it first sees a loss (slow start), then
+    by one per window's worth of chunks (congestion avoidance). A timeout or
+    NACK halves it, at most once per window of interests, and it is always
+    kept within [`min_window`, `max_window`]. It does not grow while
+    ``_is_backlogged()`` returns True, which subclasses saving chunks to slow
+    storage can use to push back on the network.
+
+    The current window is exposed as the read-only ``window`` property.
+
+    By default the whole content is retrieved. To fetch only some of it, pass
+    `segment_ranges`, a list of half-open ``(start, stop)`` ranges of segment
+    numbers, and/or `byte_ranges`, likewise in bytes, which are mapped to the
+    segments holding them. Ranges may overlap, and are clipped to the end of
+    the content. Segments outside them are never requested, and are not
+    passed to ``_save_chunk()``; ``progress`` and ``complete`` only account
+    for the requested ones. The first segment is always retrieved, to learn
+    the size of the content, but is dropped if it is not requested.
+
+    If an interest is still unanswered once its retries are used up, the
+    download stops: the other outstanding interests are cancelled, and
+    ``failed`` is emitted with the reason. Calling ``start()`` again resumes
+    it from the segments not received yet.
+    """
+
     __gsignals__ = {
         'progress': (GObject.SIGNAL_RUN_FIRST, None, (int, )),
         'complete': (GObject.SIGNAL_RUN_FIRST, None, ()),
+        'failed': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
     }
 
-    def __init__(self, name, chunk_size=CHUNK_SIZE, pipeline=5, *args, **kwargs):
+    def __init__(self, name, chunk_size=CHUNK_SIZE, pipeline=5,
+                 min_window=MIN_WINDOW, max_window=MAX_WINDOW,
+                 segment_ranges=None, byte_ranges=None, *args, **kwargs):
+        assert 0 < min_window <= max_window
         self.chunk_size = chunk_size
-        self._total_interest_requests = pipeline
+        if segment_ranges is None and byte_ranges is None:
+            self._segment_ranges = None
+        else:
+            ranges = list(segment_ranges or [])
+            ranges.extend(byte_range_to_segments(start, stop, chunk_size)
+                          for start, stop in byte_ranges or [])
+            self._segment_ranges = _merge_ranges(ranges)
+        self._num_skipped_segments = 0
+        self._min_window = min_window
+        self._max_window = max_window
+        self._window = float(max(min_window, min(pipeline, max_window)))
+        self._ssthresh = float(max_window)
+        self._recovery_segment = -1
+        self._highest_requested_segment = -1
         self._final_segment = None
         self._num_segments = None
         self._segments = None
         self._num_outstanding_interests = 0
         self._qualified_name = None
         self._emitted_complete = False
+        self._failed = False
 
         self.interest = Interest(Name(name))
         self.interest.setMustBeFresh(True)
 
         super(Consumer, self).__init__(name=name, *args, **kwargs)
         self.connect('data', self._on_data)
+        self.connect('interest-failed', self._on_interest_failed)
         logger.debug('init chunks.Consumer: %s', name)
 
+    @GObject.Property(type=float)
+    def window(self):
+        return self._window
+
     def start(self):
+        self._failed = False
         if not self._segments:
             # Make an initial request for the barename. We should get a fully
             # qualified request back for the first segment, with a timestamp and
             # segment number. Future requests will request the fully qualified
             # name.
+            self._num_outstanding_interests += 1
             self.expressInterest(try_again=True)
         else:
             self._schedule_interests()
@@ -147,12 +239,20 @@ class Consumer(base.Consumer):
     def _save_chunk(self, n, data):
         raise NotImplementedError()
 
+    def _is_backlogged(self):
+        return False
+
+    def _can_request(self, n):
+        # Subclasses may hold back requests for segments they cannot take
+        # yet; they must call _schedule_interests() once they can.
+        return True
+
     def _on_complete(self):
         self.emit('complete')
         logger.debug('fully retrieved: %s', self.name)
 
     def _check_for_complete(self):
-        if self._segments.count(defaults.SegmentState.COMPLETE) == len(self._segments):
+        if self._segments.is_complete():
             if not self._emitted_complete:
                 self._emitted_complete = True
                 self._on_complete()
@@ -160,15 +260,21 @@ class Consumer(base.Consumer):
                 logger.debug('Prevented emitting repeated complete signal')
 
     def _schedule_interests(self):
-        while self._num_outstanding_interests < self._total_interest_requests:
+        if self._failed:
+            return
+
+        while self._num_outstanding_interests < int(self._window):
             try:
-                next_segment = self._segments.index(defaults.SegmentState.UNSENT)
+                next_segment = self._segments.next_unsent()
             except ValueError as e:
                 # If we have no unsent segments left, then check for
                 # completion.
                 self._check_for_complete()
                 return
 
+            if not self._can_request(next_segment):
+                return
+
             self._request_segment(next_segment)
 
     def _request_segment(self, n):
@@ -178,6 +284,59 @@ class Consumer(base.Consumer):
         if self._segments is not None:
             self._segments[n] = defaults.SegmentState.OUTGOING
         self._num_outstanding_interests += 1
+        self._highest_requested_segment = max(self._highest_requested_segment, n)
+
+    def _set_window(self, window):
+        window = float(max(self._min_window, min(window, self._max_window)))
+        if window != self._window:
+            self._window = window
+            self.notify('window')
+
+    def _grow_window(self):
+        if self._is_backlogged():
+            return
+
+        if self._window < self._ssthresh:
+            self._set_window(self._window + 1)
+        else:
+            self._set_window(self._window + 1 / self._window)
+
+    def _shrink_window(self, seg=None):
+        # Losses of interests sent before the last decrease are part of the
+        # same congestion event, so only react to them once.
+        if seg is not None and seg <= self._recovery_segment:
+            return
+
+        self._ssthresh = max(self._window / 2, float(self._min_window))
+        self._recovery_segment = self._highest_requested_segment
+        self._set_window(self._ssthresh)
+        logger.debug('shrinking window to %.2f', self._window)
+
+    def onTimeout(self, interest, try_again=False):
+        self._shrink_window(get_segment(interest.getName()))
+        super(Consumer, self).onTimeout(interest, try_again=try_again)
+
+    def _on_interest_failed(self, o, interest):
+        self._num_outstanding_interests -= 1
+        self._fail('No reply to %s' % (interest.getName().toUri(), ))
+
+    def _fail(self, reason):
+        """Stop the download, and emit ``failed`` with reason."""
+        if self._failed:
+            return
+
+        logger.warning('download of %s failed: %s', self.name, reason)
+        self._failed = True
+        self.removePendingInterests()
+        self._num_outstanding_interests = 0
+        # Segments requested but not received are requested again if the
+        # download is restarted.
+        if self._segments is not None:
+            outgoing = [n for n, state in enumerate(self._segments)
+                        if state == defaults.SegmentState.OUTGOING]
+            for n in outgoing:
+                self._segments[n] = defaults.SegmentState.UNSENT
+        self.emit('failed', reason)
 
     def _set_final_segment(self, n):
         self._final_segment = n
@@ -185,7 +344,40 @@ class Consumer(base.Consumer):
         self._size = self.chunk_size * self._num_segments
 
         if self._segments is None:
-            self._segments = [defaults.SegmentState.UNSENT] * self._num_segments
+            self._segments = self._build_segment_map()
+
+    def _build_segment_map(self):
+        if self._segment_ranges is None:
+            return SegmentMap(self._num_segments)
+
+        # Segments outside the requested ranges are marked as complete from
+        # the start, so that they are never scheduled.
+        segments = SegmentMap(self._num_segments,
+                              defaults.SegmentState.COMPLETE)
+        for start, stop in self._segment_ranges:
+            if start >= self._num_segments:
+                break
+            segments.fill(start, min(stop, self._num_segments),
+                          defaults.SegmentState.UNSENT)
+        self._num_skipped_segments = segments.count(
+            defaults.SegmentState.COMPLETE)
+        return segments
+
+    def _next_wanted_segment(self, n):
+        # The first requested segment from n on, or None if there are none.
+        if self._segment_ranges is None:
+            return n
+        for start, stop in self._segment_ranges:
+            if n < stop:
+                return max(n, start)
+        return None
+
+    def _count_wanted_segments(self, start, stop):
+        # The number of requested segments in [start, stop).
+        if self._segment_ranges is None:
+            return max(0, stop - start)
+        return sum(max(0, min(stop, r_stop) - max(start, r_start))
+                   for r_start, r_stop in self._segment_ranges)
 
     def _check_final_segment(self, n):
         if self._final_segment is not None:
@@ -197,11 +389,14 @@ class Consumer(base.Consumer):
             self._set_final_segment(n)
 
     def _on_data(self, o, interest, data):
+        if self._failed:
+            return
         self._num_outstanding_interests -= 1
 
         # If we get a NACK, then check for completion.
         meta_info = data.getMetaInfo()
         if meta_info.getType() == ContentType.NACK:
+            self._shrink_window(get_segment(data.getName()))
             self._check_for_complete()
             return
 
@@ -220,9 +415,9 @@ class Consumer(base.Consumer):
 
         # Have we somehow already got this segment?
         if self._segments[seg] == defaults.SegmentState.COMPLETE:
-            logger.debug('Ignoring data ‘%s’ as it’s already been received',
-                         name)
-            self._check_for_complete()
+            logger.debug('Ignoring data ‘%s’ as it’s already been received '
+                         'or was not requested', name)
+            self._schedule_interests()
             return
 
         # If saving the chunk fails, it might be because the chunk was invalid,
@@ -230,9 +425,14 @@ class Consumer(base.Consumer):
         if not self._save_chunk(seg, data):
             return
         self._segments[seg] = defaults.SegmentState.COMPLETE
-
-        num_complete_segments = self._segments.count(defaults.SegmentState.COMPLETE)
-        self.emit(
-            'progress', (float(num_complete_segments) / len(self._segments)) * 100)
+        self._grow_window()
+
+        num_complete_segments = (
+            self._segments.count(defaults.SegmentState.COMPLETE) -
+            self._num_skipped_segments)
+        num_requested_segments = (len(self._segments) -
+                                  self._num_skipped_segments)
+        self.emit('progress',
+                  (float(num_complete_segments) / num_requested_segments) * 100)
 
         self._schedule_interests()
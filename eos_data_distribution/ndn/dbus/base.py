@@ -38,6 +38,8 @@ BASE_DBUS_NAME = 'com.endlessm.NDNHackBridge.base'
 BASE_DBUS_PATH = '/com/endlessm/NDNHackBridge'
 
 DBUS_PATH_TEMPLATE = '%s%s'
+# Object paths cannot end with a slash, so the root name gets its own.
+ROOT_DBUS_PATH = '%s/_' % (BASE_DBUS_PATH, )
 
 dbus_producer_instances = dict()
 
@@ -61,8 +63,19 @@ def sanitize_dbus_path(path):
             .replace('%', '_'))
 
 def build_dbus_path(name):
-    name = Name(name)
-    return sanitize_dbus_path(DBUS_PATH_TEMPLATE % (BASE_DBUS_PATH, name.toString()))
+    name = Name(name).toString()
+    if name == '/':
+        return ROOT_DBUS_PATH
+    return sanitize_dbus_path(DBUS_PATH_TEMPLATE % (BASE_DBUS_PATH, name))
+
+def iter_prefixes(name):
+    """Yield name, then each of its prefixes down to the root, '/'."""
+    prefix = Name(name).toString()
+    while True:
+        yield prefix
+        if prefix == '/':
+            return
+        prefix = prefix.rsplit('/', 1)[0] or '/'
 
 def build_dbus_name(base, name):
     component = get_route_component(name)
@@ -169,17 +182,14 @@ class Consumer(Base):
 
     def _dbus_express_interest(self, interest, dbus_path, dbus_name):
         logger.debug('looking for %s in %s (%s)', dbus_path, [p.get_object_path() for p in self._object_manager.get_objects()], self._object_manager)
-        prefix = interest
-        while len(prefix):
+        for prefix in iter_prefixes(interest):
             object_path = build_dbus_path(prefix)
             proxy = self._object_manager.get_object(object_path)
             if proxy:
                 break
 
             logger.debug("couldn't find %s on bus", object_path)
-            prefix = '/'.join(prefix.split('/')[:-1])
-
-        if not len(prefix):
+        else:
             logger.debug("failed to find a dbus object for %s %s %s", interest, dbus_name, dbus_path)
             return None
 
@@ -254,6 +264,13 @@ class DBusProducerSingleton():
                     self._dbus_name, dbus_path, iface_str)
         return registered
 
+    def unregister_path_for_name(self, name):
+        name = Name(name)
+        dbus_path = build_dbus_path(name)
+        logger.debug('unregistering path: %s', dbus_path)
+        self._object_manager.unexport(dbus_path)
+        self._cb_registery.pop(name.toString(), None)
+
     def _on_complete(self, *args, **kwargs):
         return self._find_handler_and_call('complete', *args, **kwargs)
 
@@ -279,17 +296,13 @@ class DBusProducerSingleton():
         logger.debug('handeling call %s for name=%s, args=%s, kwargs=%s',
                      handler_name, name, args, kwargs)
 
-        prefix = name
-
-        while len(prefix):
+        for prefix in iter_prefixes(name):
             try:
                 callback = self._cb_registery[prefix][handler_name]
                 break
             except KeyError:
                 logger.debug("couldn't find handler for %s", prefix)
-                prefix = '/'.join(prefix.split('/')[:-1])
-
-        if not len(prefix):
+        else:
             logger.debug("FOUND NO handler for %s", name)
             return False
 
@@ -316,6 +329,9 @@ class Producer(Base):
     """Base DBus-NDN producer
 
     this is for simple message passing with the NDN API
+
+    If given a `dispatcher` (see ``ndn.dispatch``), the producer adds itself
+    to it rather than registering its own name.
     """
 
     __gsignals__ = {
@@ -327,9 +343,10 @@ class Producer(Base):
 
     def __init__(self, name, dbus_name=BASE_DBUS_NAME,
                  skeleton=EosDataDistributionDbus.BaseProducerSkeleton,
-                 *args, **kwargs):
+                 dispatcher=None, *args, **kwargs):
         self.registered = False
         self._workers = dict()
+        self._dispatcher = dispatcher
 
         super(Producer, self).__init__(name=name, *args, **kwargs)
         try:
@@ -348,14 +365,26 @@ class Producer(Base):
             raise NotImplementedError()
 
         if self.registered:
-            console.error('already registered')
+            logger.error('already registered')
+            return
+
+        if self._dispatcher is not None:
+            self._dispatcher.add(self)
+            self.registered = True
             return
 
-        self.registred = self._dbus.register_path_for_name(self.name, {
+        self.registered = bool(self._dbus.register_path_for_name(self.name, {
             'request-interest': self._on_request_interest,
             'complete': self._on_complete
-        })
-        if not self.registred: self.emit('register-failed', self.registered)
+        }))
+        if not self.registered: self.emit('register-failed', self.registered)
+
+    def removeRegisteredPrefix(self, prefix=None):
+        if self._dispatcher is not None:
+            self._dispatcher.remove(self)
+        else:
+            self._dbus.unregister_path_for_name(self.name)
+        self.registered = False
 
     def send(self, name, data, flags = {}):
         logger.debug('producer: sending on name %s, %s', name, data)
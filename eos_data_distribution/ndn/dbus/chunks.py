@@ -31,6 +31,7 @@ from gi.repository import GLib
 from gi.repository import Gio
 
 from . import base
+from ..segments import SegmentMap
 from ... import defaults
 from .base import Interest
 from eos_data_distribution import utils
@@ -101,6 +102,8 @@ class Consumer(base.Consumer):
         self._segments = None
         self._qualified_name = None
         self._emitted_complete = False
+        self._progress_interface = None
+        self._progress_id = 0
 
         super(Consumer, self).__init__(name=name,
                                        dbus_name=CHUNKS_DBUS_NAME,
@@ -113,7 +116,7 @@ class Consumer(base.Consumer):
         # XXX parse interest to see if we're requesting the first chunk
         self.first_segment = 0
         if (self._segments):
-            self.current_segment = self.first_segment = self._segments.index(defaults.SegmentState.UNSENT) or 0
+            self.current_segment = self.first_segment = self._segments.next_unsent() or 0
             logger.debug('STARTING AT %s', self.first_segment)
         self.interest = interest
 
@@ -137,7 +140,10 @@ class Consumer(base.Consumer):
         assert(self.filename)
         assert(self.fd)
 
-        interface.connect('progress', self._on_progress)
+        if self._progress_id:
+            self._progress_interface.disconnect(self._progress_id)
+        self._progress_interface = interface
+        self._progress_id = interface.connect('progress', self._on_progress)
         interface.call_request_interest(interest,
                                         GLib.Variant('h', fd_id),
                                         self.first_segment, fd_list=fd_list,
@@ -148,6 +154,11 @@ class Consumer(base.Consumer):
         raise NotImplementedError()
 
     def _on_progress(self, proxy, name, first_segment, last_segment):
+        # The object may answer for other names too (see ndn.dispatch), and
+        # report their progress on the same signal.
+        if Name(name).toString() != Name(self.interest).toString():
+            return
+
         logger.info('got progress, (%s) %s → %s', self.fd,  self.current_segment, last_segment)
 
         assert(self._final_segment != None)
@@ -173,7 +184,10 @@ class Consumer(base.Consumer):
                 logger.warning('consumer read segment FAILED: %s @ %s', self.current_segment, self.fd.tell())
                 return
 
-            self._save_chunk(self.current_segment, buf)
+            # If saving the chunk fails, it might be because the chunk is
+            # being saved by someone else.
+            if not self._save_chunk(self.current_segment, buf):
+                return
             self._segments[self.current_segment] = defaults.SegmentState.COMPLETE
             self.current_segment += 1
 
@@ -199,7 +213,7 @@ class Consumer(base.Consumer):
         self._size = self.chunk_size * self._num_segments
 
         if self._segments is None:
-            self._segments = [defaults.SegmentState.UNSENT] * self._num_segments
+            self._segments = SegmentMap(self._num_segments)
 
     def _check_final_segment(self, n):
         if self._final_segment is not None:
@@ -222,7 +236,11 @@ class Consumer(base.Consumer):
         logger.info('fully retrieved: %s', self.name)
 
 class Producer(base.Producer):
-    def __init__(self, name, *args, **kwargs):
+    def __init__(self, name, io_pool=None, *args, **kwargs):
+        # If given an IOPool, chunks are written out to consumers from it,
+        # off the main loop.
+        self._io_pool = io_pool
+
         super(Producer, self).__init__(name=name,
                                        dbus_name=CHUNKS_DBUS_NAME,
                                        skeleton=EosDataDistributionDbus.ChunksChunksProducerSkeleton,
@@ -231,6 +249,19 @@ class Producer(base.Producer):
     def _get_final_segment(self):
         raise NotImplementedError
 
+    def _get_chunk(self, n):
+        raise NotImplementedError
+
+    def _get_chunk_async(self, n, callback, errback=None):
+        # Subclasses which block to get a chunk may override this to do so
+        # off the main loop; callback, or errback with the exception if it
+        # fails, must still be called on the main loop.
+        callback(self._get_chunk(n))
+
+    def _send_chunk(self, data, n):
+        data.setContent(self._get_chunk(n))
+        self.sendFinish(data)
+
     def _on_request_interest(self, name, skeleton, fd_list, fd_variant, first_segment):
         self.emit('interest', Name(name), Interest(name), None, None, None)
         fd = fd_list.get(fd_variant.get_handle())
@@ -257,8 +288,13 @@ class Producer(base.Producer):
         except KeyError:
             pass
 
-        self._workers[key] = worker = ProducerWorker(fd, first_segment, final_segment,
-                                                      self._send_chunk)
+        if self._io_pool is None:
+            worker = ProducerWorker(fd, first_segment, final_segment,
+                                    self._send_chunk)
+        else:
+            worker = AsyncProducerWorker(fd, first_segment, final_segment,
+                                         self._get_chunk_async, self._io_pool)
+        self._workers[key] = worker
         self._dbus.return_value(name, final_segment)
 
         last_emited = first_segment - 1
@@ -275,8 +311,7 @@ class Producer(base.Producer):
         # get another fd from the consumer
         key = name.toString()
         worker = self._workers[key]
-        worker.working = False
-        worker.fd.close()
+        worker.stop()
         del self._workers[key]
         return True
 
@@ -295,14 +330,77 @@ class ProducerWorker():
         self.fd = os.fdopen(fd, 'w+b')
         self.data = Data(self.fd, first_segment)
 
+        self._run(send_chunk)
+
+    def _run(self, send_chunk):
         while(True):
             send_chunk(self.data, self.current_segment)
-            if self.current_segment < final_segment:
+            if self.current_segment < self.final_segment:
                 self.current_segment += 1
             else:
                 break
 
-        logger.info('end segments: %s, %s', self.current_segment, final_segment)
+        logger.info('end segments: %s, %s', self.current_segment, self.final_segment)
+
+    def stop(self):
+        self.working = False
+        self.fd.close()
+
+class AsyncProducerWorker(ProducerWorker):
+    """ProducerWorker which writes its chunks from an IOPool
+
+    Chunks are still written one at a time and in order, as Data requires,
+    but the writes (and the reads of the chunks from disk, if the producer's
+    _get_chunk_async() does them there) do not block the main loop.
+
+    """
+    def __init__(self, fd, first_segment, final_segment, get_chunk_async,
+                 io_pool):
+        self._get_chunk_async = get_chunk_async
+        self._io_pool = io_pool
+        self._busy = False
+        ProducerWorker.__init__(self, fd, first_segment, final_segment, None)
+
+    def _run(self, send_chunk):
+        self._busy = True
+        self._get_chunk_async(self.current_segment, self._on_chunk,
+                              self._on_error)
+
+    def _on_chunk(self, content):
+        if not self.working:
+            return self._on_stopped()
+        self._io_pool.submit(self.data.setContent, (content, ),
+                             self._on_chunk_written, self._on_error)
+
+    def _on_chunk_written(self, ret):
+        self._busy = False
+        if not self.working:
+            return self._on_stopped()
+
+        if self.current_segment < self.final_segment:
+            self.current_segment += 1
+            self._run(None)
+        else:
+            logger.info('end segments: %s, %s', self.current_segment, self.final_segment)
+
+    def stop(self):
+        self.working = False
+        if not self._busy:
+            self.fd.close()
+
+    def _on_stopped(self):
+        # The consumer completed while a chunk was being written; only close
+        # the fd once nothing uses it any more.
+        self._busy = False
+        self.fd.close()
+
+    def _on_error(self, error):
+        # Closing the fd hangs up on the consumer, rather than leaving it
+        # waiting for chunks which will never come.
+        logger.warning('Failed to send segment %s: %s', self.current_segment,
+                       error)
+        self.working = False
+        self._on_stopped()
 
 if __name__ == '__main__':
     import re
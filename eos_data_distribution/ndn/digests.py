@@ -0,0 +1,103 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import hashlib
+import logging
+import os
+
+from .pread import pread
+
+logger = logging.getLogger(__name__)
+
+# The digest table of some content is published under the content's name
+# with this component appended.
+DIGESTS_COMPONENT = 'digests'
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+# Chunks are read this many bytes at a time when hashing a whole file.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def digest_chunk(data):
+    return hashlib.sha256(data).digest()
+
+
+class DigestTable(object):
+
+    """
+    Table of the SHA-256 digests of each chunk of some content.
+
+    It is serialised as the concatenation of the digests of all the chunks,
+    in order, which is what producers publish under ``DIGESTS_COMPONENT``.
+    """
+
+    def __init__(self, digests=b''):
+        digests = bytes(digests)
+        if len(digests) % DIGEST_SIZE:
+            raise ValueError('Digest table size %u is not a multiple of %u'
+                             % (len(digests), DIGEST_SIZE))
+        self._digests = digests
+
+    @classmethod
+    def from_fd(cls, fd, chunk_size, size):
+        """Hash the first size bytes of the file open as fd."""
+        assert HASH_BLOCK_SIZE % chunk_size == 0
+        digests = []
+        for pos in xrange(0, size, HASH_BLOCK_SIZE):
+            block = pread(fd, min(HASH_BLOCK_SIZE, size - pos), pos)
+            for i in xrange(0, len(block), chunk_size):
+                digests.append(digest_chunk(block[i:i + chunk_size]))
+        return cls(b''.join(digests))
+
+    def __len__(self):
+        return len(self._digests) // DIGEST_SIZE
+
+    def __getitem__(self, n):
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        return self._digests[n * DIGEST_SIZE:(n + 1) * DIGEST_SIZE]
+
+    def to_bytes(self):
+        return self._digests
+
+    def verify(self, n, data):
+        return n < len(self) and digest_chunk(data) == self[n]
+
+
+def verify_part_file(filename, digests, chunk_size, indexes):
+    """
+    Check the chunks with the given indexes of a partially downloaded file.
+
+    Returns the list of those which do not match their digest (including
+    any which are missing from the file).
+    """
+    try:
+        fd = os.open(filename, os.O_RDONLY)
+    except EnvironmentError as e:
+        logger.warning('Could not open ‘%s’ to verify it: %s', filename, e)
+        return list(indexes)
+
+    corrupt = []
+    try:
+        for n in indexes:
+            if not digests.verify(n, pread(fd, chunk_size, n * chunk_size)):
+                corrupt.append(n)
+    finally:
+        os.close(fd)
+    return corrupt
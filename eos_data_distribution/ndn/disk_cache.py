@@ -0,0 +1,396 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import errno
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from gi.repository import GLib
+
+from .iopool import IOQueue, get_default_io_pool
+from .pread import pread
+from .pwritev import pwritev
+from .segments import CommitQueue, File as SegmentsFile, SegmentMap
+from .utils import singleton
+from ..defaults import SegmentState
+
+logger = logging.getLogger(__name__)
+
+DISK_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+# Number of entries whose files are kept open at once.
+MAX_OPEN_ENTRIES = 64
+# Number of chunks written to an entry between syncs of its segment table.
+COMMIT_CHUNKS = 64
+
+
+def _unlink(filename):
+    try:
+        os.unlink(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _write_chunk(fd, commit_queue, n, buf, offs, segments):
+    pwritev(fd, [buf], offs)
+    commit_queue.add(n, segments)
+
+
+def _close_files(fd, segments_file, commit_queue, segments):
+    try:
+        commit_queue.commit(segments)
+    finally:
+        segments_file.close()
+        os.close(fd)
+
+
+class CacheEntry(object):
+
+    """
+    The chunks of the content at one URL, cached in a sparse file.
+
+    Which chunks are present is kept in a segment table next to it (see
+    ``segments.File``), so that they survive restarts; the URL, size and
+    chunk size are kept in a .meta file. The files are only open while the
+    entry is among the most recently used ones of its ``DiskCache``.
+
+    If the cache has an `io_pool`, chunks are read and written, and the
+    files synced and closed, from it, in order; a chunk is only found by
+    ``get()`` once it is written.
+
+    If the files cannot be opened, the entry is treated as empty: nothing
+    is found in it, and nothing written to it.
+    """
+
+    def __init__(self, cache, path, url, size, chunk_size, disk_usage=0):
+        self.url = url
+        self.size = size
+        self.chunk_size = chunk_size
+        self.disk_usage = disk_usage
+        self.removed = False
+
+        self._cache = cache
+        self._path = path
+        self._fd = -1
+        self._segments_file = None
+        self._segments = None
+        self._commit_queue = None
+        self._io_queue = (IOQueue(cache.io_pool)
+                          if cache.io_pool is not None else None)
+        # Jobs closing the files, which must be done before they are opened
+        # again, as the segment table is locked until then.
+        self._closing = 0
+
+    @property
+    def num_segments(self):
+        return self.size // self.chunk_size + 1
+
+    def _meta(self):
+        return {'url': self.url, 'size': self.size,
+                'chunk_size': self.chunk_size}
+
+    def _chunk_length(self, n):
+        return max(0, min(self.chunk_size, self.size - n * self.chunk_size))
+
+    def _run_io(self, func, args=(), callback=None, errback=None):
+        # Run func on our I/O queue if we have one, or right away otherwise.
+        if self._io_queue is not None:
+            return self._io_queue.submit(func, args, callback, errback)
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            if errback is None:
+                raise
+            logger.exception('I/O job %s failed', func)
+            return errback(e)
+        if callback is not None:
+            callback(result)
+
+    def _open(self):
+        if self._fd >= 0:
+            return True
+        if self.removed or self._closing:
+            return False
+
+        try:
+            self._open_files()
+        except (IOError, OSError) as e:
+            # In use elsewhere, out of space, or the like.
+            logger.info('cannot open the cache entry for %s: %s',
+                        self.url, e)
+            return False
+
+        self._commit_queue = CommitQueue(self._segments_file, self._fd,
+                                         COMMIT_CHUNKS)
+        self._cache._opened(self)
+        return True
+
+    def _open_files(self):
+        segments_file = SegmentsFile(self._path)
+        fd = -1
+        try:
+            try:
+                segments = segments_file.read()
+            except ValueError:
+                segments = None
+            if segments is not None and len(segments) != self.num_segments:
+                segments = None
+
+            fd = os.open(self._path, os.O_CREAT | os.O_RDWR, 0o600)
+            if segments is None:
+                os.ftruncate(fd, 0)
+                segments = SegmentMap(self.num_segments)
+                self._cache._account(self, -self.disk_usage)
+                with open(self._path + '.meta', 'w') as f:
+                    json.dump(self._meta(), f)
+        except Exception:
+            if fd >= 0:
+                os.close(fd)
+            segments_file.close()
+            raise
+
+        self._segments_file = segments_file
+        self._fd = fd
+        self._segments = segments
+
+    def close(self):
+        if self._fd < 0:
+            return
+
+        self._closing += 1
+        self._run_io(_close_files, (self._fd, self._segments_file,
+                                    self._commit_queue, self._segments),
+                     self._on_closed, self._on_closed)
+        self._fd = -1
+        self._segments_file = None
+        self._segments = None
+        self._commit_queue = None
+
+    def _on_closed(self, result):
+        self._closing -= 1
+
+    def remove(self):
+        # Unlink the files right away, so that a new entry for the URL
+        # starts afresh; writes still queued go to the old ones.
+        self.close()
+        self.removed = True
+        for filename in (self._path, self._path + '.sgt',
+                         self._path + '.meta'):
+            _unlink(filename)
+
+    def get(self, n, callback):
+        """Call callback with chunk n, or None if it is not cached."""
+        if not self._open() or self._segments[n] != SegmentState.COMPLETE:
+            self._cache.misses += 1
+            return callback(None)
+
+        self._cache._touch(self)
+        self._run_io(pread, (self._fd, self.chunk_size, n * self.chunk_size),
+                     lambda buf: self._on_chunk_read(buf, callback),
+                     lambda error: self._on_chunk_read(None, callback))
+
+    def _on_chunk_read(self, buf, callback):
+        if buf is None:
+            self._cache.misses += 1
+        else:
+            self._cache.hits += 1
+        callback(buf)
+
+    def put(self, n, buf):
+        """
+        Write chunk n through to the cache.
+
+        Only chunks of the expected length are kept: chunk_size bytes, or
+        the rest of the content for the last one.
+        """
+        length = self._chunk_length(n)
+        if len(buf) != length or not length:
+            logger.debug('not caching chunk %d of %s: %d bytes, expected %d',
+                         n, self.url, len(buf), length)
+            return
+        if not self._open() or self._segments[n] != SegmentState.UNSENT:
+            return
+
+        if isinstance(buf, memoryview):
+            buf = buf.tobytes()
+        else:
+            buf = bytes(buf)
+
+        segments = self._segments
+        segments[n] = SegmentState.OUTGOING
+        self._run_io(_write_chunk,
+                     (self._fd, self._commit_queue, n, buf,
+                      n * self.chunk_size, segments),
+                     lambda result: self._on_chunk_written(segments, n),
+                     lambda error: self._on_chunk_failed(segments, n))
+        self._cache._touch(self)
+        self._cache._account(self, len(buf))
+
+    def _on_chunk_written(self, segments, n):
+        # segments is the map of the files the chunk was written to, even if
+        # the entry has been closed since.
+        segments[n] = SegmentState.COMPLETE
+
+    def _on_chunk_failed(self, segments, n):
+        segments[n] = SegmentState.UNSENT
+
+
+class DiskCache(object):
+
+    """
+    Read-through cache on disk of content fetched by URL.
+
+    Each URL gets a ``CacheEntry``, made with ``entry()``. Entries already
+    on disk are found again when the cache is created, so content fetched
+    by an earlier run is not fetched again. Content at a URL is assumed not
+    to change, as for the content-addressed shard URLs we fetch: only its
+    size is checked.
+
+    Once the chunks stored take more than `max_bytes` on disk, the least
+    recently used entries are removed. The ``hits``, ``misses`` and
+    ``evictions`` counters are kept as by ``cache.LRUCache``.
+
+    If an `io_pool` is given, reads and writes of the entries are made from
+    it rather than on the main loop.
+    """
+
+    def __init__(self, directory, max_bytes=DISK_CACHE_SIZE,
+                 max_open=MAX_OPEN_ENTRIES, io_pool=None):
+        assert max_bytes > 0 and max_open > 0
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.io_pool = io_pool
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._open_entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o755)
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def _path(self, url):
+        return os.path.join(self.directory,
+                            hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _load(self):
+        found = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.meta'):
+                continue
+
+            path = os.path.join(self.directory, filename[:-len('.meta')])
+            try:
+                with open(path + '.meta') as f:
+                    meta = json.load(f)
+                st = os.stat(path)
+            except (IOError, OSError, ValueError):
+                logger.debug('dropping broken cache entry %s', path)
+                for name in (path, path + '.sgt', path + '.meta'):
+                    _unlink(name)
+                continue
+
+            entry = CacheEntry(self, path, meta['url'], meta['size'],
+                               meta['chunk_size'],
+                               disk_usage=st.st_blocks * 512)
+            found.append((st.st_mtime, entry))
+
+        # Oldest first, as though they had been used in that order.
+        for mtime, entry in sorted(found, key=lambda f: f[0]):
+            self._entries[entry.url] = entry
+            self.size += entry.disk_usage
+        self._evict()
+
+    def lookup(self, url):
+        """Return the entry of url, or None."""
+        return self._entries.get(url)
+
+    def entry(self, url, size, chunk_size):
+        """Return the entry of url, starting a new one if needed."""
+        entry = self._entries.get(url)
+        if entry is not None:
+            if entry.size == size and entry.chunk_size == chunk_size:
+                self._touch(entry)
+                return entry
+            logger.info('cached size of %s changed, dropping it', url)
+            self._remove(entry)
+
+        entry = self._entries[url] = CacheEntry(self, self._path(url), url,
+                                                size, chunk_size)
+        return entry
+
+    def _touch(self, entry):
+        self._entries[entry.url] = self._entries.pop(entry.url)
+        if entry.url in self._open_entries:
+            self._open_entries[entry.url] = self._open_entries.pop(entry.url)
+
+    def _opened(self, entry):
+        self._open_entries[entry.url] = entry
+        while len(self._open_entries) > self.max_open:
+            url, oldest = self._open_entries.popitem(last=False)
+            oldest.close()
+
+    def _account(self, entry, size):
+        entry.disk_usage += size
+        self.size += size
+        self._evict()
+
+    def _remove(self, entry):
+        del self._entries[entry.url]
+        self._open_entries.pop(entry.url, None)
+        self.size -= entry.disk_usage
+        entry.remove()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            url, oldest = next(iter(self._entries.items()))
+            logger.debug('evicting %s from the disk cache', url)
+            self._remove(oldest)
+            self.evictions += 1
+
+    def close(self):
+        for entry in list(self._open_entries.values()):
+            entry.close()
+        self._open_entries.clear()
+
+
+@singleton
+def get_default_disk_cache():
+    return DiskCache(os.path.join(GLib.get_user_cache_dir(),
+                                  'eos-data-distribution', 'http'),
+                     io_pool=get_default_io_pool())
@@ -0,0 +1,223 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import logging
+
+from .dbus import chunks
+from ..defaults import RouteCost
+from ..names import Name
+
+logger = logging.getLogger(__name__)
+
+dispatcher_instances = dict()
+
+
+class _TrieNode(object):
+
+    __slots__ = ('children', 'value', 'has_value')
+
+    def __init__(self):
+        self.children = dict()
+        self.value = None
+        self.has_value = False
+
+
+class NameTrie(object):
+
+    """
+    Map names to values, matching names against their longest prefix.
+
+    Names are split into their components, so ``/a/b`` is a prefix of
+    ``/a/b/c`` but not of ``/a/bc``.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _find(self, name):
+        node = self._root
+        for component in Name(name):
+            node = node.children.get(component)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, name):
+        node = self._find(name)
+        return node is not None and node.has_value
+
+    def __getitem__(self, name):
+        node = self._find(name)
+        if node is None or not node.has_value:
+            raise KeyError(name)
+        return node.value
+
+    def __setitem__(self, name, value):
+        node = self._root
+        for component in Name(name):
+            node = node.children.setdefault(component, _TrieNode())
+        if not node.has_value:
+            self._size += 1
+        node.value = value
+        node.has_value = True
+
+    def __delitem__(self, name):
+        # Remember the path down, to prune the nodes left empty.
+        path = [(None, self._root)]
+        for component in Name(name):
+            node = path[-1][1].children.get(component)
+            if node is None:
+                raise KeyError(name)
+            path.append((component, node))
+
+        node = path[-1][1]
+        if not node.has_value:
+            raise KeyError(name)
+        node.value = None
+        node.has_value = False
+        self._size -= 1
+
+        for i in range(len(path) - 1, 0, -1):
+            component, node = path[i]
+            if node.has_value or node.children:
+                break
+            del path[i - 1][1].children[component]
+
+    def longest_prefix(self, name):
+        """Return the value of the longest prefix of name, or None."""
+        node = self._root
+        value = node.value if node.has_value else None
+        for component in Name(name):
+            node = node.children.get(component)
+            if node is None:
+                break
+            if node.has_value:
+                value = node.value
+        return value
+
+
+class Dispatcher(chunks.Producer):
+
+    """
+    Answer for all the names under a prefix on behalf of other producers.
+
+    Registering a prefix per producer costs a round trip each, and an
+    entry in the routing table. Producers given a dispatcher add themselves
+    to it instead, in ``registerPrefix()``: it is the only one to register
+    its prefix, and routes each request to the producer with the longest
+    name matching it, found in a ``NameTrie``.
+
+    Several producers may be added for the same name, for instance by two
+    stores sharing the dispatcher: requests go to the cheapest of them.
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        super(Dispatcher, self).__init__(name, *args, **kwargs)
+        self._producers = NameTrie()
+
+    def __len__(self):
+        return len(self._producers)
+
+    def add(self, producer):
+        logger.debug('dispatching %s', producer.name)
+        try:
+            producers = self._producers[producer.name]
+        except KeyError:
+            producers = self._producers[producer.name] = []
+        if producer not in producers:
+            producers.append(producer)
+            producers.sort(key=_get_cost)
+
+    def remove(self, producer):
+        producers = self._producers[producer.name]
+        producers.remove(producer)
+        if not producers:
+            del self._producers[producer.name]
+
+    def set_cost(self, cost):
+        """
+        Lower the cost of the dispatcher to cost, if that is cheaper.
+
+        Its prefix is registered again if it already was, so that the new
+        cost takes effect.
+        """
+        if cost is None or _get_cost(self) <= cost:
+            return
+
+        if not self.registered:
+            self.cost = cost
+            return
+
+        self.removeRegisteredPrefix()
+        self.cost = cost
+        self.registerPrefix()
+
+    def _lookup(self, name):
+        producers = self._producers.longest_prefix(name)
+        if producers is None:
+            logger.debug('no producer for %s under %s', name, self.name)
+        return producers
+
+    def _on_request_interest(self, name, skeleton, *args, **kwargs):
+        producers = self._lookup(name)
+        if producers is None:
+            self._dbus.return_error(name, 'TryAgain')
+            return False
+        return producers[0]._on_request_interest(name, skeleton, *args,
+                                                 **kwargs)
+
+    def _on_complete(self, name, skeleton):
+        producers = self._lookup(name)
+        if producers is None:
+            return False
+        # Go back to the producer which answered the request, even if a
+        # cheaper one was added since.
+        key = name.toString()
+        producer = next((p for p in producers if key in p._workers),
+                        producers[0])
+        return producer._on_complete(name, skeleton)
+
+
+def _get_cost(producer):
+    if producer.cost is None:
+        return RouteCost.DEFAULT
+    return producer.cost
+
+
+def get_dispatcher(prefix, cost=None, *args, **kwargs):
+    """
+    Return the process-wide dispatcher for prefix, starting it if needed.
+
+    A dispatcher shared by several callers takes on the lowest of their
+    costs, as it answers for each of them (see ``Dispatcher.set_cost()``).
+    """
+    key = Name(prefix).toString()
+    try:
+        dispatcher = dispatcher_instances[key]
+    except KeyError:
+        dispatcher = dispatcher_instances[key] = Dispatcher(
+            Name(prefix), cost=cost, *args, **kwargs)
+        dispatcher.start()
+        return dispatcher
+
+    dispatcher.set_cost(cost)
+    return dispatcher
@@ -0,0 +1,35 @@
+import ctypes
+import ctypes.util
+import os
+
+POSIX_FADV_NORMAL = 0
+POSIX_FADV_RANDOM = 1
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+
+
+def _fadvise():
+    try:
+        return os.posix_fadvise
+    except AttributeError:
+        pass
+
+    libc_name = ctypes.util.find_library('c')
+    libc = ctypes.CDLL(libc_name)
+
+    raw_fadvise = libc.posix_fadvise
+    raw_fadvise.restype = ctypes.c_int
+    raw_fadvise.argtypes = [
+        ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+
+    def fadvise(fd, offs, size, advice):
+        # posix_fadvise() returns the error number rather than setting errno.
+        ret = raw_fadvise(fd, offs, size, advice)
+        if ret != 0:
+            raise IOError(ret, os.strerror(ret))
+
+    return fadvise
+
+fadvise = _fadvise()
+del _fadvise
@@ -3,42 +3,379 @@
 import errno
 import gi
 import logging
+import mmap
 import os
+from collections import OrderedDict
 
 gi.require_version('Gio', '2.0')
+gi.require_version('GLib', '2.0')
 from gi.repository import Gio
+from gi.repository import GObject
+from gi.repository import GLib
 
 from . import fallocate
+from .cache import get_default_chunk_cache
 from .dbus import chunks
-from .segments import File as SegmentsFile
+from .digests import (DIGEST_SIZE, DIGESTS_COMPONENT, DigestTable,
+                      verify_part_file)
+from .fadvise import fadvise, POSIX_FADV_SEQUENTIAL, POSIX_FADV_WILLNEED
+from .iopool import IOQueue, get_default_io_pool
+from .pread import pread
+from .segments import ChunkWriter, CommitQueue, File as SegmentsFile
+from .utils import singleton
+from ..defaults import SegmentState
+from ..names import Name
 
 logger = logging.getLogger(__name__)
 
+# Saved chunks are recorded in the segment table in batches: once this many
+# are pending, or this many milliseconds after the first of them was saved,
+# whichever comes first.
+FLUSH_CHUNKS = 256
+FLUSH_INTERVAL = 1000
+
+# Saved chunks are buffered, and written out in runs of contiguous chunks
+# once this many bytes of them are pending (or on flush).
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Once this many consecutive chunks of a file have been requested, its
+# producer reads ahead of the requests in blocks of READAHEAD_SIZE bytes.
+SEQUENTIAL_THRESHOLD = 4
+READAHEAD_SIZE = 1024 * 1024
+
+# When resuming a verified download, the chunks already in the .part file
+# are checked again in batches of this many.
+REVERIFY_BATCH = 256
+
 
 def get_file_size(f):
     f.seek(0, os.SEEK_END)
     return f.tell()
 
 
+def get_map_slice(m, offs, size):
+    """Return a zero-copy memoryview of size bytes of the mmap m at offs."""
+    try:
+        # On Python 2, mmap only has the old buffer interface, which
+        # memoryview cannot wrap directly.
+        return memoryview(buffer(m, offs, size))
+    except NameError:
+        return memoryview(m)[offs:offs + size]
+
+
+class SequentialStream(object):
+    def __init__(self):
+        self.run = 0
+        self.readahead_end = 0
+
+
+class SequentialDetector(object):
+
+    """
+    Spot sequential runs in the chunk requests for a file.
+
+    Requests from several consumers interleave, so up to `max_streams` runs
+    are tracked at once, keyed by the next chunk each of them expects.
+    """
+
+    def __init__(self, threshold=SEQUENTIAL_THRESHOLD, max_streams=16):
+        self._threshold = threshold
+        self._max_streams = max_streams
+        self._streams = OrderedDict()
+
+    def add(self, n):
+        """
+        Record a request for chunk n.
+
+        Returns its ``SequentialStream`` if the request continues a run of at
+        least `threshold` chunks, or None otherwise.
+        """
+        stream = self._streams.pop(n, None) or SequentialStream()
+        stream.run += 1
+        self._streams[n + 1] = stream
+
+        while len(self._streams) > self._max_streams:
+            self._streams.popitem(last=False)
+
+        if stream.run < self._threshold:
+            return None
+        return stream
+
+
 class FileProducer(chunks.Producer):
 
-    def __init__(self, name, file, *args, **kwargs):
-        super(FileProducer, self).__init__(name, *args, **kwargs)
+    """
+    Produce chunks of the content of a file.
+
+    The file is memory-mapped once, and chunks are handed out as memoryviews
+    of the mapping, without copying or any syscall per chunk. If the file
+    cannot be mapped (as on some FUSE filesystems), or `use_mmap` is False,
+    chunks are read with pread() through `cache`, a ``ChunkCache`` (by
+    default, the one shared by all producers in the process).
+
+    When chunks are requested sequentially, the producer reads ahead in
+    blocks of `readahead_size` bytes: into the cache when reading with
+    pread(), or by advising the kernel to page them in when mapped.
+
+    If an `io_pool` is given, the pread() calls are made on it, off the main
+    loop, by ``_get_chunk_async()``.
+
+    If `publish_digests` is True, the file's ``DigestTable`` is also
+    published, by a ``DigestsProducer``, so consumers can verify its chunks.
+    """
+
+    def __init__(self, name, file, use_mmap=True, cache=None,
+                 readahead_size=READAHEAD_SIZE, io_pool=None,
+                 publish_digests=False, *args, **kwargs):
+        super(FileProducer, self).__init__(name, io_pool=io_pool,
+                                           *args, **kwargs)
         self.name = name
         self.f = file
         self._file_size = get_file_size(self.f)
+        self._map = None
+        assert readahead_size % self.chunk_size == 0
+        self._cache = cache
+        self._readahead_size = readahead_size
+        self._detector = SequentialDetector()
+        self._advised_sequential = False
+        self._publish_digests = publish_digests
+        self._digests = None
+        self._digests_producer = None
+
+        st = os.fstat(self.f.fileno())
+        self._cache_key = (st.st_dev, st.st_ino)
+
+        if use_mmap and self._file_size > 0:
+            try:
+                self._map = mmap.mmap(self.f.fileno(), self._file_size,
+                                      access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError) as e:
+                logger.info('Could not map ‘%s’, falling back to pread: %s',
+                            getattr(self.f, 'name', self.f), e)
+
+        if self._map is None and self._cache is None:
+            self._cache = get_default_chunk_cache()
+
+    def start(self):
+        super(FileProducer, self).start()
+
+        if self._publish_digests:
+            self._digests_producer = DigestsProducer(
+                self, cost=self.cost, dispatcher=self._dispatcher)
+            self._digests_producer.start()
+
+    def removeRegisteredPrefix(self, prefix=None):
+        super(FileProducer, self).removeRegisteredPrefix(prefix)
+        if self._digests_producer is not None:
+            self._digests_producer.removeRegisteredPrefix()
+
+    def get_digests(self):
+        """Return the file's ``DigestTable``, hashing it on first use."""
+        if self._digests is None:
+            self._digests = self._compute_digests()
+        return self._digests
+
+    def _compute_digests(self):
+        return DigestTable.from_fd(self.f.fileno(), self.chunk_size,
+                                   self._file_size)
 
     def _get_final_segment(self):
         return ((self._file_size + self.chunk_size - 1) // self.chunk_size) - 1
 
     def _get_chunk(self, n):
+        chunk, size = self._lookup_chunk(n)
+        if size:
+            block = pread(self.f.fileno(), size, self.chunk_size * n)
+            chunk = self._cache_block(n, size, block)
+        return chunk
+
+    def _get_chunk_async(self, n, callback, errback=None):
+        if self._io_pool is None:
+            return callback(self._get_chunk(n))
+
+        chunk, size = self._lookup_chunk(n)
+        if not size:
+            return callback(chunk)
+
+        # Only the read itself happens off the main loop: the cache and the
+        # sequential detector are not thread safe.
+        self._io_pool.submit(
+            pread, (self.f.fileno(), size, self.chunk_size * n),
+            lambda block: callback(self._cache_block(n, size, block)),
+            errback)
+
+    def _lookup_chunk(self, n):
+        """
+        Look chunk n up without reading the file.
+
+        Returns a (chunk, size) pair: if size is non-zero, the chunk has to be
+        read, along with the rest of the size bytes from its start, and passed
+        to ``_cache_block()``.
+        """
         pos = self.chunk_size * n
 
         if pos >= self._file_size:
+            return (None, 0)
+
+        stream = self._detector.add(n)
+        if stream is not None and not self._advised_sequential:
+            self._advise(0, 0, POSIX_FADV_SEQUENTIAL)
+            self._advised_sequential = True
+
+        if self._map is not None:
+            if stream is not None:
+                self._advise_readahead(stream, pos)
+            size = min(self.chunk_size, self._file_size - pos)
+            return (get_map_slice(self._map, pos, size), 0)
+
+        chunk = self._cache.get((self._cache_key, n))
+        if chunk is not None:
+            return (chunk, 0)
+
+        if stream is None:
+            return (None, self.chunk_size)
+
+        # Read a whole block with one syscall, which slow flash media handle
+        # far better than interleaved chunk-sized reads.
+        return (None, self._readahead_size)
+
+    def _advise(self, offs, size, advice):
+        try:
+            fadvise(self.f.fileno(), offs, size, advice)
+        except IOError as e:
+            logger.debug('posix_fadvise(%u, %u, %u) failed: %s',
+                         offs, size, advice, e)
+
+    def _advise_readahead(self, stream, pos):
+        # Ask for the next block once half of the current one has been
+        # consumed, so the kernel reads it while we serve the rest.
+        if pos + self._readahead_size // 2 < stream.readahead_end:
+            return
+
+        start = max(pos, stream.readahead_end)
+        stream.readahead_end = pos + self._readahead_size
+        self._advise(start, stream.readahead_end - start, POSIX_FADV_WILLNEED)
+
+    def _cache_block(self, n, size, block):
+        # Cache the chunks of block, read from the start of chunk n, and
+        # return chunk n.
+        if size <= self.chunk_size:
+            self._cache.put((self._cache_key, n), block)
+            return block
+
+        pos = self.chunk_size * n
+        self._cache.readaheads += 1
+
+        for i in xrange(0, len(block), self.chunk_size):
+            self._cache.put((self._cache_key, n + i // self.chunk_size),
+                            block[i:i + self.chunk_size])
+
+        # Have the kernel fetch the following block in the background.
+        self._advise(pos + len(block), self._readahead_size,
+                     POSIX_FADV_WILLNEED)
+
+        return block[:self.chunk_size]
+
+
+class DigestsProducer(chunks.Producer):
+
+    """
+    Produce the ``DigestTable`` of the file served by a ``FileProducer``.
+
+    It is published under the file's name with ``DIGESTS_COMPONENT``
+    appended. The table is only computed when first requested; on the file
+    producer's IOPool, if it has one.
+    """
+
+    def __init__(self, file_producer, *args, **kwargs):
+        self._file_producer = file_producer
+        name = Name(file_producer.name).append(DIGESTS_COMPONENT)
+        super(DigestsProducer, self).__init__(
+            name, io_pool=file_producer._io_pool, *args, **kwargs)
+
+    def _get_final_segment(self):
+        size = (self._file_producer._get_final_segment() + 1) * DIGEST_SIZE
+        return ((size + self.chunk_size - 1) // self.chunk_size) - 1
+
+    def _get_chunk(self, n):
+        table = self._file_producer.get_digests().to_bytes()
+        pos = self.chunk_size * n
+        if pos >= len(table):
             return None
+        return table[pos:pos + self.chunk_size]
+
+    def _get_chunk_async(self, n, callback, errback=None):
+        file_producer = self._file_producer
+        if self._io_pool is None or file_producer._digests is not None:
+            return callback(self._get_chunk(n))
+
+        def on_digests(table):
+            if file_producer._digests is None:
+                file_producer._digests = table
+            callback(self._get_chunk(n))
+
+        self._io_pool.submit(file_producer._compute_digests, (), on_digests,
+                             errback)
+
+
+class DigestsConsumer(chunks.Consumer):
+
+    """Retrieve the ``DigestTable`` published by a ``DigestsProducer``."""
+
+    def __init__(self, name, *args, **kwargs):
+        super(DigestsConsumer, self).__init__(name, *args, **kwargs)
+        self._chunks = dict()
+
+    def _save_chunk(self, n, data):
+        self._chunks[n] = bytes(data)
+        return True
+
+    def get_digests(self):
+        return DigestTable(b''.join(self._chunks[n]
+                                    for n in sorted(self._chunks)))
+
+
+class DownloadRegistry(object):
+
+    """
+    Downloads in progress in this process, keyed by (name, destination).
+
+    A consumer which is asked to download something another consumer in the
+    process is already downloading to the same place attaches to that one
+    rather than competing with it for the segment table lock.
+    """
+
+    def __init__(self):
+        self._downloads = dict()
+
+    @staticmethod
+    def _key(name, filename):
+        return (str(name), os.path.realpath(filename))
+
+    def get(self, name, filename):
+        return self._downloads.get(self._key(name, filename))
+
+    def add(self, name, filename, consumer):
+        self._downloads[self._key(name, filename)] = consumer
+
+    def remove(self, name, filename, consumer):
+        key = self._key(name, filename)
+        if self._downloads.get(key) is consumer:
+            del self._downloads[key]
+
 
-        self.f.seek(pos, os.SEEK_SET)
-        return self.f.read(self.chunk_size)
+@singleton
+def get_download_registry():
+    return DownloadRegistry()
+
+
+def write_chunks(writer, commit_queue, segments, commit):
+    # Only chunks which have actually been written out may be committed to
+    # the segment table.
+    for n in writer.flush():
+        commit_queue.add(n, segments)
+    if commit:
+        commit_queue.commit(segments)
 
 
 def mkdir_p(dirname):
@@ -56,11 +393,72 @@ def mkdir_p(dirname):
 
 class Consumer(chunks.Consumer):
 
-    def __init__(self, *args, **kwargs):
-        super(Consumer, self).__init__(*args, **kwargs)
+    """
+    Retrieve some named content into a file.
+
+    Chunks are buffered and written out in batches, then recorded in the
+    segment table (see ``segments.ChunkWriter`` and ``segments.CommitQueue``)
+    so that an interrupted download can be resumed.
+
+    If an `io_pool` is given, all the writes, syncs and renames are done on
+    it, in order, rather than on the main loop.
+
+    If `verify` is True, or a ``DigestTable`` is given as `digests`, each
+    chunk is checked against its digest (on `io_pool`, or the default
+    IOPool) before being written, and chunks which do not match are fetched
+    again. Without `digests`, the table is first fetched from the producer.
+    When resuming, the chunks already in the .part file are checked too, in
+    the background, rather than trusting the segment table.
+
+    Only one consumer in a process downloads a given name to a given file:
+    any others started meanwhile attach to it (see ``DownloadRegistry``),
+    and relay its progress and completion.
+
+    If the file cannot be finished, 'failed' is emitted with the error
+    instead of 'complete', and the download is left to be resumed.
+    """
+
+    __gsignals__ = {
+        'failed': (GObject.SIGNAL_RUN_FIRST, None, (object, )),
+    }
+
+    _filename = None
+
+    def __init__(self, name, flush_chunks=FLUSH_CHUNKS,
+                 flush_interval=FLUSH_INTERVAL,
+                 write_buffer_size=WRITE_BUFFER_SIZE, io_pool=None,
+                 verify=False, digests=None, *args, **kwargs):
+        super(Consumer, self).__init__(name, *args, **kwargs)
 
         self._part_filename = None
         self._part_fd = -1
+        self._segments_file = None
+
+        self._flush_chunks = flush_chunks
+        self._flush_interval = flush_interval
+        self._flush_timeout_id = 0
+        self._write_buffer_size = write_buffer_size
+        self._writer = None
+        self._commit_queue = None
+
+        self._io_pool = io_pool
+        self._io_queue = IOQueue(io_pool) if io_pool is not None else None
+
+        self._verify = verify or digests is not None
+        self._digests = digests
+        self._digests_consumer = None
+        self._verify_pool = io_pool or get_default_io_pool()
+        # Number of verification jobs in flight, which completion waits for.
+        self._verifying = 0
+        self._deferred_complete = None
+        self._reverified = False
+
+        self._registry = get_download_registry()
+        self._registered_filename = None
+        # The consumer we are attached to, and the ones attached to us.
+        self._owner = None
+        self._owner_progress_id = 0
+        self._followers = []
 
         # If we attempt to start downloading a file in parallel with another
         # Consumer, stop downloading and monitor the other consumer's progress
@@ -73,57 +471,373 @@ class Consumer(chunks.Consumer):
     def _open_files(self):
         raise NotImplementedError()
 
+    def start(self):
+        if self._filename is not None:
+            if self._attach(self._filename):
+                return
+            if not self._lock_segments_file(self._filename):
+                return
+
+        if self._verify and self._digests is None:
+            self._fetch_digests()
+        else:
+            super(Consumer, self).start()
+
+    def _attach(self, filename):
+        """
+        Attach to another consumer downloading filename in this process.
+
+        Returns True if there is one; otherwise, registers this consumer as
+        downloading it and returns False.
+        """
+        if self._owner is not None:
+            return True
+
+        owner = self._registry.get(self.name, filename)
+        if owner is None or owner is self:
+            self._registry.add(self.name, filename, self)
+            self._registered_filename = filename
+            return False
+
+        logger.debug('Attaching to the download of ‘%s’ in progress',
+                     filename)
+        self._owner = owner
+        self._owner_progress_id = owner.connect(
+            'progress', lambda owner, progress: self.emit('progress',
+                                                          progress))
+        owner._followers.append(self)
+        return True
+
+    def _lock_segments_file(self, filename):
+        """
+        Open and lock the segment table of filename, resuming from it if
+        this consumer has no segments yet.
+
+        Returns False if another process holds the lock, after starting to
+        watch for that download to complete.
+        """
+        if self._segments_file is not None:
+            return True
+        if self._completion_monitor is not None:
+            return False
+
+        # we need to make the dir early, so that the sgt file can be created
+        mkdir_p(os.path.dirname(filename))
+        try:
+            self._segments_file = SegmentsFile(filename)
+        except IOError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+            # Cannot acquire lock: some other process is already downloading
+            # it. Watch that file for completion.
+            logger.debug('File ‘%s.sgt’ is locked: waiting on completion.',
+                         filename)
+            self._watch_for_completion(filename)
+            return False
+
+        # If we have an existing download to resume, use that. Otherwise,
+        # request the first segment to bootstrap us.
+        try:
+            segments = self._segments_file.read()
+        except ValueError:
+            return True
+        if self._segments is None:
+            self._segments = segments
+        return True
+
+    def _detach(self):
+        self._owner.disconnect(self._owner_progress_id)
+        self._owner_progress_id = 0
+        self._owner._followers.remove(self)
+        self._owner = None
+
+    def _unregister(self):
+        if self._registered_filename is not None:
+            self._registry.remove(self.name, self._registered_filename, self)
+            self._registered_filename = None
+
+    def _on_owner_complete(self):
+        self._detach()
+        self._emitted_complete = True
+        self.emit('complete')
+
+    def _on_owner_closed(self):
+        # The download was stopped before completing: take it over.
+        self._detach()
+        self.start()
+
+    def _fetch_digests(self):
+        consumer = DigestsConsumer(Name(self.name).append(DIGESTS_COMPONENT))
+        consumer.connect('complete', self._on_digests_complete)
+        self._digests_consumer = consumer
+        consumer.start()
+
+    def _on_digests_complete(self, consumer):
+        self._digests_consumer = None
+        try:
+            self._digests = consumer.get_digests()
+        except ValueError as e:
+            logger.warning('Invalid digest table for ‘%s’, not verifying it: %s',
+                           self.name, e)
+            self._verify = False
+
+        super(Consumer, self).start()
+
+    def _check_digests(self):
+        # Producers which do not publish digests may answer for the digest
+        # table's name anyway; don't fail every chunk because of that.
+        if self._digests is not None and len(self._digests) != self._num_segments:
+            logger.warning('Digest table for ‘%s’ has %u entries, expected %u: '
+                           'not verifying it', self.name, len(self._digests),
+                           self._num_segments)
+            self._digests = None
+        return self._digests is not None
+
     def _save_chunk(self, n, data):
+        if self._owner is not None or self._completion_monitor is not None:
+            # Someone else is downloading the file.
+            return False
+
         if self._part_fd < 0:
             if not self._open_files():
                 return False
 
         assert self._part_fd >= 0
-        offs = self.chunk_size * n
-        os.lseek(self._part_fd, offs, os.SEEK_SET)
-        os.write(self._part_fd, data)
-        self._segments_file.write(self._segments)
+        if not self._check_digests():
+            self._write_chunk(n, data)
+            return True
+
+        self._verifying += 1
+        # A chunk which could not be checked is fetched again, as though it
+        # were corrupt.
+        self._verify_pool.submit(
+            self._digests.verify, (n, data),
+            lambda ok: self._on_chunk_verified(n, data, ok),
+            lambda error: self._on_chunk_verified(n, data, False))
+        return True
+
+    def _on_chunk_verified(self, n, data, ok):
+        self._verifying -= 1
+        if not ok:
+            self._on_corrupt_chunks([n])
+        elif self._writer is not None:
+            self._write_chunk(n, data)
+        self._complete_if_verified()
+
+    def _reverify_part(self):
+        # The segment table only records which chunks were written, not
+        # that they survived: check them again, in the background.
+        if self._reverified or not self._check_digests():
+            return
+        self._reverified = True
+
+        complete = [n for n, state in enumerate(self._segments)
+                    if state == SegmentState.COMPLETE]
+        for i in xrange(0, len(complete), REVERIFY_BATCH):
+            batch = complete[i:i + REVERIFY_BATCH]
+            self._verifying += 1
+            self._verify_pool.submit(
+                verify_part_file,
+                (self._part_filename, self._digests, self.chunk_size, batch),
+                self._on_part_verified,
+                lambda error, batch=batch: self._on_part_verified(batch))
+
+    def _on_part_verified(self, corrupt):
+        self._verifying -= 1
+        if corrupt:
+            self._on_corrupt_chunks(corrupt)
+        self._complete_if_verified()
+
+    def _on_corrupt_chunks(self, indexes):
+        logger.warning('Chunks %s of ‘%s’ do not match their digests: '
+                       'fetching them again', indexes, self.name)
+        for n in indexes:
+            self._segments[n] = SegmentState.UNSENT
+        if self._commit_queue is not None:
+            self._run_io(self._segments_file.mark_incomplete,
+                         (indexes, self._segments))
+
+    def _complete_if_verified(self):
+        if self._deferred_complete is not None and not self._verifying:
+            args, kwargs = self._deferred_complete
+            self._deferred_complete = None
+            self._on_complete(*args, **kwargs)
+
+    def _write_chunk(self, n, data):
+        self._writer.put(n, data)
+        if self._writer.is_full():
+            self._write_out(commit=False)
+
+        if not self._flush_timeout_id:
+            self._flush_timeout_id = GLib.timeout_add(
+                self._flush_interval, self._on_flush_timeout)
 
         return True
 
+    def _run_io(self, func, args=(), callback=None, errback=None):
+        # Run func on our I/O queue if we have one, or right away otherwise.
+        if self._io_queue is not None:
+            return self._io_queue.submit(func, args, callback, errback)
+
+        try:
+            result = func(*args)
+        except Exception as e:
+            if errback is None:
+                raise
+            logger.exception('I/O job %s failed', func)
+            return errback(e)
+        if callback is not None:
+            callback(result)
+
+    def _write_out(self, commit):
+        writer = self._writer
+        self._writer = ChunkWriter(self._part_fd, self.chunk_size,
+                                   self._write_buffer_size)
+        indexes = writer.indexes()
+        self._run_io(write_chunks,
+                     (writer, self._commit_queue, self._segments, commit),
+                     errback=lambda error: self._on_write_failed(indexes,
+                                                                 error))
+
+    def _on_write_failed(self, indexes, error):
+        # Those chunks may not all be on disk: fetch them again, rather than
+        # completing with holes.
+        logger.warning('Writing chunks %s of ‘%s’ failed: %s', indexes,
+                       self.name, error)
+        for n in indexes:
+            self._segments[n] = SegmentState.UNSENT
+
+    def _on_flush_timeout(self):
+        self._flush_timeout_id = 0
+        self.flush()
+        return GLib.SOURCE_REMOVE
+
+    def flush(self):
+        """Record all the chunks saved so far in the segment table."""
+        if self._flush_timeout_id:
+            GLib.source_remove(self._flush_timeout_id)
+            self._flush_timeout_id = 0
+
+        if self._commit_queue is not None:
+            self._write_out(commit=True)
+
+    def close(self):
+        """
+        Stop writing the download, leaving it to be resumed later.
+
+        Everything saved so far is flushed to the segment table first.
+        """
+        if self._owner is not None:
+            return self._detach()
+
+        self._unregister()
+        self.flush()
+        self._writer = None
+        self._commit_queue = None
+
+        segments_file = self._segments_file
+        self._segments_file = None
+
+        if self._part_fd >= 0 or segments_file is not None:
+            self._run_io(self._close_files, (self._part_fd, segments_file),
+                         lambda result: self._on_files_closed(),
+                         lambda error: self._on_files_closed())
+            self._part_fd = -1
+        else:
+            self._on_files_closed()
+
+    def _close_files(self, part_fd, segments_file):
+        if part_fd >= 0:
+            os.close(part_fd)
+        if segments_file is not None:
+            segments_file.close()
+
+    def _on_files_closed(self):
+        # Only hand the download over once the segment table is unlocked.
+        for follower in list(self._followers):
+            follower._on_owner_closed()
+
     def _on_complete(self, *args, **kwargs):
-        os.close(self._part_fd)
+        if self._verifying:
+            # Wait for the last chunks to be verified.
+            self._deferred_complete = (args, kwargs)
+            return
+
+        if not self._segments.is_complete():
+            # Some chunks turned out to be corrupt; fetch them again.
+            self._emitted_complete = False
+            return self.start()
+
+        self.flush()
+        self._writer = None
+        self._commit_queue = None
+
+        part_fd = self._part_fd
         self._part_fd = -1
+        segments_file = self._segments_file
+        self._segments_file = None
 
-        os.rename(self._part_filename, self._filename)
-        os.chmod(self._filename, 0o644)
+        self._run_io(self._finish_files, (part_fd, segments_file),
+                     lambda result: self._on_files_finished(*args, **kwargs),
+                     self._on_finish_failed)
 
-        self._segments_file.close(unlink=True)
+    def _on_files_finished(self, *args, **kwargs):
+        self._unregister()
         super(Consumer, self)._on_complete(*args, **kwargs)
 
+        for follower in list(self._followers):
+            follower._on_owner_complete()
+
+    def _on_finish_failed(self, error):
+        # The download can still be resumed from the .part file.
+        logger.warning('Failed to finish ‘%s’: %s', self.name, error)
+        self._unregister()
+        self.emit('failed', error)
+
+        for follower in list(self._followers):
+            follower._on_owner_closed()
+
+    def _finish_files(self, part_fd, segments_file):
+        os.close(part_fd)
+
+        try:
+            # The callbacks of earlier writes have run by now: if any of
+            # them failed, its chunks are no longer complete.
+            if not self._segments.is_complete():
+                raise IOError(errno.EIO, 'Failed to write all of %s' %
+                              (self._part_filename, ))
+            os.rename(self._part_filename, self._filename)
+            os.chmod(self._filename, 0o644)
+        except Exception:
+            segments_file.close()
+            raise
+
+        segments_file.close(unlink=True)
+
     def _create_files(self, filename):
         # XXX this is racy
         assert filename
+
+        # Another consumer in this process may have started downloading the
+        # same file since; the segment table lock only guards against other
+        # processes.
+        if self._attach(filename):
+            return False
+        if not self._lock_segments_file(filename):
+            return False
+
         logger.debug('Opening files for ‘%s’', filename)
 
-        mkdir_p(os.path.dirname(filename))
         self._part_filename = '%s.part' % (filename, )
         self._part_fd = os.open(
             self._part_filename, os.O_CREAT | os.O_WRONLY | os.O_NONBLOCK, 0o600)
 
-        try:
-            self._segments_file.lock()
-        except IOError as e:
-            # Clean up.
-            os.close(self._part_fd)
-            self._part_fd = -1
-            self._part_filename = None
-
-            if e.errno == errno.EAGAIN:
-                # Cannot acquire lock: some other process (or part of this
-                # process) is already downloading it. Clean up and watch that
-                # file for completion.
-                logger.debug('File ‘%s.sgt’ is locked: waiting on completion.',
-                             filename)
-                self._watch_for_completion(filename)
-                return False
-            else:
-                raise
+        self._writer = ChunkWriter(self._part_fd, self.chunk_size,
+                                   self._write_buffer_size)
+        self._commit_queue = CommitQueue(self._segments_file, self._part_fd,
+                                         self._flush_chunks)
+        self._reverify_part()
 
         # XXX hack
         return True
@@ -191,16 +905,6 @@ class FileConsumer(Consumer):
         self._filename = filename
         super(FileConsumer, self).__init__(name, *args, **kwargs)
 
-        # If we have an existing download to resume, use that. Otherwise,
-        # request the first segment to bootstrap us.
-        try:
-            # we need to make the dir early, so that the sgt file can be created
-            mkdir_p(os.path.dirname(filename))
-            self._segments_file = SegmentsFile(self._filename)
-            self._segments = self._segments_file.read()
-        except ValueError as e:
-            pass
-
     def _open_files(self):
         return self._create_files(self._filename)
 
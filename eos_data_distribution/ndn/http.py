@@ -21,19 +21,31 @@
 import argparse
 import logging
 import bisect
+import weakref
+from collections import OrderedDict, deque
 
 import gi
 gi.require_version('Soup', '2.4')
 
 from gi.repository import Soup
+from gi.repository import GLib
 from gi.repository import GObject
 
 from .dbus import chunks
+from .utils import singleton
 from .. import defaults, utils
 
 logger = logging.getLogger(__name__)
 
-MAX_IN_FLIGHT = 16
+# Number of range requests a Getter keeps in flight at once, and the size of
+# the largest range (in bytes) contiguous queued chunks are merged into.
+MAX_CONCURRENT_REQUESTS = 4
+MAX_RANGE_SIZE = 1024 * 1024
+# Number of requests in flight at once on a Soup session, shared fairly
+# between all the Getters using it.
+MAX_SESSION_REQUESTS = 64
+# How long the headers probed for a URL are reused for, in seconds.
+METADATA_TTL = 60
 
 def make_soup_session():
     session = Soup.Session()
@@ -45,16 +57,184 @@ def make_soup_session():
     return session
 
 
-def fetch_http_headers(session, url):
+@singleton
+def get_default_soup_session():
+    return make_soup_session()
+
+
+class RequestScheduler(object):
+
+    """
+    Share the requests in flight on a Soup session between its Getters.
+
+    At most `max_requests` are in flight at once. When there is room for
+    one more, the Getters with queued chunks take turns, round-robin, to
+    send their next range request, so that one Getter with a long queue
+    cannot starve the others.
+
+    Requests are only sent from an idle callback, so that the chunks queued
+    in one main loop iteration can be merged into ranges.
+    """
+
+    def __init__(self, max_requests=MAX_SESSION_REQUESTS):
+        assert max_requests > 0
+        self.max_requests = max_requests
+        self.in_flight = 0
+        self._ready = deque()
+        self._idle_id = 0
+
+    def wake(self, getter):
+        """Let getter send requests, once it is its turn."""
+        if not getter._scheduled:
+            getter._scheduled = True
+            self._ready.append(getter)
+        if not self._idle_id:
+            self._idle_id = GLib.idle_add(self._on_idle)
+
+    def _on_idle(self):
+        self._idle_id = 0
+        self._dispatch()
+        return GLib.SOURCE_REMOVE
+
+    def done(self, getter):
+        """Account for a completed request of getter."""
+        self.in_flight -= 1
+        if getter._has_work():
+            self.wake(getter)
+        else:
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_requests and self._ready:
+            getter = self._ready.popleft()
+            getter._scheduled = False
+            if not getter._has_work():
+                continue
+
+            getter._start_request()
+            self.in_flight += 1
+            if getter._has_work():
+                getter._scheduled = True
+                self._ready.append(getter)
+
+
+_schedulers = weakref.WeakKeyDictionary()
+
+
+def get_scheduler(session):
+    """Return the RequestScheduler of session."""
+    try:
+        return _schedulers[session]
+    except KeyError:
+        scheduler = _schedulers[session] = RequestScheduler()
+        return scheduler
+
+
+def _make_probe_message(url):
     # XXX: SOMA's subscriptions-frontend doesn't handle HEAD requests yet because S3
     # is a bit silly with signed requests. For now, request a bytes=0-0 range and
     # return the full response_headers.
     msg = Soup.Message.new("GET", url)
     msg.request_headers.append('Range', 'bytes=0-0')
+    return msg
+
+
+def fetch_http_headers(session, url):
+    msg = _make_probe_message(url)
     session.send(msg, None)
     return msg.response_headers
 
 
+def fetch_http_headers_async(session, url, callback):
+    """Probe the headers of url, then call callback(headers).
+
+    headers is None if the request failed.
+    """
+    def got_reply(session, msg):
+        if msg.status_code not in (Soup.Status.OK, Soup.Status.PARTIAL_CONTENT):
+            logger.info('got error probing %s: %s(%s)', url, msg.status_code,
+                        Soup.status_get_phrase(msg.status_code))
+            return callback(None)
+        callback(msg.response_headers)
+
+    session.queue_message(_make_probe_message(url), got_reply)
+
+
+class MetadataCache(object):
+
+    """
+    Cache the headers probed for URLs, for `ttl` seconds.
+
+    Getters for a URL probed recently reuse its headers instead of making
+    a request; concurrent probes of the same URL share one request. Failed
+    probes are not cached. Times are monotonic, in µs; `now` defaults to
+    the current time.
+    """
+
+    def __init__(self, ttl=METADATA_TTL):
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._pending = dict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url, now=None):
+        if now is None:
+            now = GLib.get_monotonic_time()
+        try:
+            headers, expiry = self._entries[url]
+        except KeyError:
+            return None
+        if expiry <= now:
+            del self._entries[url]
+            return None
+        return headers
+
+    def put(self, url, headers, now=None):
+        if now is None:
+            now = GLib.get_monotonic_time()
+        # All entries live as long, so the oldest ones are at the front.
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if self._entries[oldest][1] > now:
+                break
+            del self._entries[oldest]
+
+        self._entries.pop(url, None)
+        self._entries[url] = (headers, now + self.ttl * 1000 * 1000)
+
+    def fetch(self, session, url, callback):
+        """Call callback(headers) with the headers of url, probing if needed."""
+        headers = self.get(url)
+        if headers is not None:
+            self.hits += 1
+            return callback(headers)
+
+        self.misses += 1
+        try:
+            self._pending[url].append(callback)
+            return
+        except KeyError:
+            self._pending[url] = [callback]
+
+        def got_headers(headers):
+            if headers is not None:
+                self.put(url, headers)
+            for waiter in self._pending.pop(url):
+                waiter(headers)
+
+        fetch_http_headers_async(session, url, got_headers)
+
+
+@singleton
+def get_default_metadata_cache():
+    return MetadataCache()
+
+
 def get_content_size(headers):
     content_range = headers.get_one('Content-Range')
     if not content_range:
@@ -65,104 +245,354 @@ def get_content_size(headers):
 
 def get_last_modified(headers):
     # note that we can't use ETag as we need things to be ordered
-    date = Soup.Date.new_from_string(headers.get_one('Last-Modified'))
+    last_modified = headers.get_one('Last-Modified')
+    if not last_modified:
+        return None
+    date = Soup.Date.new_from_string(last_modified)
     if not date:
         return None
     return date.to_string(Soup.DateFormat.ISO8601)
 
 
+class RangeReader(object):
+
+    """
+    Read the body of a range request of `count` chunks, starting at chunk n.
+
+    Chunks are passed to ``on_chunk(n, buf)`` as soon as they are complete,
+    as memoryviews: reads which return a whole chunk at once are handed on
+    as they are, the others are gathered in a chunk-sized buffer. Once done,
+    ``on_done(n, end)`` is called with the range of chunks not received,
+    which is empty unless the request failed or the body was short.
+
+    Only the last chunk of the content, of `size` bytes, may be short: a
+    body which ends partway through any other chunk is missing that chunk.
+    """
+
+    def __init__(self, stream, n, count, chunk_size, size, on_chunk,
+                 on_done):
+        self._stream = stream
+        self._n = n
+        self._end = n + count
+        self._chunk_size = chunk_size
+        self._size = size
+        self._on_chunk = on_chunk
+        self._on_done = on_done
+
+        self._buf = None
+        self._filled = 0
+
+    def read(self):
+        self._stream.read_bytes_async(self._chunk_size - self._filled,
+                                      GLib.PRIORITY_DEFAULT, None,
+                                      self._on_read, None)
+
+    def _on_read(self, stream, result, user_data):
+        try:
+            data = stream.read_bytes_finish(result).get_data()
+        except GLib.Error as error:
+            logger.info('got error reading chunk %s: %s', self._n,
+                        error.message)
+            return self._finish(failed=True)
+
+        if not data:
+            return self._finish()
+
+        if not self._filled and len(data) == self._chunk_size:
+            self._emit(memoryview(data))
+        else:
+            if self._buf is None:
+                self._buf = bytearray(self._chunk_size)
+            self._buf[self._filled:self._filled + len(data)] = data
+            self._filled += len(data)
+            if self._filled == self._chunk_size:
+                self._emit(memoryview(self._buf))
+
+        if self._n == self._end:
+            return self._finish()
+        self.read()
+
+    def _emit(self, buf):
+        n = self._n
+        self._n += 1
+        self._buf = None
+        self._filled = 0
+        self._on_chunk(n, buf)
+
+    def _finish(self, failed=False):
+        self._stream.close(None)
+        if (self._filled and not failed and
+                (self._n + 1) * self._chunk_size >= self._size):
+            self._emit(memoryview(self._buf)[:self._filled])
+        self._on_done(self._n, self._end)
+
+
 class Getter(object):
 
-    def __init__(self, url, onData, session=None, chunk_size=defaults.CHUNK_SIZE):
+    """
+    Fetch chunks of the content at a URL with HTTP range requests.
+
+    Chunks requested with ``queue_request()`` are queued, and contiguous
+    ones merged into ranges of up to `max_range_size` bytes. Up to
+    `concurrency` range requests are kept in flight at once, subject to the
+    ``RequestScheduler`` of the Soup session, which is shared by all the
+    Getters using the same session (by default, one for the whole process).
+
+    Reply bodies are streamed, and each chunk handed on as a memoryview as
+    soon as it is complete, without waiting for the rest of its range.
+    Replies may arrive out of order, but each Data is always given chunks,
+    and passed to `onData`, in the order it requested them: producer
+    workers write them out sequentially.
+
+    Requests for a chunk already pending are collapsed into it: each chunk
+    is fetched once and handed to every Data waiting for it, then
+    forgotten. ``requests`` and ``collapsed_requests`` count the requests
+    made, and those collapsed.
+
+    The size of the content is probed asynchronously, from the constructor,
+    through `metadata_cache`. Use ``when_ready()`` to wait for it.
+
+    If a `disk_cache` (a ``disk_cache.DiskCache``) is given, chunks fetched
+    are written through to it, and chunks found in it are read from disk
+    (on its I/O pool, if it has one) without any HTTP request; so is the
+    size of content it has an entry for.
+    """
+
+    def __init__(self, url, onData, session=None, chunk_size=defaults.CHUNK_SIZE,
+                 concurrency=MAX_CONCURRENT_REQUESTS,
+                 max_range_size=MAX_RANGE_SIZE, metadata_cache=None,
+                 disk_cache=None):
         super(Getter, self).__init__()
+        assert concurrency > 0 and max_range_size >= chunk_size
 
         self.url = url
         self.onData = onData
         self.chunk_size = chunk_size
 
+        self._concurrency = concurrency
+        self._max_range_chunks = max_range_size // chunk_size
         self._queue = list()
-        self._data = dict()
-        self._in_flight = None
+        # Data objects waiting for each pending chunk.
+        self._pending = dict()
+        self._in_flight = 0
+        self._scheduled = False
+        # The chunks each Data is waiting for, in the order it requested
+        # them, and the contents of those received but not yet delivered to
+        # all their Data.
+        self._order = dict()
+        self._received = dict()
+
+        self.requests = 0
+        self.collapsed_requests = 0
 
         self._session = session
         if self._session is None:
-            self._session = make_soup_session()
-
-        # XXX -- this is a bit ugly that we're making an HTTP request
-        # in the constructor here...
-        self._headers = fetch_http_headers(self._session, self.url)
-        self._size = get_content_size(self._headers)
-        if self._size == -1:
-            raise ValueError("Could not determine Content-Size for %s" % url)
+            self._session = get_default_soup_session()
+        self._scheduler = get_scheduler(self._session)
+
+        self._metadata_cache = metadata_cache
+        if self._metadata_cache is None:
+            self._metadata_cache = get_default_metadata_cache()
+        self._disk_cache = disk_cache
+        self._cache_entry = None
+        self._headers = None
+        self._size = -1
+        self._probing = False
+        self._ready_callbacks = list()
+        self._probe()
         logger.debug('getter init: %s', url)
 
+    @property
+    def ready(self):
+        return self._size != -1
+
+    def when_ready(self, callback):
+        """Call callback() once the probe of the headers is done.
+
+        If the probe failed, ``ready`` is still False when callback is
+        called, and the next call probes again.
+        """
+        if self.ready:
+            return callback()
+        self._ready_callbacks.append(callback)
+        if not self._probing:
+            self._probe()
+
+    def _probe(self):
+        if self._disk_cache is not None:
+            entry = self._disk_cache.lookup(self.url)
+            if entry is not None and entry.chunk_size == self.chunk_size:
+                self._cache_entry = entry
+                return self._got_size(entry.size)
+
+        self._probing = True
+        self._metadata_cache.fetch(self._session, self.url, self._got_headers)
+
+    def _got_headers(self, headers):
+        self._probing = False
+        size = get_content_size(headers) if headers is not None else -1
+        if size == -1:
+            logger.warning('Could not determine Content-Size for %s', self.url)
+        else:
+            self._headers = headers
+        self._got_size(size)
+
+    def _got_size(self, size):
+        self._size = size
+        callbacks, self._ready_callbacks = self._ready_callbacks, list()
+        for callback in callbacks:
+            callback()
+
+    def _get_cache_entry(self):
+        if self._disk_cache is None or not self.ready:
+            return None
+        # Entries evicted meanwhile are started again.
+        if self._cache_entry is None or self._cache_entry.removed:
+            self._cache_entry = self._disk_cache.entry(
+                self.url, self._size, self.chunk_size)
+        return self._cache_entry
+
     def soup_get(self, n, count=1, cancellable=None):
         msg = Soup.Message.new('GET', self.url)
         _bytes = 'bytes=%d-%d' % (n * self.chunk_size, (n + count) * self.chunk_size - 1)
         logger.debug('GET %s', _bytes)
         msg.request_headers.append('Range', _bytes)
-        self._session.queue_message(
-            msg, lambda session, msg: self._got_reply(msg, (n, count)))
+        self._session.send_async(msg, cancellable, self._got_reply,
+                                 (msg, n, count))
         logger.debug('getter: soup_get: queued %d', n)
 
-    def _got_reply(self, msg, args):
-        n, count = args
+    def _got_reply(self, session, result, args):
+        msg, n, count = args
+        try:
+            stream = session.send_finish(result)
+        except GLib.Error as error:
+            logger.info('got error in soup_get: %s for %s+%s',
+                        error.message, n, count)
+            return self._range_done(n, n + count)
+
         if msg.status_code not in (Soup.Status.OK, Soup.Status.PARTIAL_CONTENT):
             logger.info('got error in soup_get: %s(%s) for %s+%s',
                         msg.status_code, Soup.status_get_phrase(msg.status_code),
                         n, count)
-            [self._queue_request(n + i) for i in xrange(count)]
-            return self._consume_queue()
+            stream.close(None)
+            return self._range_done(n, n + count)
 
-        self._in_flight = 0
-        buf = msg.get_property('response-body-data').get_data()
-        bufs = [buf[i*self.chunk_size:(i+1)*self.chunk_size]for i in xrange(count)]
-        [self._got_buf(b, n + i) for i, b in enumerate(bufs)]
-        return self._consume_queue()
+        RangeReader(stream, n, count, self.chunk_size, self._size,
+                    self._got_remote_chunk, self._range_done).read()
+
+    def _got_remote_chunk(self, n, buf):
+        entry = self._get_cache_entry()
+        if entry is not None:
+            entry.put(n, buf)
+        self._got_chunk(n, buf)
 
-    def _got_buf(self, buf, index):
-        data = self._data[index]
-        data.setContent(buf)
-        self.onData(data)
+    def _got_chunk(self, n, buf):
+        waiters = self._pending.get(n)
+        if not waiters:
+            return
+        self._received[n] = buf
+        for data in list(waiters):
+            self._deliver(data)
+
+    def _range_done(self, n, end):
+        # Chunks n to end were not received: those past the end of the
+        # content are empty, the others are fetched again.
+        self._in_flight -= 1
+        for i in xrange(n, end):
+            if 0 <= self._size <= i * self.chunk_size:
+                self._got_chunk(i, b'')
+            else:
+                bisect.insort(self._queue, i)
+        self._scheduler.done(self)
+
+    def _deliver(self, data):
+        # Hand data the chunks it is waiting for, up to the first one not
+        # received yet.
+        order = self._order.get(data)
+        while order and order[0] in self._received:
+            n = order.popleft()
+            buf = self._received[n]
+            waiters = self._pending[n]
+            waiters.remove(data)
+            if not waiters:
+                del self._pending[n]
+                del self._received[n]
+            data.setContent(buf)
+            self.onData(data)
+        if not order:
+            self._order.pop(data, None)
 
     def queue_request(self, data, n):
-        self._data[n] = data
+        self.requests += 1
+        self._order.setdefault(data, deque()).append(n)
+        try:
+            self._pending[n].append(data)
+            self.collapsed_requests += 1
+        except KeyError:
+            self._pending[n] = [data]
+        else:
+            if n in self._received:
+                self._deliver(data)
+            return
+
+        entry = self._get_cache_entry()
+        if entry is not None:
+            return entry.get(n, lambda buf: self._got_cached_chunk(n, buf))
         return self._queue_request(n)
 
+    def _got_cached_chunk(self, n, buf):
+        if buf is None:
+            return self._queue_request(n)
+        self._got_chunk(n, buf)
+
     def _queue_request(self, n):
         bisect.insort(self._queue, n)
+        self._scheduler.wake(self)
 
-        if not self._in_flight:
-            self._consume_queue()
-
-    def _consume_queue(self):
-        if len(self._queue) == 0:
-            self._in_flight = None
-            return
+    def _has_work(self):
+        return bool(self._queue) and self._in_flight < self._concurrency
 
+    def _start_request(self):
+        # Merge the run of contiguous chunks at the head of the queue.
         n = self._queue[0]
-        if len(self._queue) == 1:
-            self._in_flight = 1
-            self._queue = []
-            return self.soup_get(n)
-
-        # we are now sure to have more than 1 element
-        simil = [e for i, e in enumerate(self._queue) if e == n + i and e < n + MAX_IN_FLIGHT]
-        size = len(simil)
+        size = 1
+        while (size < len(self._queue) and size < self._max_range_chunks and
+               self._queue[size] == n + size):
+            size += 1
         del self._queue[:size]
-        self._in_flight = size
-        logger.debug('consuming queue have %s in queue, %s in flight', len(self._queue), size)
+        self._in_flight += 1
+        logger.debug('consuming queue have %s in queue, %s in flight',
+                     len(self._queue), self._in_flight)
         self.soup_get(n, size)
 
 class Producer(chunks.Producer):
 
-    def __init__(self, name, url, session=None, *args, **kwargs):
-        self._getter = Getter(url, session=session,
+    """
+    Serve the content at a URL, fetched with a ``Getter``.
+
+    If a `disk_cache` is given (such as the process-wide one, from
+    ``disk_cache.get_default_disk_cache()``), chunks are cached in it, so
+    that they are only fetched once.
+    """
+
+    def __init__(self, name, url, session=None, disk_cache=None,
+                 *args, **kwargs):
+        self._getter = Getter(url, session=session, disk_cache=disk_cache,
                               onData=lambda d: self.sendFinish(d))
         super(Producer, self).__init__(
             name, cost=defaults.RouteCost.HTTP, *args, **kwargs)
 
+    def _on_request_interest(self, *args):
+        # Hold requests until we know the size of the content.
+        if self._getter.ready:
+            return super(Producer, self)._on_request_interest(*args)
+        self._getter.when_ready(
+            lambda: super(Producer, self)._on_request_interest(*args))
+        return True
+
     def _get_final_segment(self):
+        if not self._getter.ready:
+            raise NotImplementedError
         return self._getter._size // self.chunk_size
 
     def _send_chunk(self, data, n):
@@ -0,0 +1,154 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import logging
+import threading
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from gi.repository import GLib
+
+from .utils import singleton
+
+logger = logging.getLogger(__name__)
+
+IO_THREADS = 2
+
+
+class IOPool(object):
+
+    """
+    Pool of threads to run blocking disk I/O off the main loop.
+
+    ``submit()`` queues a function to be run on one of the `num_threads`
+    worker threads. Its result is passed to the job's callback, which is
+    called back on the main loop through ``GLib.idle_add()``; if it raises,
+    the error is logged and the exception passed to the job's errback
+    instead.
+
+    ``pending`` counts the jobs submitted but not completed yet.
+
+    The pool's own state is only touched from the main loop; the jobs
+    themselves must not touch any state the main loop uses without locking.
+    """
+
+    def __init__(self, num_threads=IO_THREADS):
+        assert num_threads > 0
+        self.num_threads = num_threads
+        self.pending = 0
+        self._jobs = queue.Queue()
+        self._threads = []
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        self.pending += 1
+        self._dispatch(func, args, callback, errback)
+
+    def _dispatch(self, func, args, callback, errback):
+        # Threads are only started once there is something for them to do.
+        if not self._threads:
+            for i in range(self.num_threads):
+                thread = threading.Thread(target=self._run,
+                                          name='io-pool-%d' % (i, ))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        self._jobs.put((func, args, callback, errback))
+
+    def _run(self):
+        while True:
+            func, args, callback, errback = self._jobs.get()
+            try:
+                result = func(*args)
+            except Exception as e:
+                logger.exception('I/O job %s failed', func)
+                GLib.idle_add(self._on_job_done, errback, e)
+            else:
+                GLib.idle_add(self._on_job_done, callback, result)
+
+    def _on_job_done(self, callback, result):
+        self.pending -= 1
+        if callback is not None:
+            callback(result)
+        return GLib.SOURCE_REMOVE
+
+
+class IOQueue(object):
+
+    """
+    Serial queue of jobs on an ``IOPool``.
+
+    Jobs submitted to the same queue run one at a time, in the order they
+    were submitted, so that (for instance) the writes to a file and the
+    commit which records them cannot be reordered. Jobs waiting in the queue
+    count towards the pool's ``pending`` jobs.
+
+    Each job's callback or errback is called before the next job starts, so
+    it may still change what that job will do.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._jobs = deque()
+        self._busy = False
+
+    def __len__(self):
+        return len(self._jobs) + int(self._busy)
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        self._pool.pending += 1
+        self._jobs.append((func, args, callback, errback))
+        if not self._busy:
+            self._dispatch_next()
+
+    def _dispatch_next(self):
+        func, args, callback, errback = self._jobs.popleft()
+        self._busy = True
+        self._pool._dispatch(
+            self._run_job, (func, args),
+            lambda result: self._on_job_done(callback, errback, result),
+            None)
+
+    @staticmethod
+    def _run_job(func, args):
+        try:
+            return (True, func(*args))
+        except Exception as e:
+            logger.exception('I/O job %s failed', func)
+            return (False, e)
+
+    def _on_job_done(self, callback, errback, result):
+        succeeded, value = result
+        try:
+            if succeeded and callback is not None:
+                callback(value)
+            elif not succeeded and errback is not None:
+                errback(value)
+        finally:
+            self._busy = False
+            if self._jobs:
+                self._dispatch_next()
+
+
+@singleton
+def get_default_io_pool():
+    return IOPool()
@@ -28,24 +28,74 @@ from ..names import Name
 
 logger = logging.getLogger(__name__)
 
+# Number of times the headers are probed for a Last-Modified date before
+# requests for the manifest are refused.
+MAX_PROBES = 3
+
 
 # the manifest producer is an http Producer that answers on a different name
 class Producer(chunks.Producer):
 
     def __init__(self, name, url, session=None, *args, **kwargs):
+        self._last_modified = None
+        self._qualified_name = None
+        self._probes = 0
+        # Requests held while the headers are probed again.
+        self._waiting = list()
         self._getter = http.Getter(
             url, onData=self._send_finish, session=session)
-        self._last_modified = http.get_last_modified(self._getter._headers)
-        if not self._last_modified:
-            raise ValueError("Could not get Last-Modified")
-
-        # XXX -- we mangle the name in the constructor, this is slow
-        self._qualified_name = Name(name).append(self._last_modified)
 
         super(Producer, self).__init__(
             name, cost=defaults.RouteCost.HTTP, *args, **kwargs)
 
+    def _on_request_interest(self, *args):
+        # Hold requests until we know the Last-Modified date to version the
+        # name with.
+        if self._getter.ready:
+            return self._request_interest_ready(*args)
+        self._getter.when_ready(lambda: self._request_interest_ready(*args))
+        return True
+
+    def _request_interest_ready(self, name, *args):
+        if self._getter.ready and self._qualified_name is None:
+            if self._probes == 0:
+                self._probes += 1
+                self._set_last_modified(self._getter._headers)
+            if self._qualified_name is None:
+                return self._wait_for_last_modified(name, *args)
+        return super(Producer, self)._on_request_interest(name, *args)
+
+    def _set_last_modified(self, headers):
+        if headers is not None:
+            self._last_modified = http.get_last_modified(headers)
+        if self._last_modified:
+            self._qualified_name = Name(self.name).append(self._last_modified)
+
+    def _wait_for_last_modified(self, name, *args):
+        if self._probes >= MAX_PROBES:
+            # Without it, the name cannot be versioned: refuse the request
+            # rather than have it tried again forever.
+            self._dbus.return_error(name, 'NoLastModified')
+            return False
+
+        self._waiting.append((name, args))
+        if len(self._waiting) == 1:
+            logger.warning('Could not get Last-Modified for %s: probing again',
+                           self._getter.url)
+            self._probes += 1
+            http.fetch_http_headers_async(self._getter._session,
+                                          self._getter.url, self._got_headers)
+        return True
+
+    def _got_headers(self, headers):
+        self._set_last_modified(headers)
+        waiting, self._waiting = self._waiting, list()
+        for name, args in waiting:
+            self._request_interest_ready(name, *args)
+
     def _get_final_segment(self):
+        if self._qualified_name is None:
+            raise NotImplementedError
         return self._getter._size // self.chunk_size
 
     def _send_chunk(self, data, n):
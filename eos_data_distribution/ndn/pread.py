@@ -0,0 +1,31 @@
+import ctypes
+import ctypes.util
+import os
+
+
+def _pread():
+    try:
+        return os.pread
+    except AttributeError:
+        pass
+
+    libc_name = ctypes.util.find_library('c')
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+
+    raw_pread = libc.pread
+    raw_pread.restype = ctypes.c_ssize_t
+    raw_pread.argtypes = [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int64]
+
+    def pread(fd, size, offs):
+        buf = ctypes.create_string_buffer(size)
+        ret = raw_pread(fd, buf, size, offs)
+        if ret < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return buf.raw[:ret]
+
+    return pread
+
+pread = _pread()
+del _pread
@@ -0,0 +1,45 @@
+import ctypes
+import ctypes.util
+import os
+
+# Maximum number of buffers a single pwritev() call accepts on Linux.
+IOV_MAX = 1024
+
+
+def _pwritev():
+    try:
+        return os.pwritev
+    except AttributeError:
+        pass
+
+    class iovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_void_p),
+                    ('iov_len', ctypes.c_size_t)]
+
+    libc_name = ctypes.util.find_library('c')
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+
+    raw_pwritev = libc.pwritev
+    raw_pwritev.restype = ctypes.c_ssize_t
+    raw_pwritev.argtypes = [
+        ctypes.c_int, ctypes.POINTER(iovec), ctypes.c_int, ctypes.c_int64]
+
+    def pwritev(fd, buffers, offs):
+        # buffers must be byte strings; c_char_p points at their content
+        # without copying it.
+        iov = (iovec * len(buffers))()
+        for i, buf in enumerate(buffers):
+            iov[i].iov_base = ctypes.cast(ctypes.c_char_p(buf),
+                                          ctypes.c_void_p)
+            iov[i].iov_len = len(buf)
+
+        ret = raw_pwritev(fd, iov, len(buffers), offs)
+        if ret < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ret
+
+    return pwritev
+
+pwritev = _pwritev()
+del _pwritev
@@ -2,10 +2,12 @@
 import logging
 import struct
 import fcntl
+import mmap
 import os
 
 from io import BytesIO
 
+from .pwritev import pwritev, IOV_MAX
 from ..defaults import SegmentState
 
 logger = logging.getLogger(__name__)
@@ -42,8 +44,21 @@ logger = logging.getLogger(__name__)
 #   num_segments long. Mark all indexes lower than num_completed_segments
 #   as being complete. Then, mark each segment for at each hole_index as
 #   incomplete.
+#
+# Mode 2 is the "mapped segment table". It is only a way of writing a mode 0
+# table: the file is memory-mapped once it has been written, and completing
+# a segment sets its bit in place rather than rewriting the whole table. The
+# table is marked as mode 0 on disk, so that any reader can read it.
+#
+# Tables marked with any other mode are rejected.
 
 SEGMENT_TABLE_MAGIC = 'EosSgtV1'
+# Magic, flags and num_segments: the bitmap of modes 0 and 2 follows.
+SEGMENT_TABLE_HEADER_SIZE = len(SEGMENT_TABLE_MAGIC) + 8 + 8
+SEGMENT_TABLE_MODE_MAPPED = 2
+# Mode recorded in the header of the tables written in each mode.
+SEGMENT_TABLE_DISK_MODES = {0: 0, 1: 1, SEGMENT_TABLE_MODE_MAPPED: 0}
+SEGMENT_STATE_COUNT = 3
 
 def dump_segments(segments):
     import operator
@@ -58,6 +73,102 @@ def dump_segments(segments):
 
     return s
 
+class SegmentMap(object):
+    """
+    Compact table of per-segment download state.
+
+    Each segment's ``SegmentState`` is stored as a single byte in a
+    ``bytearray``. Running counts of each state and a cursor on the lowest
+    segment which might still be ``UNSENT`` are kept up to date on every
+    assignment, so that scheduling the next interest and checking progress
+    cost O(1) (amortised) per chunk rather than a scan of the whole table.
+
+    ``SegmentMap`` behaves enough like the ``list`` of states it replaces
+    (indexing, slicing, ``len()``, ``count()`` and ``index()``) that callers
+    do not need to care.
+    """
+
+    def __init__(self, num_segments, state=SegmentState.UNSENT):
+        self._states = bytearray([state]) * num_segments
+        self._counts = [0] * SEGMENT_STATE_COUNT
+        self._counts[state] = num_segments
+        self._next_unsent = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    def __iter__(self):
+        return iter(self._states)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return list(self._states[n])
+        return self._states[n]
+
+    def __setitem__(self, n, state):
+        old_state = self._states[n]
+        if old_state == state:
+            return
+
+        self._states[n] = state
+        self._counts[old_state] -= 1
+        self._counts[state] += 1
+
+        if state == SegmentState.UNSENT and n < self._next_unsent:
+            self._next_unsent = n
+
+    def fill(self, start, stop, state):
+        """Set every segment in [start, stop) to state."""
+        section = self._states[start:stop]
+        for old_state in range(SEGMENT_STATE_COUNT):
+            self._counts[old_state] -= section.count(bytearray([old_state]))
+        self._counts[state] += len(section)
+        self._states[start:stop] = bytearray([state]) * len(section)
+
+        if state == SegmentState.UNSENT and start < self._next_unsent:
+            self._next_unsent = start
+
+    def count(self, state):
+        return self._counts[state]
+
+    def copy(self):
+        segments = SegmentMap(0)
+        segments._states = bytearray(self._states)
+        segments._counts = list(self._counts)
+        segments._next_unsent = self._next_unsent
+        return segments
+
+    def index(self, state):
+        if state == SegmentState.UNSENT:
+            return self.next_unsent()
+
+        n = self._states.find(bytearray([state]))
+        if n < 0:
+            raise ValueError('no segment in state %s' % (state, ))
+        return n
+
+    def next_unsent(self):
+        """
+        Return the lowest ``UNSENT`` segment, or raise ``ValueError``.
+
+        Segments below the cursor are never ``UNSENT`` (``__setitem__`` moves
+        the cursor back if one becomes so again), so the search only ever
+        starts from the cursor.
+        """
+        if self._counts[SegmentState.UNSENT] == 0:
+            self._next_unsent = len(self._states)
+            raise ValueError('no unsent segments')
+
+        n = self._states.find(bytearray([SegmentState.UNSENT]),
+                              self._next_unsent)
+        assert n >= 0
+        self._next_unsent = n
+        return n
+
+    def is_complete(self):
+        return self._counts[SegmentState.COMPLETE] == len(self._states)
+
+
 def num_to_bitmap(n):
     """7 => [0, 0, 0, 0, 0, 1, 1, 1]"""
     assert 0 <= n <= 255
@@ -74,8 +185,13 @@ def bitmap_to_num(bitmap):
     return n
 
 class File:
-    def __init__(self, filename, mode=0):
+    def __init__(self, filename, mode=SEGMENT_TABLE_MODE_MAPPED):
+        if mode not in SEGMENT_TABLE_DISK_MODES:
+            raise ValueError('Unknown segment table mode %s' % (mode, ))
         self.mode = mode
+        self._map = None
+        # The segments recorded as complete in the table.
+        self._committed = None
         self._filename = '%s.sgt' % (filename, )
         self._fd = os.open(
             self._filename, os.O_CREAT | os.O_RDWR, 0o600)
@@ -94,7 +210,14 @@ class File:
     def lock(self):
         fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
 
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
     def close(self, unlink=False):
+        self._unmap()
+
         try:
             self.unlock()
         except IOError as e:
@@ -136,24 +259,24 @@ class File:
         def read_mode0():
             # Num segments.
             num_segments = read8()
-            completed_segments = []
+            segments = SegmentMap(num_segments)
+
+            bitmap = bytearray(os.read(self._fd, (num_segments + 7) // 8))
+            if len(bitmap) < (num_segments + 7) // 8:
+                logger.debug("COULDNT READ SEGMENT TABLE, short bitmap")
+                raise ValueError()
 
-            for i in range(0, num_segments, 8):
-                char = os.read(self._fd, 1)
-                #logger.debug('read pos: %s/%s -> %s', i, num_segments, char)
-                byte = ord(char)
-                completed_segments += num_to_bitmap(byte)
+            for i in xrange(num_segments):
+                if bitmap[i >> 3] & (0x80 >> (i & 7)):
+                    segments[i] = SegmentState.COMPLETE
 
-            segments = completed_segments[:num_segments]
-            return [
-                SegmentState.COMPLETE if bit else SegmentState.UNSENT for bit in segments]
+            return segments
 
         def read_mode1():
             num_segments = read8()
             num_complete_segments = read8()
-            num_unsent_segments = num_segments - num_complete_segments
-            segments = ([SegmentState.COMPLETE] * num_complete_segments) + (
-                [SegmentState.UNSENT] * num_unsent_segments)
+            segments = SegmentMap(num_segments)
+            segments.fill(0, num_complete_segments, SegmentState.COMPLETE)
 
             num_holes = read8()
             for i in range(num_holes):
@@ -163,8 +286,13 @@ class File:
             return segments
 
         logger.debug ('reading mode %s', mode)
-        read = [read_mode0, read_mode1]
-        return read[mode]()
+        read = {0: read_mode0, 1: read_mode1}
+        if mode not in read:
+            logger.debug("COULDNT READ SEGMENT TABLE, mode: %s", mode)
+            raise ValueError()
+        segments = read[mode]()
+        self._committed = segments.copy()
+        return segments
 
     def write(self, segments):
         # If we don't have any segment state yet, just quit.
@@ -183,9 +311,9 @@ class File:
 
         # Flags.
         mode = self.mode
-        flags = 0 | mode
+        flags = 0 | SEGMENT_TABLE_DISK_MODES[mode]
 
-        write8(mode)
+        write8(flags)
         write8(len(segments))
 
         def write_mode0(segments):
@@ -200,29 +328,27 @@ class File:
 
 
         def write_mode1(segments):
-            try:
-                first_unsent_index = segments.index(SegmentState.UNSENT)
-            except ValueError as e:
-                first_unsent_index = len(segments)
-
-            unsent_segments = segments[first_unsent_index:]
-            # Make sure there are no complete and outgoing segments past the
-            # first unsent one...
-            assert unsent_segments.count(SegmentState.COMPLETE) == 0
-            assert unsent_segments.count(SegmentState.OUTGOING) == 0
-
-            # All complete segments are before this index.
-            num_complete_segments = first_unsent_index
+            # All complete segments are before this index; anything else
+            # before it is a hole.
+            num_complete_segments = 0
+            for i in xrange(len(segments) - 1, -1, -1):
+                if segments[i] == SegmentState.COMPLETE:
+                    num_complete_segments = i + 1
+                    break
             write8(num_complete_segments)
 
             complete_segments = segments[:num_complete_segments]
             hole_indexes = [i for i, state in enumerate(
-                complete_segments) if state == SegmentState.OUTGOING]
+                complete_segments) if state != SegmentState.COMPLETE]
             write8(len(hole_indexes))
             for hole_index in hole_indexes:
                 write8(hole_index)
 
-        [write_mode0, write_mode1][mode](segments)
+        {0: write_mode0, 1: write_mode1,
+         SEGMENT_TABLE_MODE_MAPPED: write_mode0}[mode](segments)
+
+        if mode == SEGMENT_TABLE_MODE_MAPPED:
+            return self._write_mapped(bio.getvalue())
 
         bio.seek(0)
         # Truncate the file so it contains nothing.
@@ -230,6 +356,192 @@ class File:
         os.lseek(self._fd, 0, os.SEEK_SET)
         os.write(self._fd, bio.read())
 
+    def _write_mapped(self, buf):
+        # The table only changes size if the number of segments does, which
+        # does not happen during a download; otherwise rewrite it in place.
+        if self._map is None or len(self._map) != len(buf):
+            self._unmap()
+            os.ftruncate(self._fd, len(buf))
+            self._map = mmap.mmap(self._fd, len(buf))
+
+        self._map[:] = buf
+
+    def mark_complete(self, indexes, segments):
+        """
+        Record the segments at indexes of segments as complete.
+
+        In mapped mode, this sets one bit of the mapped table per index
+        (writing the full table first if it is not mapped yet). In the other
+        modes, the full table is rewritten.
+
+        Either way, only the segments read from the table or marked complete
+        through here are recorded: segments itself is only used for its
+        length, as it may be updated on the main loop while this runs on an
+        ``IOPool``, and have chunks marked complete which are not written yet.
+        """
+        self._mark(indexes, segments, SegmentState.COMPLETE)
+
+    def mark_incomplete(self, indexes, segments):
+        """Stop recording the segments at indexes of segments as complete."""
+        self._mark(indexes, segments, SegmentState.UNSENT)
+
+    def _mark(self, indexes, segments, state):
+        committed = self._committed
+        if committed is None or len(committed) != len(segments):
+            committed = self._committed = SegmentMap(len(segments))
+        for n in indexes:
+            committed[n] = state
+
+        if self.mode != SEGMENT_TABLE_MODE_MAPPED or self._map is None:
+            return self.write(committed)
+
+        for n in indexes:
+            offs = SEGMENT_TABLE_HEADER_SIZE + (n >> 3)
+            byte = struct.unpack('<B', self._map[offs:offs + 1])[0]
+            if state == SegmentState.COMPLETE:
+                byte |= 0x80 >> (n & 7)
+            else:
+                byte &= ~(0x80 >> (n & 7)) & 0xFF
+            self._map[offs:offs + 1] = struct.pack('<B', byte)
+
+    def flush(self):
+        """Synchronously write the table back to disk."""
+        if self._map is not None:
+            self._map.flush()
+        else:
+            os.fdatasync(self._fd)
+
+
+class CommitQueue(object):
+
+    """
+    Group commit of completed segments into a segment table.
+
+    Rather than updating the table after every chunk, segments whose data
+    has been written are queued with ``add()`` and recorded in the table in
+    one go by ``commit()``, which happens automatically once `max_pending`
+    segments are queued.
+
+    ``commit()`` syncs the data file before touching the table, so however
+    the writer dies the table can lose progress but never claim a segment
+    whose data is not on disk.
+    """
+
+    def __init__(self, segments_file, data_fd, max_pending):
+        assert max_pending > 0
+        self._segments_file = segments_file
+        self._data_fd = data_fd
+        self._max_pending = max_pending
+        self._pending = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, n, segments):
+        """
+        Queue segment n, whose data has been written, to be marked complete.
+
+        Returns True if this caused the queue to be committed.
+        """
+        self._pending.append(n)
+        if len(self._pending) >= self._max_pending:
+            self.commit(segments)
+            return True
+        return False
+
+    def commit(self, segments):
+        if not self._pending:
+            return
+
+        os.fdatasync(self._data_fd)
+        self._segments_file.mark_complete(self._pending, segments)
+        self._segments_file.flush()
+        self._pending = []
+
+
+class ChunkWriter(object):
+
+    """
+    Coalescing writer of chunks into a file.
+
+    Chunks are buffered, in any order, until `max_bytes` of them are pending.
+    They are then written with one pwritev() per run of contiguous chunks,
+    rather than a seek and a write each. ``add()`` and ``flush()`` return the
+    numbers of the chunks they wrote: only those may be recorded as complete.
+
+    ``writes`` counts the write syscalls made.
+    """
+
+    def __init__(self, fd, chunk_size, max_bytes):
+        self._fd = fd
+        self._chunk_size = chunk_size
+        self._max_bytes = max_bytes
+        self._pending = dict()
+        self._pending_bytes = 0
+        self.writes = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def is_full(self):
+        return self._pending_bytes >= self._max_bytes
+
+    def indexes(self):
+        """Return the numbers of the chunks buffered, in order."""
+        return sorted(self._pending)
+
+    def put(self, n, data):
+        """Buffer chunk n, without writing anything out."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        else:
+            data = bytes(data)
+
+        old_data = self._pending.pop(n, None)
+        if old_data is not None:
+            self._pending_bytes -= len(old_data)
+
+        self._pending[n] = data
+        self._pending_bytes += len(data)
+
+    def add(self, n, data):
+        self.put(n, data)
+        if self.is_full():
+            return self.flush()
+        return []
+
+    def flush(self):
+        written = sorted(self._pending)
+
+        run = []
+        for n in written:
+            if run and n != run[-1] + 1:
+                self._write_run(run)
+                run = []
+            run.append(n)
+        if run:
+            self._write_run(run)
+
+        self._pending = dict()
+        self._pending_bytes = 0
+        return written
+
+    def _write_run(self, run):
+        offs = run[0] * self._chunk_size
+        buffers = [self._pending[n] for n in run]
+
+        while buffers:
+            ret = pwritev(self._fd, buffers[:IOV_MAX], offs)
+            self.writes += 1
+            offs += ret
+
+            # Drop what was written, including any partially written buffer.
+            while buffers and ret >= len(buffers[0]):
+                ret -= len(buffers.pop(0))
+            if ret:
+                buffers[0] = buffers[0][ret:]
+
+
 if __name__ == '__main__':
     import argparse
     from .. import utils
@@ -0,0 +1,59 @@
+import ctypes
+import ctypes.util
+import os
+import socket
+
+# Maximum number of buffers a single sendmsg() call accepts on Linux.
+IOV_MAX = 1024
+
+
+def _sendmsg():
+    if hasattr(socket.socket, 'sendmsg'):
+        def sendmsg(sock, buffers, flags=0):
+            return sock.sendmsg(buffers, [], flags)
+        return sendmsg
+
+    class iovec(ctypes.Structure):
+        _fields_ = [('iov_base', ctypes.c_void_p),
+                    ('iov_len', ctypes.c_size_t)]
+
+    class msghdr(ctypes.Structure):
+        _fields_ = [('msg_name', ctypes.c_void_p),
+                    ('msg_namelen', ctypes.c_uint32),
+                    ('msg_iov', ctypes.POINTER(iovec)),
+                    ('msg_iovlen', ctypes.c_size_t),
+                    ('msg_control', ctypes.c_void_p),
+                    ('msg_controllen', ctypes.c_size_t),
+                    ('msg_flags', ctypes.c_int)]
+
+    libc_name = ctypes.util.find_library('c')
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+
+    raw_sendmsg = libc.sendmsg
+    raw_sendmsg.restype = ctypes.c_ssize_t
+    raw_sendmsg.argtypes = [
+        ctypes.c_int, ctypes.POINTER(msghdr), ctypes.c_int]
+
+    def sendmsg(sock, buffers, flags=0):
+        # buffers must be byte strings; c_char_p points at their content
+        # without copying it.
+        iov = (iovec * len(buffers))()
+        for i, buf in enumerate(buffers):
+            iov[i].iov_base = ctypes.cast(ctypes.c_char_p(buf),
+                                          ctypes.c_void_p)
+            iov[i].iov_len = len(buf)
+
+        msg = msghdr()
+        msg.msg_iov = iov
+        msg.msg_iovlen = len(buffers)
+
+        ret = raw_sendmsg(sock.fileno(), ctypes.byref(msg), flags)
+        if ret < 0:
+            errno = ctypes.get_errno()
+            raise socket.error(errno, os.strerror(errno))
+        return ret
+
+    return sendmsg
+
+sendmsg = _sendmsg()
+del _sendmsg
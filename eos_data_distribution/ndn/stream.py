@@ -0,0 +1,208 @@
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+import logging
+from collections import deque
+
+import gi
+gi.require_version('Gio', '2.0')
+gi.require_version('GLib', '2.0')
+from gi.repository import Gio
+from gi.repository import GLib
+
+from . import chunks
+
+logger = logging.getLogger(__name__)
+
+# Default bound on the bytes a StreamConsumer holds: chunks received out of
+# order, plus data delivered but not yet written out.
+STREAM_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class CallbackWriter(object):
+
+    """Deliver data by calling a function with it."""
+
+    pending_bytes = 0
+
+    def __init__(self, callback):
+        self._callback = callback
+
+    def write(self, data):
+        self._callback(data)
+
+    def close(self, callback):
+        callback()
+
+
+class OutputStreamWriter(object):
+
+    """
+    Write data to a ``Gio.OutputStream`` asynchronously, in order.
+
+    ``pending_bytes`` counts the data queued but not written yet;
+    `on_drained` is called whenever it drops back to zero, and `on_error`
+    with the ``GLib.Error`` if a write fails, after which nothing more is
+    written.
+    """
+
+    def __init__(self, stream, on_drained=None, on_error=None):
+        self._stream = stream
+        self._on_drained = on_drained
+        self._on_error = on_error
+        self._queue = deque()
+        self._writing = False
+        self._failed = False
+        self._close_callback = None
+        self.pending_bytes = 0
+
+    def write(self, data):
+        if self._failed:
+            return
+        self._queue.append(data)
+        self.pending_bytes += len(data)
+        if not self._writing:
+            self._write_next()
+
+    def close(self, callback):
+        """Call callback once everything queued has been written."""
+        if self._writing:
+            self._close_callback = callback
+        else:
+            callback()
+
+    def _write_next(self):
+        self._writing = True
+        self._stream.write_bytes_async(GLib.Bytes.new(self._queue[0]),
+                                       GLib.PRIORITY_DEFAULT, None,
+                                       self._on_written)
+
+    def _on_written(self, stream, result):
+        try:
+            written = stream.write_bytes_finish(result)
+        except GLib.Error as e:
+            logger.warning('Error writing to %s: %s', stream, e.message)
+            self._failed = True
+            self._queue.clear()
+            self.pending_bytes = 0
+            written = 0
+            if self._on_error is not None:
+                self._on_error(e)
+        else:
+            data = self._queue.popleft()
+            self.pending_bytes -= written
+            if written < len(data):
+                self._queue.appendleft(data[written:])
+
+        if self._queue:
+            return self._write_next()
+
+        self._writing = False
+        if self._on_drained is not None:
+            self._on_drained()
+        if self._close_callback is not None:
+            callback = self._close_callback
+            self._close_callback = None
+            callback()
+
+
+class StreamConsumer(chunks.Consumer):
+
+    """
+    Retrieve some named content, delivering its bytes in order as they come.
+
+    Chunks received ahead of the first missing one are held in a reorder
+    buffer; as soon as the missing chunk arrives, the contiguous data is
+    passed on to `sink`, which may be:
+
+     - a function, called with each piece of data, in order;
+     - a ``Gio.OutputStream``, which data is written to asynchronously;
+     - a file descriptor (such as the write end of a pipe), likewise. It is
+       not closed by the consumer: do that on ``complete`` to signal EOF.
+
+    At most `max_buffer` bytes are held at a time, counting both the reorder
+    buffer and data not yet written to the sink: no more chunks are
+    requested past that, so a slow reader slows the download down rather
+    than growing memory use.
+
+    If only some `segment_ranges` or `byte_ranges` are requested (see
+    ``chunks.Consumer``), the chunks holding them are delivered one after
+    the other, and the others are stepped over.
+
+    ``complete`` is only emitted once all the data has been written out. If
+    writing to the sink fails, the download is stopped and ``failed`` is
+    emitted with the ``GLib.Error``.
+    """
+
+    def __init__(self, name, sink, max_buffer=STREAM_BUFFER_SIZE,
+                 *args, **kwargs):
+        super(StreamConsumer, self).__init__(name, *args, **kwargs)
+        assert max_buffer >= self.chunk_size
+
+        if isinstance(sink, int):
+            sink = Gio.UnixOutputStream.new(sink, False)
+        if isinstance(sink, Gio.OutputStream):
+            self._writer = OutputStreamWriter(
+                sink, on_drained=self._on_writer_drained,
+                on_error=self._on_writer_error)
+        else:
+            self._writer = CallbackWriter(sink)
+
+        self._max_buffer = max_buffer
+        self._reorder_buffer = dict()
+        self._next_segment = self._next_wanted_segment(0)
+
+    def _buffered_bytes(self):
+        return (len(self._reorder_buffer) * self.chunk_size +
+                self._writer.pending_bytes)
+
+    def _can_request(self, n):
+        # Chunks up to n will have to be held until they can be delivered.
+        ahead = (self._count_wanted_segments(self._next_segment, n + 1) *
+                 self.chunk_size)
+        return (not self._failed and
+                ahead + self._writer.pending_bytes <= self._max_buffer)
+
+    def _is_backlogged(self):
+        return self._buffered_bytes() >= self._max_buffer
+
+    def _save_chunk(self, n, data):
+        if self._failed:
+            return False
+        if self._next_segment is None or n < self._next_segment:
+            return True
+
+        self._reorder_buffer[n] = data.getContent().toBytes()
+        while self._next_segment in self._reorder_buffer:
+            self._writer.write(self._reorder_buffer.pop(self._next_segment))
+            self._next_segment = self._next_wanted_segment(
+                self._next_segment + 1)
+        return True
+
+    def _on_writer_drained(self):
+        if self._segments is not None and not self._emitted_complete:
+            self._schedule_interests()
+
+    def _on_writer_error(self, error):
+        # Nobody is reading any more: stop downloading.
+        self._reorder_buffer.clear()
+        self._fail(error)
+
+    def _on_complete(self):
+        self._writer.close(
+            lambda: super(StreamConsumer, self)._on_complete())
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Benchmark the startup of a store with many files.
+
+A temporary store of `files` empty shards is walked, creating one producer
+per file as a store does, first loading keys for each producer (as
+``base.Producer`` used to), then sharing the process-wide signing info,
+which is only loaded when the first command interest is made.
+
+    $ python -m eos_data_distribution.ndn.tests.bench_keys
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from eos_data_distribution.ndn import base
+
+
+def build_store(n_files):
+    store_dir = tempfile.mkdtemp()
+    for i in range(n_files):
+        open(os.path.join(store_dir, '%05d.shard' % (i, )), 'w').close()
+    return store_dir
+
+
+def start_store(store_dir, load_keys):
+    producers = []
+    for filename in sorted(os.listdir(store_dir)):
+        name = '/endlessm/bench/%s' % (filename, )
+        if load_keys:
+            base.generate_keys(name)
+        producers.append(base.Producer(name))
+    return producers
+
+
+def bench(store_dir, load_keys):
+    start = time.time()
+    producers = start_store(store_dir, load_keys)
+    return producers, time.time() - start
+
+
+def bench_command(producer):
+    start = time.time()
+    producer._makeCommandInterest('/nfd/rib/register', prefix=producer.name)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    from ... import utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--files", default=10000, type=int)
+    args = utils.parse_args(parser=parser, include_name=False)
+
+    store_dir = build_store(args.files)
+    try:
+        print('%16s %12s' % ('', 'startup s'))
+        for label, load_keys in [('keys per file', True),
+                                 ('shared keys', False)]:
+            producers, startup = bench(store_dir, load_keys)
+            print('%16s %12.2f' % (label, startup))
+
+        # The shared keys are loaded by the first command interest.
+        print('first command interest: %.1f ms' %
+              (bench_command(producers[0]) * 1000))
+        print('next command interest: %.1f ms' %
+              (bench_command(producers[1]) * 1000))
+    finally:
+        shutil.rmtree(store_dir)
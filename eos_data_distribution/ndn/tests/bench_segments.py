@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Benchmark the per-chunk bookkeeping cost of chunks.Consumer.
+
+This replays the segment table operations a consumer does for every chunk
+(pick the next unsent segment, mark it outgoing, mark it complete, report
+progress, check for completion) against a ``SegmentMap`` and against the
+plain ``list`` it replaced, for growing segment counts. The per-chunk cost
+of the ``SegmentMap`` should stay flat; the ``list`` one grows linearly.
+
+    $ python -m eos_data_distribution.ndn.tests.bench_segments
+"""
+
+import argparse
+import time
+
+from eos_data_distribution.defaults import SegmentState
+from eos_data_distribution.ndn.segments import SegmentMap
+
+
+def replay_list(num_segments, pipeline):
+    segments = [SegmentState.UNSENT] * num_segments
+    outstanding = []
+
+    while True:
+        while len(outstanding) < pipeline:
+            try:
+                n = segments.index(SegmentState.UNSENT)
+            except ValueError:
+                break
+            segments[n] = SegmentState.OUTGOING
+            outstanding.append(n)
+
+        if not outstanding:
+            break
+
+        segments[outstanding.pop(0)] = SegmentState.COMPLETE
+        segments.count(SegmentState.COMPLETE)
+
+    assert segments.count(SegmentState.COMPLETE) == num_segments
+
+
+def replay_segment_map(num_segments, pipeline):
+    segments = SegmentMap(num_segments)
+    outstanding = []
+
+    while True:
+        while len(outstanding) < pipeline:
+            try:
+                n = segments.next_unsent()
+            except ValueError:
+                break
+            segments[n] = SegmentState.OUTGOING
+            outstanding.append(n)
+
+        if not outstanding:
+            break
+
+        segments[outstanding.pop(0)] = SegmentState.COMPLETE
+        segments.count(SegmentState.COMPLETE)
+
+    assert segments.is_complete()
+
+
+def bench(replay, num_segments, pipeline):
+    start = time.time()
+    replay(num_segments, pipeline)
+    elapsed = time.time() - start
+    return elapsed * 1e6 / num_segments
+
+
+if __name__ == '__main__':
+    from ... import utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--pipeline", default=5, type=int)
+    parser.add_argument("-m", "--max-segments", default=1000000, type=int)
+    parser.add_argument("--list-max-segments", default=20000, type=int,
+                        help="largest table to replay with a plain list")
+    args = utils.parse_args(parser=parser, include_name=False)
+
+    print('%12s %18s %18s' % ('segments', 'SegmentMap µs/chunk',
+                              'list µs/chunk'))
+    num_segments = 1000
+    while num_segments <= args.max_segments:
+        segment_map_cost = bench(replay_segment_map, num_segments,
+                                 args.pipeline)
+        if num_segments <= args.list_max_segments:
+            list_cost = '%18.2f' % bench(replay_list, num_segments,
+                                         args.pipeline)
+        else:
+            list_cost = '%18s' % '-'
+        print('%12d %18.2f %s' % (num_segments, segment_map_cost, list_cost))
+        num_segments *= 10
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Benchmark sending Data packets through GLibUnixTransport.
+
+A child process stands in for the forwarder: it listens on a Unix socket
+and reads everything sent to it. The producer side answers bursts of
+`pipeline` interests at a time, writing each packet with its own
+``sendall()`` as pyndn's ``UnixTransport`` does, or queueing them on a
+``GLibUnixTransport`` which flushes each burst with gathered writes. The
+CPU time used by the producer process is reported per MB served.
+
+    $ python -m eos_data_distribution.ndn.tests.bench_send
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+
+from gi.repository import GLib
+from pyndn import Data, Name
+from pyndn.transport.unix_transport import UnixTransport
+
+from eos_data_distribution.ndn import base
+
+
+def forward(server, total):
+    conn, _ = server.accept()
+    received = 0
+    while received < total:
+        data = conn.recv(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+    conn.close()
+
+
+class NullListener(object):
+
+    def onReceivedElement(self, element):
+        pass
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def send_unbatched(transport, packet, count, pipeline):
+    for i in range(count):
+        transport.send(packet)
+
+
+def send_batched(transport, packet, count, pipeline):
+    context = GLib.MainContext.default()
+    sent = 0
+    while sent < count:
+        burst = min(pipeline, count - sent)
+        for i in range(burst):
+            transport.send(packet)
+        sent += burst
+        while transport.bytes_sent < sent * len(packet):
+            context.iteration(True)
+
+
+def bench(transport, send, packet, count, pipeline):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'nfd.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        forwarder = multiprocessing.Process(
+            target=forward, args=(server, len(packet) * count))
+        forwarder.start()
+
+        transport.connect(UnixTransport.ConnectionInfo(path), NullListener(),
+                          None)
+        start = cpu_time()
+        send(transport, packet, count, pipeline)
+        elapsed = cpu_time() - start
+
+        forwarder.join()
+        transport.close()
+        server.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    megabytes = len(packet) * count / float(1024 * 1024)
+    return elapsed * 1000 / megabytes
+
+
+if __name__ == '__main__':
+    from ... import utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--packets", default=100000, type=int)
+    parser.add_argument("-s", "--size", default=4096, type=int,
+                        help="content size of each Data packet")
+    parser.add_argument("-p", "--pipeline", default=32, type=int,
+                        help="number of packets sent per burst")
+    args = utils.parse_args(parser=parser, include_name=False)
+
+    data = Data(Name('/endlessm/bench/%00%00'))
+    data.setContent(b'x' * args.size)
+    packet = data.wireEncode().buf()
+
+    print('%12s %16s' % ('', 'CPU ms/MB'))
+    print('%12s %16.2f' % ('unbatched', bench(UnixTransport(), send_unbatched,
+                                              packet, args.packets,
+                                              args.pipeline)))
+    transport = base.GLibUnixTransport()
+    cost = bench(transport, send_batched, packet, args.packets, args.pipeline)
+    print('%12s %16.2f  (%.1f packets per write)' %
+          ('batched', cost, args.packets / float(transport.writes)))
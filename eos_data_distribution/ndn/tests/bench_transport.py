@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright (C) 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Benchmark receiving Data packets through GLibUnixTransport.
+
+A thread stands in for the forwarder: it listens on a Unix socket and, once
+the transport has connected, writes a stream of encoded Data packets to it
+as fast as it can. The main loop is iterated until they have all been
+decoded, for a transport doing a single small read per wakeup (as it used
+to) and one draining the socket in batches.
+
+    $ python -m eos_data_distribution.ndn.tests.bench_transport
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from gi.repository import GLib
+from pyndn import Data, Name
+from pyndn.transport.unix_transport import UnixTransport
+from pyndn.util.common import Common
+
+from eos_data_distribution.ndn import base
+
+
+class Forwarder(threading.Thread):
+
+    """Serve count copies of a packet to the first client to connect."""
+
+    # Packets are written this many at a time.
+    BATCH = 64
+
+    def __init__(self, path, packet, count):
+        super(Forwarder, self).__init__()
+        self.daemon = True
+        self._packet = packet
+        self._count = count
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(1)
+
+    def run(self):
+        conn, _ = self._server.accept()
+        batch = self._packet * self.BATCH
+        for i in range(self._count // self.BATCH):
+            conn.sendall(batch)
+        conn.sendall(self._packet * (self._count % self.BATCH))
+        # Keep the connection open until the client is done with it.
+        conn.recv(1)
+        conn.close()
+        self._server.close()
+
+
+class ElementCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def onReceivedElement(self, element):
+        self.count += 1
+
+
+def bench(packet, count, **kwargs):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'nfd.sock')
+        forwarder = Forwarder(path, packet, count)
+        forwarder.start()
+
+        counter = ElementCounter()
+        transport = base.GLibUnixTransport(**kwargs)
+        context = GLib.MainContext.default()
+
+        start = time.time()
+        transport.connect(UnixTransport.ConnectionInfo(path), counter, None)
+        iterations = 0
+        while counter.count < count:
+            context.iteration(True)
+            iterations += 1
+        elapsed = time.time() - start
+
+        transport.close()
+        forwarder.join()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    megabytes = len(packet) * count / float(1024 * 1024)
+    return count / elapsed, iterations / megabytes, transport.reads / megabytes
+
+
+if __name__ == '__main__':
+    from ... import utils
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--packets", default=100000, type=int)
+    parser.add_argument("-s", "--size", default=4096, type=int,
+                        help="content size of each Data packet")
+    args = utils.parse_args(parser=parser, include_name=False)
+
+    data = Data(Name('/endlessm/bench/%00%00'))
+    data.setContent(b'x' * args.size)
+    packet = data.wireEncode().toBytes()
+
+    configurations = [
+        ('single read', dict(recv_budget=1,
+                             recv_buffer_size=Common.MAX_NDN_PACKET_SIZE,
+                             rcvbuf=None)),
+        ('batched', dict()),
+    ]
+
+    print('%12s %12s %18s %12s' % ('', 'packets/s', 'iterations/MB',
+                                   'reads/MB'))
+    for label, kwargs in configurations:
+        print('%12s %12.0f %18.1f %12.1f' % ((label, ) +
+                                            bench(packet, args.packets,
+                                                  **kwargs)))
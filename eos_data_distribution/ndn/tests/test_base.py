@@ -0,0 +1,274 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.base
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import base
+from eos_data_distribution.ndn.tests import test_file
+from pyndn import Interest, Name
+import logging
+import unittest
+
+
+class TestRttEstimator(unittest.TestCase):
+    """Test the RTO computation of RttEstimator."""
+
+    def test_initial_rto(self):
+        estimator = base.RttEstimator(initial_rto=1000)
+        self.assertEqual(estimator.get_rto(), 1000)
+        self.assertIsNone(estimator.srtt)
+
+    def test_first_measurement(self):
+        estimator = base.RttEstimator(min_rto=1)
+        estimator.add_measurement(100)
+        self.assertEqual(estimator.srtt, 100)
+        self.assertEqual(estimator.rttvar, 50)
+        self.assertEqual(estimator.get_rto(), 100 + 4 * 50)
+
+    def test_converges(self):
+        estimator = base.RttEstimator(min_rto=1)
+        for i in range(100):
+            estimator.add_measurement(40)
+        self.assertAlmostEqual(estimator.srtt, 40)
+        self.assertLess(estimator.get_rto(), 41)
+
+    def test_backoff(self):
+        estimator = base.RttEstimator(initial_rto=500, max_rto=3000)
+        self.assertEqual(estimator.get_rto(1), 1000)
+        self.assertEqual(estimator.get_rto(2), 2000)
+        self.assertEqual(estimator.get_rto(3), 3000)
+        self.assertEqual(estimator.get_rto(10), 3000)
+
+    def test_floor(self):
+        estimator = base.RttEstimator(min_rto=200)
+        estimator.add_measurement(1)
+        self.assertEqual(estimator.get_rto(), 200)
+
+
+class TestConsumerRetries(unittest.TestCase):
+    """Test re-expression of timed out interests by base.Consumer."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    def setUp(self):
+        self.face = test_file.MockFace()
+        self._failed = []
+
+    def _on_interest_failed(self, consumer, interest):
+        self._failed.append(str(interest.getName()))
+
+    def test_backoff(self):
+        consumer = base.Consumer('/file-name', face=self.face,
+                                 rtt_estimator=base.RttEstimator(
+                                     initial_rto=500, max_rto=60000))
+        consumer.expressInterest(try_again=True)
+
+        lifetimes = []
+        for i in range(4):
+            (interest, _, _) = self.face.getInterest('/file-name')
+            lifetimes.append(interest.getInterestLifetimeMilliseconds())
+            self.face.callInterestTimeout('/file-name')
+
+        self.assertEqual(lifetimes, [500, 1000, 2000, 4000])
+
+    def test_retry_budget(self):
+        consumer = base.Consumer('/file-name', face=self.face, max_retries=3)
+        consumer.connect('interest-failed', self._on_interest_failed)
+        consumer.expressInterest(try_again=True)
+
+        for i in range(3):
+            self.face.callInterestTimeout('/file-name')
+            self.assertEqual(self.face.getInterestNames(), set(['/file-name']))
+            self.assertEqual(self._failed, [])
+
+        self.face.callInterestTimeout('/file-name')
+        self.assertEqual(self.face.getInterestNames(), set())
+        self.assertEqual(self._failed, ['/file-name'])
+
+
+class TestPendingInterestTable(unittest.TestCase):
+    """Test the bookkeeping of PendingInterestTable."""
+
+    def make_interest(self, name, lifetime=1000):
+        interest = Interest(Name(name))
+        interest.setInterestLifetimeMilliseconds(lifetime)
+        return interest
+
+    def test_add_discard(self):
+        pit = base.PendingInterestTable()
+        entry = pit.add(self.make_interest('/a'), now=0)
+        entry.pending_id = 7
+        self.assertEqual(len(pit), 1)
+        self.assertIn('/a', pit)
+        self.assertEqual(pit[Name('/a')], 7)
+
+        pit.discard(entry)
+        self.assertEqual(len(pit), 0)
+        self.assertNotIn('/a', pit)
+
+    def test_replace(self):
+        # Discarding a replaced entry leaves the new one alone.
+        pit = base.PendingInterestTable()
+        old = pit.add(self.make_interest('/a'), now=0)
+        new = pit.add(self.make_interest('/a'), now=10)
+        self.assertEqual(len(pit), 1)
+        pit.discard(old)
+        self.assertIn('/a', pit)
+        pit.discard(new)
+        self.assertEqual(len(pit), 0)
+
+    def test_expire(self):
+        pit = base.PendingInterestTable()
+        grace = int(base.PIT_GRACE_PERIOD * 1000)
+        pit.add(self.make_interest('/short', 100), now=0)
+        pit.add(self.make_interest('/long', 10000), now=0)
+        pit.add(self.make_interest('/default', None), now=0)
+
+        pit.expire(now=100 * 1000 + grace - 1)
+        self.assertEqual(len(pit), 3)
+        pit.expire(now=100 * 1000 + grace)
+        self.assertEqual(len(pit), 2)
+        self.assertNotIn('/short', pit)
+
+        # Adding an entry also drops the expired ones.
+        pit.add(self.make_interest('/new'),
+                now=int(base.DEFAULT_INTEREST_LIFETIME * 1000) + grace)
+        self.assertEqual(len(pit), 2)
+        self.assertNotIn('/default', pit)
+
+    def test_max_size(self):
+        pit = base.PendingInterestTable(max_size=2)
+        pit.add(self.make_interest('/a', 3000), now=0)
+        pit.add(self.make_interest('/b', 1000), now=0)
+        pit.add(self.make_interest('/c', 2000), now=0)
+        self.assertEqual(len(pit), 2)
+        self.assertNotIn('/b', pit)
+
+    def test_pop(self):
+        pit = base.PendingInterestTable()
+        pit.add(self.make_interest('/a'), now=0).pending_id = 3
+        self.assertEqual(pit.pop('/a'), 3)
+        self.assertRaises(KeyError, pit.pop, '/a')
+
+
+class TestConsumerPit(unittest.TestCase):
+    """Test base.Consumer cleans up its PIT."""
+
+    def setUp(self):
+        self.face = test_file.MockFace()
+        self.segments = [
+            test_file.TestDirConsumer.build_segment('/file-name', i, 2)
+            for i in range(2)]
+
+    def test_cleaned_on_data(self):
+        consumer = base.Consumer('/file-name', face=self.face)
+        consumer.expressInterest()
+        self.assertEqual(consumer.get_property('pit-size'), 1)
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.assertEqual(consumer.get_property('pit-size'), 0)
+
+    def test_cleaned_on_timeout(self):
+        consumer = base.Consumer('/file-name', face=self.face, max_retries=1)
+        consumer.expressInterest(try_again=True)
+
+        # Re-expressing the interest keeps a single entry for it.
+        self.face.callInterestTimeout('/file-name')
+        self.assertEqual(len(consumer.pit), 1)
+        self.face.callInterestTimeout('/file-name')
+        self.assertEqual(len(consumer.pit), 0)
+
+
+
+class UpstreamRecordingFace(base.GLibUnixFace):
+    """GLibUnixFace which records interests instead of sending them."""
+
+    def __init__(self):
+        super(UpstreamRecordingFace, self).__init__()
+        self.upstream = {}
+
+    def _expressUpstream(self, interest, onData, onTimeout):
+        pending_id = len(self.upstream)
+        self.upstream[pending_id] = (interest, onData, onTimeout)
+        return pending_id
+
+    def _removeUpstream(self, pending_id):
+        del self.upstream[pending_id]
+
+
+class TestInterestAggregation(unittest.TestCase):
+    """Test GLibUnixFace collapses identical interests."""
+
+    def setUp(self):
+        self.face = UpstreamRecordingFace()
+        self.received = []
+
+    def on_data(self, tag):
+        return lambda interest, data: self.received.append((tag, interest))
+
+    def test_collapsed(self):
+        interest1 = Interest(Name('/a'))
+        interest2 = Interest(Name('/a'))
+        id1 = self.face.expressInterest(interest1, self.on_data(1))
+        id2 = self.face.expressInterest(interest2, self.on_data(2))
+        self.assertNotEqual(id1, id2)
+        self.assertEqual(len(self.face.upstream), 1)
+        self.assertEqual(self.face.collapsed_interests, 1)
+
+        (interest, on_data, _) = self.face.upstream[0]
+        on_data(interest, None)
+        self.assertEqual(self.received, [(1, interest1), (2, interest2)])
+
+        # Once answered, the interest is sent again.
+        self.face.expressInterest(Interest(Name('/a')), self.on_data(3))
+        self.assertEqual(len(self.face.upstream), 2)
+
+    def test_freshness_not_collapsed(self):
+        fresh = Interest(Name('/a'))
+        fresh.setMustBeFresh(True)
+        self.face.expressInterest(fresh, self.on_data(1))
+        self.face.expressInterest(Interest(Name('/a')), self.on_data(2))
+        self.assertEqual(len(self.face.upstream), 2)
+
+    def test_timeout(self):
+        timed_out = []
+        for i in range(2):
+            self.face.expressInterest(Interest(Name('/a')), self.on_data(i),
+                                      timed_out.append)
+        (interest, _, on_timeout) = self.face.upstream[0]
+        on_timeout(interest)
+        self.assertEqual(len(timed_out), 2)
+
+    def test_remove(self):
+        id1 = self.face.expressInterest(Interest(Name('/a')), self.on_data(1))
+        id2 = self.face.expressInterest(Interest(Name('/a')), self.on_data(2))
+        self.face.removePendingInterest(id1)
+        self.assertEqual(len(self.face.upstream), 1)
+        self.face.removePendingInterest(id2)
+        self.assertEqual(self.face.upstream, {})
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
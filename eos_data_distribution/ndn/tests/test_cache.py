@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.cache
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import cache
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test the byte-bounded LRUCache."""
+
+    def test_get_put(self):
+        lru = cache.LRUCache(10)
+        self.assertIsNone(lru.get('a'))
+        lru.put('a', 'xxx')
+        self.assertEqual(lru.get('a'), 'xxx')
+        self.assertEqual(lru.size, 3)
+        self.assertEqual((lru.hits, lru.misses), (1, 1))
+
+    def test_replace(self):
+        lru = cache.LRUCache(10)
+        lru.put('a', 'xxx')
+        lru.put('a', 'yyyyy')
+        self.assertEqual(lru.size, 5)
+        self.assertEqual(len(lru), 1)
+
+    def test_evicts_least_recently_used(self):
+        lru = cache.LRUCache(10)
+        lru.put('a', 'aaaa')
+        lru.put('b', 'bbbb')
+        lru.get('a')
+        lru.put('c', 'cccc')
+
+        self.assertIn('a', lru)
+        self.assertNotIn('b', lru)
+        self.assertIn('c', lru)
+        self.assertEqual(lru.size, 8)
+        self.assertEqual(lru.evictions, 1)
+
+    def test_too_large(self):
+        lru = cache.LRUCache(10)
+        lru.put('a', 'aaaa')
+        lru.put('b', 'b' * 11)
+        self.assertNotIn('b', lru)
+        self.assertIn('a', lru)
+
+    def test_remove(self):
+        lru = cache.LRUCache(10)
+        lru.put('a', 'aaaa')
+        self.assertEqual(lru.remove('a'), 'aaaa')
+        self.assertIsNone(lru.remove('a'))
+        self.assertEqual(lru.size, 0)
+
+    def test_hit_rate(self):
+        lru = cache.LRUCache(10)
+        self.assertEqual(lru.hit_rate, 0)
+        lru.put('a', 'aaaa')
+        lru.get('a')
+        lru.get('a')
+        lru.get('a')
+        lru.get('b')
+        self.assertEqual(lru.hit_rate, 0.75)
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def test_default_is_shared(self):
+        self.assertIs(cache.get_default_chunk_cache(),
+                      cache.get_default_chunk_cache())
+
+
+class TestDataCache(unittest.TestCase):
+
+    def test_default_is_shared(self):
+        self.assertIs(cache.get_default_data_cache(),
+                      cache.get_default_data_cache())
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
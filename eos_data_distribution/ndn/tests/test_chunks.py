@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.chunks
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import cache, chunks
+from eos_data_distribution.ndn.tests import test_file
+from pyndn import Interest, Name
+import logging
+import unittest
+
+
+class MemoryConsumer(chunks.Consumer):
+    """chunks.Consumer which keeps the chunks it receives in a dict."""
+
+    def __init__(self, *args, **kwargs):
+        super(MemoryConsumer, self).__init__(*args, **kwargs)
+        self.chunks = {}
+
+    def _save_chunk(self, n, data):
+        self.chunks[n] = data.getContent().toBytes()
+        return True
+
+
+class MemoryProducer(chunks.Producer):
+    """chunks.Producer which serves chunks from a list, counting reads."""
+
+    def __init__(self, name, chunks, *args, **kwargs):
+        super(MemoryProducer, self).__init__(name, *args, **kwargs)
+        self.chunks = chunks
+        self.reads = 0
+
+    def _get_final_segment(self):
+        return len(self.chunks) - 1
+
+    def _get_chunk(self, n):
+        self.reads += 1
+        return self.chunks[n]
+
+
+class RecordingFace(test_file.MockFace):
+    """MockFace which records the packets sent through it."""
+
+    def __init__(self):
+        super(RecordingFace, self).__init__()
+        self.sent = []
+
+    def putData(self, data):
+        self.sent.append(data.wireEncode().toBytes())
+
+    def send(self, encoding):
+        self.sent.append(bytes(encoding))
+
+
+def segment_name(name, n):
+    return '%s/%%00%%%02X' % (name, n)
+
+
+class TestConsumerWindow(unittest.TestCase):
+    """Test the congestion window of chunks.Consumer."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    def setUp(self):
+        self.face = test_file.MockFace()
+        self.n_segments = 20
+        self.segments = [
+            test_file.TestDirConsumer.build_segment('/file-name', i,
+                                                    self.n_segments)
+            for i in range(0, self.n_segments)]
+
+    def assertFaceNamesEqual(self, names):
+        self.assertEqual(self.face.getInterestNames(), set(names))
+
+    def assertWindow(self, consumer, window):
+        self.assertAlmostEqual(consumer.get_property('window'), window)
+
+    def test_window_grows(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=2)
+        self.assertWindow(consumer, 2)
+
+        consumer.start()
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.assertWindow(consumer, 3)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(1, 4)])
+
+        self.face.callInterestDone(segment_name('/file-name', 1),
+                                   self.segments[1])
+        self.assertWindow(consumer, 4)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(2, 6)])
+
+    def test_window_ceiling(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=2,
+                                  max_window=3)
+        consumer.start()
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.face.callInterestDone(segment_name('/file-name', 1),
+                                   self.segments[1])
+        self.assertWindow(consumer, 3)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(2, 5)])
+
+    def test_window_shrinks_on_timeout(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=2)
+        consumer.start()
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.face.callInterestDone(segment_name('/file-name', 1),
+                                   self.segments[1])
+        self.assertWindow(consumer, 4)
+
+        # The first loss halves the window; the interest is re-expressed.
+        self.face.callInterestTimeout(segment_name('/file-name', 2))
+        self.assertWindow(consumer, 2)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(2, 6)])
+
+        # Losses in the same window are the same congestion event.
+        self.face.callInterestTimeout(segment_name('/file-name', 3))
+        self.assertWindow(consumer, 2)
+
+        # Having shrunk below the number of outstanding interests, no new
+        # interests are expressed until enough of them are answered.
+        self.face.callInterestDone(segment_name('/file-name', 2),
+                                   self.segments[2])
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(3, 6)])
+
+    def test_window_backlogged(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=2)
+        consumer._is_backlogged = lambda: True
+        consumer.start()
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.face.callInterestDone(segment_name('/file-name', 1),
+                                   self.segments[1])
+        self.assertWindow(consumer, 2)
+
+        consumer._is_backlogged = lambda: False
+        self.face.callInterestDone(segment_name('/file-name', 2),
+                                   self.segments[2])
+        self.assertWindow(consumer, 3)
+
+    def test_window_floor(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=4,
+                                  min_window=3)
+        consumer.start()
+        self.face.callInterestTimeout('/file-name')
+        self.assertWindow(consumer, 3)
+        self.face.callInterestTimeout('/file-name')
+        self.assertWindow(consumer, 3)
+        self.assertFaceNamesEqual(['/file-name'])
+
+
+    def test_retries_exhausted(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=3,
+                                  max_retries=1)
+        failed = []
+        consumer.connect('failed', lambda c, reason: failed.append(reason))
+        consumer.start()
+        self.face.callInterestDone('/file-name', self.segments[0])
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(1, 5)])
+
+        self.face.callInterestTimeout(segment_name('/file-name', 2))
+        self.assertEqual(failed, [])
+        self.face.callInterestTimeout(segment_name('/file-name', 2))
+
+        # The other interests are cancelled, and nothing more is requested.
+        self.assertEqual(len(failed), 1)
+        self.assertFaceNamesEqual([])
+        self.assertEqual(consumer._num_outstanding_interests, 0)
+
+        # Restarting picks up from the segments not received.
+        consumer.start()
+        self.assertIn(segment_name('/file-name', 1),
+                      self.face.getInterestNames())
+
+
+class TestConsumerRanges(unittest.TestCase):
+    """Test fetching only some ranges of the content."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    def setUp(self):
+        self.face = test_file.MockFace()
+        self.n_segments = 20
+        self.segments = [
+            test_file.TestDirConsumer.build_segment('/file-name', i,
+                                                    self.n_segments)
+            for i in range(0, self.n_segments)]
+        self.progress = []
+        self.complete = False
+
+    def _on_progress(self, consumer, progress):
+        self.progress.append(progress)
+
+    def _on_complete(self, consumer):
+        self.complete = True
+
+    def assertFaceNamesEqual(self, names):
+        self.assertEqual(self.face.getInterestNames(), set(names))
+
+    def reply(self, n):
+        name = '/file-name' if n == 0 else segment_name('/file-name', n)
+        self.face.callInterestDone(name, self.segments[n])
+
+    def test_byte_range_to_segments(self):
+        self.assertEqual(chunks.byte_range_to_segments(0, 1, 16), (0, 1))
+        self.assertEqual(chunks.byte_range_to_segments(0, 16, 16), (0, 1))
+        self.assertEqual(chunks.byte_range_to_segments(15, 17, 16), (0, 2))
+        self.assertEqual(chunks.byte_range_to_segments(32, 48, 16), (2, 3))
+
+    def test_invalid_range(self):
+        self.assertRaises(ValueError, MemoryConsumer, '/file-name',
+                          face=self.face, segment_ranges=[(3, 3)])
+        self.assertRaises(ValueError, MemoryConsumer, '/file-name',
+                          face=self.face, segment_ranges=[(-1, 3)])
+
+    def test_segment_ranges(self):
+        consumer = MemoryConsumer('/file-name', face=self.face, pipeline=10,
+                                  segment_ranges=[(0, 2), (5, 7), (6, 8)])
+        consumer.connect('progress', self._on_progress)
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+        self.reply(0)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in [1, 5, 6, 7]])
+        self.assertEqual(self.progress, [20])
+
+        for i in [1, 5, 6, 7]:
+            self.reply(i)
+        self.assertTrue(self.complete)
+        self.assertEqual(sorted(consumer.chunks.keys()), [0, 1, 5, 6, 7])
+        self.assertEqual(self.progress[-1], 100)
+
+    def test_byte_ranges(self):
+        # The ranges are clipped to the end of the content, and the first
+        # segment is dropped as it was not requested.
+        chunk_size = chunks.CHUNK_SIZE
+        consumer = MemoryConsumer(
+            '/file-name', face=self.face, pipeline=10,
+            byte_ranges=[(3 * chunk_size + 10, 4 * chunk_size + 1),
+                         (19 * chunk_size, 30 * chunk_size)])
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+        self.reply(0)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in [3, 4, 19]])
+
+        for i in [3, 4, 19]:
+            self.reply(i)
+        self.assertTrue(self.complete)
+        self.assertEqual(sorted(consumer.chunks.keys()), [3, 4, 19])
+
+    def test_range_past_end(self):
+        consumer = MemoryConsumer('/file-name', face=self.face,
+                                  segment_ranges=[(100, 200)])
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+        self.reply(0)
+        self.assertTrue(self.complete)
+        self.assertEqual(consumer.chunks, {})
+
+
+
+
+class TestProducerDataCache(unittest.TestCase):
+    """Test answering repeated interests from a DataCache."""
+
+    def setUp(self):
+        self.face = RecordingFace()
+
+    def request(self, producer, name):
+        producer._on_interest(None, None, Interest(Name(name)), self.face,
+                              None, None)
+
+    def test_repeat_served_from_cache(self):
+        data_cache = cache.DataCache(1024 * 1024)
+        producer = MemoryProducer('/file-name', [b'aaaa', b'bbbb'],
+                                  face=self.face, data_cache=data_cache)
+        self.request(producer, segment_name('/file-name', 1))
+        self.request(producer, segment_name('/file-name', 1))
+        self.assertEqual(producer.reads, 1)
+        self.assertEqual(len(self.face.sent), 2)
+        self.assertEqual(self.face.sent[0], self.face.sent[1])
+        self.assertEqual((data_cache.hits, data_cache.misses), (1, 1))
+
+        # The bare name is answered with the first segment, and cached as
+        # such.
+        self.request(producer, '/file-name')
+        self.request(producer, segment_name('/file-name', 0))
+        self.assertEqual(producer.reads, 2)
+
+    def test_no_cache(self):
+        producer = MemoryProducer('/file-name', [b'aaaa'], face=self.face)
+        self.request(producer, segment_name('/file-name', 0))
+        self.request(producer, segment_name('/file-name', 0))
+        self.assertEqual(producer.reads, 2)
+        self.assertEqual(len(self.face.sent), 2)
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
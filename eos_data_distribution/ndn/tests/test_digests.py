@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.digests
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import digests
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestDigestTable(unittest.TestCase):
+    """Test building and checking digest tables."""
+
+    chunk_size = 1024
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'file-name')
+        # Three full chunks and a short one.
+        self.content = b''.join(chr(ord('a') + i) * self.chunk_size
+                                for i in range(3)) + b'tail'
+        with open(self.filename, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def chunk(self, n):
+        return self.content[n * self.chunk_size:(n + 1) * self.chunk_size]
+
+    def build_table(self):
+        fd = os.open(self.filename, os.O_RDONLY)
+        try:
+            return digests.DigestTable.from_fd(fd, self.chunk_size,
+                                               len(self.content))
+        finally:
+            os.close(fd)
+
+    def test_from_fd(self):
+        table = self.build_table()
+        self.assertEqual(len(table), 4)
+        for n in range(4):
+            self.assertEqual(table[n], hashlib.sha256(self.chunk(n)).digest())
+        with self.assertRaises(IndexError):
+            table[4]
+
+    def test_round_trip(self):
+        table = self.build_table()
+        copy = digests.DigestTable(table.to_bytes())
+        self.assertEqual([copy[n] for n in range(4)],
+                         [table[n] for n in range(4)])
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            digests.DigestTable(b'x' * (digests.DIGEST_SIZE + 1))
+
+    def test_verify(self):
+        table = self.build_table()
+        self.assertTrue(table.verify(0, self.chunk(0)))
+        self.assertTrue(table.verify(3, self.chunk(3)))
+        self.assertFalse(table.verify(1, self.chunk(0)))
+        self.assertFalse(table.verify(4, self.chunk(0)))
+
+    def test_verify_part_file(self):
+        table = self.build_table()
+        with open(self.filename, 'r+b') as f:
+            f.seek(self.chunk_size + 10)
+            f.write(b'!')
+
+        self.assertEqual(digests.verify_part_file(
+            self.filename, table, self.chunk_size, [0, 1, 2, 3]), [1])
+
+    def test_verify_truncated_part_file(self):
+        table = self.build_table()
+        with open(self.filename, 'r+b') as f:
+            f.truncate(2 * self.chunk_size)
+
+        self.assertEqual(digests.verify_part_file(
+            self.filename, table, self.chunk_size, [0, 2, 3]), [2, 3])
+
+    def test_verify_missing_part_file(self):
+        table = self.build_table()
+        self.assertEqual(digests.verify_part_file(
+            self.filename + '.part', table, self.chunk_size, [0, 2]), [0, 2])
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
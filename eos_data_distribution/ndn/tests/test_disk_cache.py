@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.disk_cache
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import disk_cache, iopool
+from gi.repository import GLib
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+CHUNK_SIZE = 4096
+
+
+class TestDiskCache(unittest.TestCase):
+    """Test storage and eviction of chunks in DiskCache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_cache(self, **kwargs):
+        return disk_cache.DiskCache(self.cache_dir, **kwargs)
+
+    def get(self, entry, n):
+        # Without an I/O pool, the chunk is read right away.
+        result = []
+        entry.get(n, result.append)
+        self.assertEqual(len(result), 1)
+        return result[0]
+
+    def test_put_get(self):
+        cache = self.make_cache()
+        entry = cache.entry('http://a', 2 * CHUNK_SIZE + 10, CHUNK_SIZE)
+        self.assertIsNone(self.get(entry, 0))
+
+        entry.put(0, memoryview(b'a' * CHUNK_SIZE))
+        entry.put(2, b'c' * 10)
+        self.assertEqual(self.get(entry, 0), b'a' * CHUNK_SIZE)
+        self.assertIsNone(self.get(entry, 1))
+        self.assertEqual(self.get(entry, 2), b'c' * 10)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_put_length(self):
+        cache = self.make_cache()
+        entry = cache.entry('http://a', 2 * CHUNK_SIZE + 10, CHUNK_SIZE)
+
+        # Only the last chunk may be short, and only as short as the content.
+        entry.put(0, b'a' * 10)
+        entry.put(2, b'c' * 5)
+        entry.put(3, b'')
+        self.assertIsNone(self.get(entry, 0))
+        self.assertIsNone(self.get(entry, 2))
+        self.assertEqual(cache.size, 0)
+
+    def test_io_pool(self):
+        cache = self.make_cache(io_pool=iopool.IOPool())
+        entry = cache.entry('http://a', 2 * CHUNK_SIZE, CHUNK_SIZE)
+        entry.put(0, b'a' * CHUNK_SIZE)
+        # Chunks are only found once written.
+        self.assertIsNone(self.get(entry, 0))
+
+        context = GLib.MainContext.default()
+        deadline = time.time() + 10
+        while cache.io_pool.pending and time.time() < deadline:
+            context.iteration(False)
+
+        # Chunks are read from the pool too.
+        result = []
+        entry.get(0, result.append)
+        self.assertEqual(result, [])
+        while not result and time.time() < deadline:
+            context.iteration(False)
+        self.assertEqual(result, [b'a' * CHUNK_SIZE])
+
+        cache.close()
+        while cache.io_pool.pending and time.time() < deadline:
+            context.iteration(False)
+        cache = self.make_cache()
+        self.assertEqual(self.get(cache.lookup('http://a'), 0),
+                         b'a' * CHUNK_SIZE)
+
+    def test_open_failed(self):
+        cache = self.make_cache()
+        entry = cache.entry('http://a', 2 * CHUNK_SIZE, CHUNK_SIZE)
+        os.mkdir(cache._path('http://a') + '.sgt')
+
+        # An entry whose files cannot be opened is treated as empty.
+        entry.put(0, b'a' * CHUNK_SIZE)
+        self.assertIsNone(self.get(entry, 0))
+        self.assertEqual((cache.size, cache.misses), (0, 1))
+
+    def test_persistent(self):
+        cache = self.make_cache()
+        entry = cache.entry('http://a', 2 * CHUNK_SIZE, CHUNK_SIZE)
+        entry.put(1, b'b' * CHUNK_SIZE)
+        cache.close()
+
+        cache = self.make_cache()
+        entry = cache.lookup('http://a')
+        self.assertEqual(entry.size, 2 * CHUNK_SIZE)
+        self.assertIsNone(self.get(entry, 0))
+        self.assertEqual(self.get(entry, 1), b'b' * CHUNK_SIZE)
+
+        # A different size means different content.
+        entry = cache.entry('http://a', 3 * CHUNK_SIZE, CHUNK_SIZE)
+        self.assertIsNone(self.get(entry, 1))
+
+    def test_evict_lru(self):
+        cache = self.make_cache(max_bytes=3 * CHUNK_SIZE)
+        entries = [cache.entry(url, 4 * CHUNK_SIZE, CHUNK_SIZE)
+                   for url in ('http://a', 'http://b')]
+        entries[0].put(0, b'a' * CHUNK_SIZE)
+        entries[1].put(0, b'b' * CHUNK_SIZE)
+        self.get(entries[0], 0)
+
+        entries[1].put(1, b'b' * CHUNK_SIZE)
+        self.assertEqual(cache.evictions, 0)
+        entries[1].put(2, b'b' * CHUNK_SIZE)
+        self.assertEqual(cache.evictions, 1)
+        self.assertNotIn('http://a', cache)
+        self.assertTrue(entries[0].removed)
+        self.assertEqual(cache.size, 3 * CHUNK_SIZE)
+
+    def test_max_open(self):
+        cache = self.make_cache(max_open=1)
+        entries = [cache.entry(url, CHUNK_SIZE, CHUNK_SIZE)
+                   for url in ('http://a', 'http://b')]
+        entries[0].put(0, b'a' * CHUNK_SIZE)
+        entries[1].put(0, b'b' * CHUNK_SIZE)
+        self.assertEqual(list(cache._open_entries), ['http://b'])
+        # Closed entries are opened again when used.
+        self.assertEqual(self.get(entries[0], 0), b'a' * CHUNK_SIZE)
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.dispatch
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.defaults import RouteCost
+from eos_data_distribution.names import Name
+from eos_data_distribution.ndn import dispatch
+from eos_data_distribution.ndn.dbus import base, chunks
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestNameTrie(unittest.TestCase):
+    """Test name lookups in NameTrie."""
+
+    def test_set_get(self):
+        trie = dispatch.NameTrie()
+        trie['/a/b'] = 1
+        trie[Name('/a/c')] = 2
+        self.assertEqual(len(trie), 2)
+        self.assertEqual(trie['/a/b'], 1)
+        self.assertEqual(trie[Name('/a/c')], 2)
+        self.assertIn('/a/b', trie)
+        self.assertNotIn('/a', trie)
+        self.assertRaises(KeyError, lambda: trie['/a'])
+
+        trie['/a/b'] = 3
+        self.assertEqual(len(trie), 2)
+        self.assertEqual(trie['/a/b'], 3)
+
+    def test_longest_prefix(self):
+        trie = dispatch.NameTrie()
+        trie['/a'] = 'a'
+        trie['/a/b.shard'] = 'b'
+        trie['/a/b.shard/digests'] = 'digests'
+
+        self.assertEqual(trie.longest_prefix('/a/b.shard'), 'b')
+        self.assertEqual(trie.longest_prefix('/a/b.shard/digests'), 'digests')
+        self.assertEqual(trie.longest_prefix('/a/b.shard/other'), 'b')
+        self.assertEqual(trie.longest_prefix('/a/b.shardx'), 'a')
+        self.assertIsNone(trie.longest_prefix('/c'))
+
+    def test_delete(self):
+        trie = dispatch.NameTrie()
+        trie['/a/b/c'] = 1
+        trie['/a'] = 2
+        del trie['/a/b/c']
+        self.assertEqual(len(trie), 1)
+        self.assertEqual(trie.longest_prefix('/a/b/c'), 2)
+        # Nodes left empty are pruned.
+        self.assertEqual(list(trie._root.children['a'].children), [])
+
+        self.assertRaises(KeyError, trie.__delitem__, '/a/b/c')
+        self.assertRaises(KeyError, trie.__delitem__, '/a/b')
+
+
+class MockProducer(object):
+    """Stand in for the producers a Dispatcher routes to."""
+
+    def __init__(self, name, cost=None):
+        self.name = Name(name)
+        self.cost = cost
+        self.calls = []
+        self._workers = dict()
+
+    def _on_request_interest(self, name, skeleton, *args):
+        self.calls.append(('request-interest', name.toString()))
+        self._workers[name.toString()] = True
+        return True
+
+    def _on_complete(self, name, skeleton):
+        self.calls.append(('complete', name.toString()))
+        return True
+
+
+class MockDBus(object):
+    """Record the (un)registrations of a producer, and its cost then."""
+
+    def __init__(self, producer):
+        self.producer = producer
+        self.calls = []
+
+    def register_path_for_name(self, name, callbacks):
+        self.calls.append(('register', Name(name).toString(),
+                           self.producer.cost))
+        return True
+
+    def unregister_path_for_name(self, name):
+        self.calls.append(('unregister', Name(name).toString(),
+                           self.producer.cost))
+
+
+class TestDispatcher(unittest.TestCase):
+    """Test routing of requests by Dispatcher."""
+
+    def test_longest_prefix(self):
+        dispatcher = dispatch.Dispatcher('/dispatch/a')
+        shard = MockProducer('/dispatch/a/b.shard')
+        digests = MockProducer('/dispatch/a/b.shard/digests')
+        dispatcher.add(shard)
+        dispatcher.add(digests)
+
+        dispatcher._on_request_interest(Name('/dispatch/a/b.shard/digests'),
+                                        None)
+        dispatcher._on_request_interest(Name('/dispatch/a/b.shard'), None)
+        dispatcher._on_complete(Name('/dispatch/a/b.shard'), None)
+
+        self.assertEqual(digests.calls, [
+            ('request-interest', '/dispatch/a/b.shard/digests')])
+        self.assertEqual(shard.calls, [
+            ('request-interest', '/dispatch/a/b.shard'),
+            ('complete', '/dispatch/a/b.shard')])
+
+    def test_shared_name(self):
+        dispatcher = dispatch.Dispatcher('/dispatch/b')
+        http = MockProducer('/dispatch/b/c.shard', cost=RouteCost.HTTP)
+        usb = MockProducer('/dispatch/b/c.shard', cost=RouteCost.USB)
+        dispatcher.add(http)
+        dispatcher.add(usb)
+        self.assertEqual(len(dispatcher), 1)
+
+        # The cheapest producer answers.
+        dispatcher._on_request_interest(Name('/dispatch/b/c.shard'), None)
+        self.assertEqual(usb.calls, [
+            ('request-interest', '/dispatch/b/c.shard')])
+
+        # Removing one producer leaves the other one.
+        dispatcher.remove(usb)
+        dispatcher._on_request_interest(Name('/dispatch/b/c.shard'), None)
+        self.assertEqual(http.calls, [
+            ('request-interest', '/dispatch/b/c.shard')])
+        dispatcher.remove(http)
+        self.assertEqual(len(dispatcher), 0)
+
+    def test_complete_goes_to_worker(self):
+        dispatcher = dispatch.Dispatcher('/dispatch/c')
+        http = MockProducer('/dispatch/c/d.shard', cost=RouteCost.HTTP)
+        dispatcher.add(http)
+        dispatcher._on_request_interest(Name('/dispatch/c/d.shard'), None)
+
+        # A cheaper producer added meanwhile does not get the completion.
+        usb = MockProducer('/dispatch/c/d.shard', cost=RouteCost.USB)
+        dispatcher.add(usb)
+        dispatcher._on_complete(Name('/dispatch/c/d.shard'), None)
+        self.assertEqual(http.calls[-1], ('complete', '/dispatch/c/d.shard'))
+        self.assertEqual(usb.calls, [])
+
+    def test_shared_cost(self):
+        prefix = '/dispatch/shared'
+        self.addCleanup(dispatch.dispatcher_instances.pop, prefix)
+        dispatcher = dispatch.get_dispatcher(prefix, cost=RouteCost.HTTP)
+        self.assertIs(dispatch.get_dispatcher(prefix, cost=RouteCost.USB),
+                      dispatcher)
+        self.assertIs(dispatch.get_dispatcher(prefix), dispatcher)
+        self.assertEqual(dispatcher.cost, RouteCost.USB)
+
+    def test_shared_cost_registered(self):
+        prefix = '/dispatch/registered'
+        self.addCleanup(dispatch.dispatcher_instances.pop, prefix)
+        dispatcher = dispatch.get_dispatcher(prefix, cost=RouteCost.HTTP)
+        self.assertTrue(dispatcher.registered)
+        dbus = dispatcher._dbus = MockDBus(dispatcher)
+
+        # A dearer caller leaves the registration alone.
+        dispatch.get_dispatcher(prefix, cost=RouteCost.DEFAULT)
+        self.assertEqual(dbus.calls, [])
+
+        # A cheaper one has the prefix registered again, with its cost.
+        dispatch.get_dispatcher(prefix, cost=RouteCost.USB)
+        self.assertEqual(dbus.calls, [
+            ('unregister', prefix, RouteCost.HTTP),
+            ('register', prefix, RouteCost.USB)])
+        self.assertTrue(dispatcher.registered)
+
+
+class TestRootPrefix(unittest.TestCase):
+    """Test that names can be found under the root prefix."""
+
+    def test_dbus_path(self):
+        self.assertEqual(base.build_dbus_path('/'), base.ROOT_DBUS_PATH)
+        self.assertFalse(base.build_dbus_path('/').endswith('/'))
+        self.assertEqual(base.build_dbus_path('/a/b.shard'),
+                         base.BASE_DBUS_PATH + '/a/b_shard')
+
+    def test_iter_prefixes(self):
+        self.assertEqual(list(base.iter_prefixes('/a/b.shard')),
+                         ['/a/b.shard', '/a', '/'])
+        self.assertEqual(list(base.iter_prefixes('/')), ['/'])
+
+
+class MockProxy(object):
+
+    def __init__(self):
+        self.completed = []
+
+    def call_complete(self, name, callback=None):
+        self.completed.append(name)
+
+
+class ProgressConsumer(chunks.Consumer):
+
+    def __init__(self, *args, **kwargs):
+        super(ProgressConsumer, self).__init__(*args, **kwargs)
+        self.saved = []
+
+    def _save_chunk(self, n, data):
+        self.saved.append((n, data))
+        return True
+
+
+class TestProgress(unittest.TestCase):
+    """Test consumers only follow the progress of their own name."""
+
+    chunk_size = 16
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_consumer(self, name, n_chunks):
+        filename = os.path.join(self.test_dir, name.replace('/', '_'))
+        with open(filename, 'wb') as f:
+            for n in range(n_chunks):
+                f.write(str(n) * self.chunk_size)
+
+        consumer = ProgressConsumer(name, chunk_size=self.chunk_size)
+        consumer.interest = name
+        consumer.fd = open(filename, 'rb')
+        consumer._set_final_segment(n_chunks - 1)
+        self.addCleanup(consumer.fd.close)
+        return consumer
+
+    def test_filter_by_name(self):
+        consumers = [self.make_consumer('/dispatch/p/%s.shard' % (c, ), 2)
+                     for c in 'ab']
+        proxy = MockProxy()
+
+        # Both consumers get the signals of the objects they talk to.
+        for consumer in consumers:
+            consumer._on_progress(proxy, '/dispatch/p/b.shard', 0, 1)
+
+        self.assertEqual(consumers[0].saved, [])
+        self.assertEqual(consumers[1].saved,
+                         [(0, '0' * self.chunk_size),
+                          (1, '1' * self.chunk_size)])
+        self.assertEqual(proxy.completed, ['/dispatch/p/b.shard'])
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
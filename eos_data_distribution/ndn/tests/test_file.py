@@ -26,7 +26,7 @@ Unit tests for ndn.file
 # pylint: disable=missing-docstring
 
 
-from eos_data_distribution.ndn import file, chunks
+from eos_data_distribution.ndn import cache, digests, file, chunks, iopool
 from gi.repository import GLib, GObject
 import logging
 import os
@@ -99,6 +99,142 @@ class TestFileProducer(unittest.TestCase):
                     self.assertIsNotNone(chunk)
                 self.assertIsNone(producer._get_chunk(n_chunks))
 
+    def test_chunk_contents(self):
+        """Test mapped and pread() chunks both match the file content."""
+        size = 3 * chunks.CHUNK_SIZE + 7
+        path = os.path.join(self.test_dir, 'contents')
+
+        with open(path, 'wb+') as f:
+            TestFileProducer._write_test_file(f, size)
+            f.seek(0)
+            content = f.read()
+
+            mapped_producer = file.FileProducer('test', f)
+            pread_producer = file.FileProducer('test', f, use_mmap=False)
+            self.assertIsNotNone(mapped_producer._map)
+            self.assertIsNone(pread_producer._map)
+
+            for i in range(0, TestFileProducer._n_segments_for_size(size)):
+                expected = content[i * chunks.CHUNK_SIZE:
+                                   (i + 1) * chunks.CHUNK_SIZE]
+                self.assertEqual(mapped_producer._get_chunk(i).tobytes(),
+                                 expected)
+                self.assertEqual(pread_producer._get_chunk(i), expected)
+
+    def test_readahead(self):
+        """Test sequential requests are read ahead into the cache."""
+        size = 10 * chunks.CHUNK_SIZE
+        path = os.path.join(self.test_dir, 'readahead')
+
+        with open(path, 'wb+') as f:
+            TestFileProducer._write_test_file(f, size)
+            f.seek(0)
+            content = f.read()
+
+            chunk_cache = cache.ChunkCache()
+            producer = file.FileProducer('test', f, use_mmap=False,
+                                         cache=chunk_cache,
+                                         readahead_size=4 * chunks.CHUNK_SIZE)
+
+            for i in range(0, 10):
+                expected = content[i * chunks.CHUNK_SIZE:
+                                   (i + 1) * chunks.CHUNK_SIZE]
+                self.assertEqual(producer._get_chunk(i), expected)
+
+            # Chunks 0-2 are read one by one until the run is long enough;
+            # then 3-6 and 7-9 are each read as a single block.
+            self.assertEqual(chunk_cache.readaheads, 2)
+            self.assertEqual(chunk_cache.misses, 5)
+            self.assertEqual(chunk_cache.hits, 5)
+
+            # Repeated requests are served from the cache.
+            producer._get_chunk(2)
+            self.assertEqual(chunk_cache.hits, 6)
+
+    def test_get_chunk_async(self):
+        """Test chunks read on an IOPool match the file content."""
+        size = 10 * chunks.CHUNK_SIZE
+        path = os.path.join(self.test_dir, 'async')
+        loop = GLib.MainLoop()
+        results = {}
+
+        def on_chunk(i, chunk):
+            results[i] = chunk
+            if len(results) == 10:
+                loop.quit()
+
+        with open(path, 'wb+') as f:
+            TestFileProducer._write_test_file(f, size)
+            f.seek(0)
+            content = f.read()
+
+            chunk_cache = cache.ChunkCache()
+            producer = file.FileProducer('test', f, use_mmap=False,
+                                         cache=chunk_cache,
+                                         readahead_size=4 * chunks.CHUNK_SIZE,
+                                         io_pool=iopool.IOPool())
+
+            for i in range(0, 10):
+                producer._get_chunk_async(
+                    i, lambda chunk, i=i: on_chunk(i, chunk))
+            timeout_id = GLib.timeout_add_seconds(5, loop.quit)
+            loop.run()
+            GLib.source_remove(timeout_id)
+
+            for i in range(0, 10):
+                self.assertEqual(results[i],
+                                 content[i * chunks.CHUNK_SIZE:
+                                         (i + 1) * chunks.CHUNK_SIZE])
+
+    def test_digests(self):
+        """Test the published digest table matches the file content."""
+        size = 300 * chunks.CHUNK_SIZE + 7
+        path = os.path.join(self.test_dir, 'digests')
+
+        with open(path, 'wb+') as f:
+            TestFileProducer._write_test_file(f, size)
+            f.seek(0)
+            content = f.read()
+
+            producer = file.FileProducer('test', f)
+            digests_producer = file.DigestsProducer(producer)
+
+            n_chunks = TestFileProducer._n_segments_for_size(size)
+            final_segment = digests_producer._get_final_segment()
+            table = digests.DigestTable(b''.join(
+                digests_producer._get_chunk(i)
+                for i in range(0, final_segment + 1)))
+            self.assertIsNone(digests_producer._get_chunk(final_segment + 1))
+
+            self.assertEqual(len(table), n_chunks)
+            for i in range(0, n_chunks):
+                self.assertTrue(table.verify(
+                    i, content[i * chunks.CHUNK_SIZE:
+                               (i + 1) * chunks.CHUNK_SIZE]))
+
+
+
+class TestSequentialDetector(unittest.TestCase):
+    """Test detection of sequential chunk requests."""
+
+    def test_sequential(self):
+        detector = file.SequentialDetector(threshold=3)
+        self.assertIsNone(detector.add(0))
+        self.assertIsNone(detector.add(1))
+        self.assertIsNotNone(detector.add(2))
+        self.assertIsNotNone(detector.add(3))
+
+    def test_random(self):
+        detector = file.SequentialDetector(threshold=2)
+        for n in [5, 1, 9, 3, 7]:
+            self.assertIsNone(detector.add(n))
+
+    def test_interleaved(self):
+        detector = file.SequentialDetector(threshold=3)
+        results = [detector.add(n) for n in [0, 100, 1, 101, 2, 102]]
+        self.assertEqual([r is not None for r in results],
+                         [False, False, False, False, True, True])
+
 
 class TestSegmentTable(unittest.TestCase):
     """Test segment table functions."""
@@ -165,8 +301,9 @@ class MockFace(object):
 
     # Public API to emulate Face.
 
-    def removePendingInterest(self, name):
-        raise NotImplementedError('Not implemented in MockFace yet')
+    def removePendingInterest(self, pending_id):
+        # expressInterest() returns the interest as its pending ID.
+        self._interests.pop(str(pending_id.getName()), None)
 
     @property
     def usesGLibMainContext(self):
@@ -1005,84 +1142,125 @@ class TestDirConsumer(unittest.TestCase):
         with open(path, 'r') as f:
             self.assertEqual(f.read(), raw_content)
 
-    def test_parallel_downloads_multiple_segments(self):
-        """Test two consumers downloading a multi-segment file in parallel."""
-        (path, _, _) = self.build_paths('file-name')
 
-        # Build the segments in advance.
-        segment_size=4096  # bytes
-        n_segments = 3
-        segments = [TestDirConsumer.build_segment('/file-name', i, n_segments,
-                                                  segment_size=segment_size)
-                    for i in range(0, n_segments)]
+class StubOwner(GObject.GObject):
 
-        # Create two new consumers requesting file-name.
-        # Set the pipeline to something massive so we don’t have to worry about
-        # hitting it here. We test the pipeline in other tests.
-        face1 = MockFace()
-        consumer1 = file.DirConsumer('file-name', self.test_dir, face=face1,
-                                    pipeline=100, chunk_size=segment_size)
-        consumer1.connect('complete', self._on_complete)
+    """Stand-in for a ``file.Consumer`` which others attach to."""
 
-        face2 = MockFace()
-        consumer2 = file.DirConsumer('file-name', self.test_dir, face=face2,
-                                    pipeline=100, chunk_size=segment_size)
-        consumer2.connect('complete', self._on_complete)
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (int, )),
+    }
 
-        consumer1.start()
-        consumer2.start()
+    def __init__(self):
+        super(StubOwner, self).__init__()
+        self._followers = []
 
-        # Return the file’s first segment to the consumers. We expect consumer1
-        # should now express an interest in the file’s other segments.
-        # consumer2 should not, as it should have hit the locking from
-        # consumer1.
-        face1.callInterestDone('/file-name', segments[0])
-        self.assertFaceNamesEqual(face1, [
-            '/file-name/%00%01',
-            '/file-name/%00%02',
-        ])
 
-        face2.callInterestDone('/file-name', segments[0])
-        self.assertFaceNamesEqual(face2, [])
+class TestDownloadRegistry(unittest.TestCase):
+    """Test parallel downloads of a file in the same process."""
 
-        # The download should not have completed yet.
-        self.assertDownloadNotCompleted('file-name')
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.test_dir, 'file-name')
+        self.registry = file.DownloadRegistry()
 
-        # Return the other segments in order.
-        face1.callInterestDone('/file-name/%00%01', segments[1])
-        face1.callInterestDone('/file-name/%00%02', segments[2])
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
 
-        self.assertFaceNamesEqual(face1, [])
-        self.assertFaceNamesEqual(face2, [])
+    def build_consumer(self):
+        consumer = file.FileConsumer('/file-name', self.path)
+        consumer._registry = self.registry
+        return consumer
 
-        # The download should have completed.
-        self.assertDownloadCompleted('file-name')
+    def attach_to_stub(self, consumer):
+        owner = StubOwner()
+        self.registry.add(consumer.name, self.path, owner)
+        self.assertTrue(consumer._attach(self.path))
+        return owner
 
-        # We need to run the main context so the file monitor for consumer2
-        # can notice what has happened.
-        context = GLib.MainContext.default()
-        while not face2.getInterestNames():
-            context.iteration()
-
-        # FIXME: For the moment, when consumer2 restarts its download, it has
-        # no way to check that the existing (just downloaded) file-name file
-        # contains all the right bits. So it downloads it again. In future,
-        # we should check a checksum or its size, or something, to avoid
-        # downloading a second time.
-        face2.callInterestDone('/file-name/%00%00', segments[0])
-        face2.callInterestDone('/file-name/%00%01', segments[1])
-        face2.callInterestDone('/file-name/%00%02', segments[2])
+    def test_second_consumer_attaches(self):
+        """Test a second FileConsumer for a file attaches to the first."""
+        consumer1 = self.build_consumer()
+        consumer2 = self.build_consumer()
 
-        self.assertDownloadCompleted('file-name')
+        # Neither consumer touches the segment table until it is started.
+        self.assertIsNone(consumer1._segments_file)
+        self.assertIsNone(consumer2._segments_file)
 
-        # Check the file’s contents. It should be a n_segments * 4096-byte
-        # file, with each 4096-byte chunk being its index repeated. i.e.
-        # 000…111…222…
-        with open(path, 'r') as f:
-            for i in range(0, n_segments):
-                self.assertEqual(f.read(segment_size),
-                                 str(i)[:1] * segment_size)
-            self.assertEqual(f.read(), '')  # EOF
+        # Take the download on as consumer1.start() would, without going
+        # through D-Bus.
+        self.assertFalse(consumer1._attach(self.path))
+        self.assertTrue(consumer1._lock_segments_file(self.path))
+
+        consumer2.start()
+        self.assertIs(consumer2._owner, consumer1)
+        self.assertEqual(consumer1._followers, [consumer2])
+        self.assertIsNone(consumer2._segments_file)
+
+        consumer2.close()
+        consumer1.close()
+        self.assertEqual(consumer1._followers, [])
+        self.assertIsNone(self.registry.get(consumer1.name, self.path))
+
+    def test_attach_twice(self):
+        """Test attaching to the same owner twice only follows it once."""
+        consumer = self.build_consumer()
+        owner = self.attach_to_stub(consumer)
+        self.assertTrue(consumer._attach(self.path))
+        self.assertEqual(owner._followers, [consumer])
+
+        progress = []
+        consumer.connect('progress', lambda c, p: progress.append(p))
+        owner.emit('progress', 50)
+        self.assertEqual(progress, [50])
+
+    def test_save_chunk_attached(self):
+        """Test an attached consumer does not save chunks itself."""
+        consumer = self.build_consumer()
+        owner = self.attach_to_stub(consumer)
+
+        self.assertFalse(consumer._save_chunk(0, 'some content'))
+        self.assertEqual(owner._followers, [consumer])
+        self.assertFalse(os.path.exists(self.path + '.part'))
+        self.assertFalse(os.path.exists(self.path + '.sgt'))
+
+    def test_owner_complete(self):
+        """Test a consumer completes when the one it follows does."""
+        consumer = self.build_consumer()
+        owner = self.attach_to_stub(consumer)
+
+        complete = []
+        consumer.connect('complete', lambda c: complete.append(c))
+        consumer._on_owner_complete()
+
+        self.assertEqual(complete, [consumer])
+        self.assertIsNone(consumer._owner)
+        self.assertEqual(owner._followers, [])
+
+        # Progress from the old owner is no longer relayed.
+        progress = []
+        consumer.connect('progress', lambda c, p: progress.append(p))
+        owner.emit('progress', 100)
+        self.assertEqual(progress, [])
+
+    def test_owner_closed(self):
+        """Test a consumer takes over a download which is stopped."""
+        consumer = self.build_consumer()
+        owner = self.attach_to_stub(consumer)
+        self.registry.remove(consumer.name, self.path, owner)
+
+        started = []
+        consumer.start = lambda: started.append(True)
+        consumer._on_owner_closed()
+
+        self.assertEqual(started, [True])
+        self.assertIsNone(consumer._owner)
+        self.assertEqual(owner._followers, [])
+
+        # Nothing else is downloading the file now, so the consumer takes
+        # it on itself.
+        self.assertFalse(consumer._attach(self.path))
+        self.assertIs(self.registry.get(consumer.name, self.path), consumer)
 
 
 # TODO: More tests:
@@ -0,0 +1,390 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.http
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import disk_cache, http
+from gi.repository import GLib
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+CHUNK_SIZE = 16
+
+
+class RangeServer(ThreadingMixIn, HTTPServer):
+    """Serve in-memory files at /<name>, honouring single byte ranges.
+
+    Each request is logged as (path, start, stop) in `requests`, and the
+    largest number of requests handled at once kept in `max_concurrent`.
+    If `hold` is set to an Event, the rest of each body after its first
+    chunk is only sent once it is set. If `truncate` is set, the next body
+    is that many bytes short, as though the content ended there. The
+    Last-Modified header is only sent if `last_modified` is set.
+    """
+    daemon_threads = True
+
+    def __init__(self, files, delay=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RangeHandler)
+        self.files = files
+        self.delay = delay
+        self.hold = None
+        self.truncate = 0
+        self.last_modified = 'Mon, 16 Jan 2017 00:00:00 GMT'
+        self.requests = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, name):
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], name)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        content = server.files.get(self.path.lstrip('/'))
+        if content is None:
+            self.send_error(404)
+            return
+
+        start, stop = self.headers['Range'].split('=')[1].split('-')
+        start, stop = int(start), min(int(stop) + 1, len(content))
+        with server.lock:
+            server.requests.append((self.path, start, stop))
+            server.concurrent += 1
+            server.max_concurrent = max(server.max_concurrent,
+                                        server.concurrent)
+            stop -= server.truncate
+            server.truncate = 0
+        time.sleep(server.delay)
+        with server.lock:
+            server.concurrent -= 1
+
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                         (start, stop - 1, len(content)))
+        self.send_header('Content-Length', str(stop - start))
+        if server.last_modified:
+            self.send_header('Last-Modified', server.last_modified)
+        self.end_headers()
+        if server.hold is not None:
+            self.wfile.write(content[start:start + CHUNK_SIZE])
+            self.wfile.flush()
+            server.hold.wait()
+            start += CHUNK_SIZE
+        self.wfile.write(content[start:stop])
+
+
+class MemoryData(object):
+    """Stand in for the Data objects the Getter fills in.
+
+    Like the Data of a producer worker, one may be given several chunks in
+    turn: all of them are kept in `contents`.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.content = None
+        self.contents = []
+
+    def setContent(self, content):
+        self.raw = content
+        self.content = bytes(bytearray(content))
+        self.contents.append(self.content)
+
+
+def make_content(n_chunks):
+    return b''.join([(b'%x' % (i % 16, )) * CHUNK_SIZE
+                     for i in range(n_chunks)])
+
+
+def iterate_until(condition, timeout=10):
+    context = GLib.MainContext.default()
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        context.iteration(False)
+        time.sleep(0.001)
+
+
+class TestMetadataCache(unittest.TestCase):
+    """Test expiry of the headers in MetadataCache."""
+
+    def test_ttl(self):
+        cache = http.MetadataCache(ttl=1)
+        cache.put('a', 'headers-a', now=0)
+        cache.put('b', 'headers-b', now=500 * 1000)
+        self.assertEqual(cache.get('a', now=999 * 1000), 'headers-a')
+        self.assertIsNone(cache.get('a', now=1000 * 1000))
+        self.assertEqual(cache.get('b', now=1000 * 1000), 'headers-b')
+
+    def test_put_prunes_expired(self):
+        cache = http.MetadataCache(ttl=1)
+        cache.put('a', 'headers-a', now=0)
+        cache.put('b', 'headers-b', now=500 * 1000)
+        cache.put('c', 'headers-c', now=1200 * 1000)
+        self.assertEqual(len(cache), 2)
+        cache.put('b', 'headers-b', now=1600 * 1000)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('c', now=1600 * 1000), 'headers-c')
+
+
+class TestGetter(unittest.TestCase):
+    """Test range requests made by Getter."""
+
+    def setUp(self):
+        self.content = make_content(64)
+        self.server = RangeServer({'a': self.content, 'b': self.content},
+                                  delay=0.05)
+        self.session = http.make_soup_session()
+        self.metadata_cache = http.MetadataCache()
+        self.received = []
+
+    def tearDown(self):
+        self.server.stop()
+
+    def make_getter(self, name, **kwargs):
+        getter = http.Getter(self.server.url(name), self.received.append,
+                             session=self.session, chunk_size=CHUNK_SIZE,
+                             metadata_cache=self.metadata_cache, **kwargs)
+        iterate_until(lambda: getter.ready)
+        return getter
+
+    def test_probe(self):
+        url = self.server.url('a')
+        getters = [http.Getter(url, self.received.append,
+                               session=self.session,
+                               metadata_cache=self.metadata_cache)
+                   for i in range(2)]
+        # The probe does not block the constructor.
+        self.assertFalse(getters[0].ready)
+        ready = []
+        getters[0].when_ready(lambda: ready.append(getters[0]._size))
+        iterate_until(lambda: ready)
+        self.assertEqual(ready, [len(self.content)])
+        self.assertTrue(getters[1].ready)
+
+        # Getters made later reuse the cached headers.
+        getter = http.Getter(url, self.received.append, session=self.session,
+                             metadata_cache=self.metadata_cache)
+        self.assertTrue(getter.ready)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.metadata_cache.hits, 1)
+
+    def test_probe_failed(self):
+        getter = http.Getter(self.server.url('missing'), self.received.append,
+                             session=self.session,
+                             metadata_cache=self.metadata_cache)
+        ready = []
+        getter.when_ready(lambda: ready.append(getter.ready))
+        iterate_until(lambda: ready)
+        self.assertEqual(ready, [False])
+        self.assertEqual(len(self.metadata_cache), 0)
+
+    def test_merged_ranges(self):
+        getter = self.make_getter('a', max_range_size=4 * CHUNK_SIZE)
+        del self.server.requests[:]
+        for n in [0, 1, 2, 3, 4, 5, 9]:
+            getter.queue_request(MemoryData(n), n)
+        iterate_until(lambda: len(self.received) == 7)
+
+        self.assertEqual(sorted(self.server.requests),
+                         [('/a', 0, 4 * CHUNK_SIZE),
+                          ('/a', 4 * CHUNK_SIZE, 6 * CHUNK_SIZE),
+                          ('/a', 9 * CHUNK_SIZE, 10 * CHUNK_SIZE)])
+
+    def test_concurrent_in_order(self):
+        getter = self.make_getter('a', concurrency=4,
+                                  max_range_size=CHUNK_SIZE)
+        order = [7, 3, 12, 0, 5, 1, 9, 2]
+        data = MemoryData(0)
+        for n in order:
+            getter.queue_request(data, n)
+        iterate_until(lambda: len(data.contents) == len(order))
+
+        self.assertEqual(self.server.max_concurrent, 4)
+        self.assertEqual(data.contents,
+                         [self.content[n * CHUNK_SIZE:(n + 1) * CHUNK_SIZE]
+                          for n in order])
+
+    def test_streamed(self):
+        getter = self.make_getter('a', max_range_size=4 * CHUNK_SIZE)
+        del self.server.requests[:]
+        self.server.hold = threading.Event()
+        for n in range(4):
+            getter.queue_request(MemoryData(n), n)
+
+        # The first chunk is handed on before the rest of the range is sent.
+        iterate_until(lambda: self.received)
+        self.assertEqual([d.n for d in self.received], [0])
+        self.assertIsInstance(self.received[0].raw, memoryview)
+        self.server.hold.set()
+        iterate_until(lambda: len(self.received) == 4)
+
+        self.assertEqual(self.server.requests, [('/a', 0, 4 * CHUNK_SIZE)])
+        self.assertEqual(b''.join([d.content for d in self.received]),
+                         self.content[:4 * CHUNK_SIZE])
+
+    def test_short_last_chunk(self):
+        self.server.files['c'] = self.content[:2 * CHUNK_SIZE + 5]
+        getter = self.make_getter('c')
+        for n in range(3):
+            getter.queue_request(MemoryData(n), n)
+        iterate_until(lambda: len(self.received) == 3)
+
+        self.assertEqual([len(d.content) for d in self.received],
+                         [CHUNK_SIZE, CHUNK_SIZE, 5])
+
+    def test_short_body(self):
+        getter = self.make_getter('a', max_range_size=4 * CHUNK_SIZE)
+        del self.server.requests[:]
+        self.server.truncate = 5
+        for n in range(4):
+            getter.queue_request(MemoryData(n), n)
+        iterate_until(lambda: len(self.received) == 4)
+
+        # The truncated chunk is fetched again, rather than handed on short.
+        self.assertEqual(self.server.requests,
+                         [('/a', 0, 4 * CHUNK_SIZE),
+                          ('/a', 3 * CHUNK_SIZE, 4 * CHUNK_SIZE)])
+        self.assertEqual(b''.join([d.content for d in self.received]),
+                         self.content[:4 * CHUNK_SIZE])
+
+    def test_collapsed(self):
+        getter = self.make_getter('a')
+        del self.server.requests[:]
+        waiters = [MemoryData(n) for n in (3, 3, 4, 3)]
+        for data in waiters:
+            getter.queue_request(data, data.n)
+        iterate_until(lambda: len(self.received) == 4)
+
+        self.assertEqual(self.server.requests,
+                         [('/a', 3 * CHUNK_SIZE, 5 * CHUNK_SIZE)])
+        self.assertEqual(sorted([id(d) for d in self.received]),
+                         sorted([id(d) for d in waiters]))
+        for d in self.received:
+            self.assertEqual(d.content, self.content[d.n * CHUNK_SIZE:
+                                                     (d.n + 1) * CHUNK_SIZE])
+        self.assertEqual((getter.requests, getter.collapsed_requests), (4, 2))
+
+        # Delivered chunks are forgotten, and fetched again if requested.
+        self.assertEqual(getter._pending, {})
+        getter.queue_request(MemoryData(3), 3)
+        iterate_until(lambda: len(self.received) == 5)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_collapsed_in_order(self):
+        getter = self.make_getter('a', max_range_size=4 * CHUNK_SIZE)
+        del self.server.requests[:]
+        self.server.hold = threading.Event()
+        first, second = MemoryData(0), MemoryData(0)
+        for n in range(4):
+            getter.queue_request(first, n)
+        iterate_until(lambda: first.contents)
+
+        # The second worker wants chunk 0 again, which was already
+        # delivered and forgotten, before the chunks it shares with the
+        # first one.
+        for n in range(4):
+            getter.queue_request(second, n)
+        self.server.hold.set()
+        iterate_until(lambda: len(second.contents) == 4)
+
+        self.assertEqual(self.server.requests,
+                         [('/a', 0, 4 * CHUNK_SIZE), ('/a', 0, CHUNK_SIZE)])
+        for data in (first, second):
+            self.assertEqual(b''.join(data.contents),
+                             self.content[:4 * CHUNK_SIZE])
+        self.assertEqual((getter._pending, getter._received), ({}, {}))
+
+    def test_disk_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = disk_cache.DiskCache(cache_dir)
+
+        getter = self.make_getter('a', disk_cache=cache)
+        for n in range(4):
+            getter.queue_request(MemoryData(n), n)
+        iterate_until(lambda: len(self.received) == 4)
+
+        # Another run of the producer gets the chunks, and the size of the
+        # content, from disk.
+        cache.close()
+        cache = disk_cache.DiskCache(cache_dir)
+        del self.server.requests[:]
+        del self.received[:]
+        getter = http.Getter(self.server.url('a'), self.received.append,
+                             session=self.session, chunk_size=CHUNK_SIZE,
+                             metadata_cache=http.MetadataCache(),
+                             disk_cache=cache)
+        self.assertTrue(getter.ready)
+        for n in range(4):
+            getter.queue_request(MemoryData(n), n)
+
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(b''.join([d.content for d in self.received]),
+                         self.content[:4 * CHUNK_SIZE])
+        self.assertEqual(cache.hits, 4)
+
+    def test_fair_between_getters(self):
+        http.get_scheduler(self.session).max_requests = 1
+        getters = [self.make_getter(name, max_range_size=CHUNK_SIZE)
+                   for name in ('a', 'b')]
+        del self.server.requests[:]
+        # a queues all its chunks before b gets to queue any.
+        for getter in getters:
+            for n in range(4):
+                getter.queue_request(MemoryData(n), n)
+        iterate_until(lambda: len(self.received) == 8)
+
+        paths = [p for p, start, stop in self.server.requests]
+        self.assertEqual(paths, ['/a', '/b'] * 4)
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.iopool
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from gi.repository import GLib
+
+from eos_data_distribution.ndn import iopool
+import threading
+import time
+import unittest
+
+
+class MainLoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = GLib.MainLoop()
+        self.results = []
+
+    def run_until(self, n_results):
+        def check():
+            if len(self.results) >= n_results:
+                self.loop.quit()
+            return GLib.SOURCE_CONTINUE
+
+        check_id = GLib.timeout_add(10, check)
+        timeout_id = GLib.timeout_add_seconds(5, self.loop.quit)
+        self.loop.run()
+        GLib.source_remove(check_id)
+        GLib.source_remove(timeout_id)
+
+
+class TestIOPool(MainLoopTestCase):
+    """Test running jobs off the main loop."""
+
+    def test_callback_on_main_loop(self):
+        pool = iopool.IOPool(num_threads=2)
+        main_thread = threading.current_thread()
+
+        def job(x):
+            return (x * 2, threading.current_thread())
+
+        def callback(result):
+            value, job_thread = result
+            self.assertIsNot(job_thread, main_thread)
+            self.assertIs(threading.current_thread(), main_thread)
+            self.results.append(value)
+
+        pool.submit(job, (1, ), callback)
+        pool.submit(job, (2, ), callback)
+        self.assertEqual(pool.pending, 2)
+
+        self.run_until(2)
+        self.assertEqual(sorted(self.results), [2, 4])
+        self.assertEqual(pool.pending, 0)
+
+    def test_failed_job(self):
+        pool = iopool.IOPool(num_threads=1)
+
+        def fail():
+            raise IOError('no space left')
+
+        errors = []
+        pool.submit(fail, (), self.results.append, errors.append)
+        pool.submit(lambda: 'ok', (), self.results.append, errors.append)
+        self.run_until(1)
+        self.assertEqual(self.results, ['ok'])
+        self.assertEqual([str(e) for e in errors], ['no space left'])
+        self.assertEqual(pool.pending, 0)
+
+
+class TestIOQueue(MainLoopTestCase):
+    """Test serialising jobs on a pool."""
+
+    def test_in_order(self):
+        pool = iopool.IOPool(num_threads=4)
+        queue = iopool.IOQueue(pool)
+
+        def job(i):
+            # Later jobs are quicker: only serialisation keeps them in order.
+            time.sleep((10 - i) / 1000.0)
+            return i
+
+        for i in range(10):
+            queue.submit(job, (i, ), self.results.append)
+        self.assertEqual(len(queue), 10)
+        self.assertEqual(pool.pending, 10)
+
+        self.run_until(10)
+        self.assertEqual(self.results, list(range(10)))
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(pool.pending, 0)
+
+    def test_failed_job_in_queue(self):
+        pool = iopool.IOPool(num_threads=1)
+        queue = iopool.IOQueue(pool)
+
+        def fail():
+            raise IOError('no space left')
+
+        ran = []
+
+        def ok():
+            ran.append(True)
+            return 'ok'
+
+        def errback(error):
+            # The next job only starts once the errback has run.
+            self.assertEqual(ran, [])
+            self.results.append(error)
+
+        queue.submit(fail, (), self.results.append, errback)
+        queue.submit(ok, (), self.results.append)
+        self.run_until(2)
+        self.assertIsInstance(self.results[0], IOError)
+        self.assertEqual(self.results[1:], ['ok'])
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
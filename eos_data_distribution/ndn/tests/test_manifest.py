@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.manifest
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.names import Name
+from eos_data_distribution.ndn import http, manifest
+from eos_data_distribution.ndn.tests.test_http import (RangeServer,
+                                                       iterate_until,
+                                                       make_content)
+import unittest
+
+
+class MockDBus(object):
+    """Record the errors a producer returns."""
+
+    def __init__(self):
+        self.errors = []
+
+    def return_error(self, name, error):
+        self.errors.append((name.toString(), error))
+
+
+class TestManifestProducer(unittest.TestCase):
+    """Test how the manifest producer versions its name."""
+
+    def setUp(self):
+        self.server = RangeServer({'manifest': make_content(4)})
+        self.session = http.make_soup_session()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def make_producer(self, name):
+        producer = manifest.Producer(name, self.server.url('manifest'),
+                                     session=self.session)
+        producer._dbus = MockDBus()
+        iterate_until(lambda: producer._getter.ready)
+        return producer
+
+    def test_no_last_modified(self):
+        self.server.last_modified = None
+        producer = self.make_producer('/manifest/b')
+
+        # The headers are probed again a few times, then requests are
+        # refused.
+        self.assertTrue(producer._on_request_interest(Name('/manifest/b')))
+        iterate_until(lambda: producer._dbus.errors)
+        self.assertEqual(producer._dbus.errors,
+                         [('/manifest/b', 'NoLastModified')])
+        self.assertEqual(len(self.server.requests), manifest.MAX_PROBES)
+        self.assertIsNone(producer._qualified_name)
+
+        self.assertFalse(producer._on_request_interest(Name('/manifest/b')))
+        self.assertEqual(len(self.server.requests), manifest.MAX_PROBES)
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
@@ -0,0 +1,467 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.segments
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.defaults import SegmentState
+from eos_data_distribution.ndn import iopool, segments
+import os
+import random
+import shutil
+import signal
+import struct
+import tempfile
+import time
+import unittest
+
+
+class TestSegmentMap(unittest.TestCase):
+    """Test the SegmentMap state table."""
+
+    def assertCounts(self, segment_map, unsent, outgoing, complete):
+        self.assertEqual(segment_map.count(SegmentState.UNSENT), unsent)
+        self.assertEqual(segment_map.count(SegmentState.OUTGOING), outgoing)
+        self.assertEqual(segment_map.count(SegmentState.COMPLETE), complete)
+
+    def test_empty(self):
+        segment_map = segments.SegmentMap(0)
+        self.assertEqual(len(segment_map), 0)
+        self.assertFalse(segment_map)
+        self.assertTrue(segment_map.is_complete())
+        with self.assertRaises(ValueError):
+            segment_map.next_unsent()
+
+    def test_counts(self):
+        segment_map = segments.SegmentMap(10)
+        self.assertCounts(segment_map, 10, 0, 0)
+
+        segment_map[3] = SegmentState.OUTGOING
+        segment_map[4] = SegmentState.COMPLETE
+        self.assertCounts(segment_map, 8, 1, 1)
+
+        # Setting the same state twice must not skew the counters.
+        segment_map[4] = SegmentState.COMPLETE
+        self.assertCounts(segment_map, 8, 1, 1)
+
+        segment_map[3] = SegmentState.COMPLETE
+        self.assertCounts(segment_map, 8, 0, 2)
+        self.assertEqual(segment_map[3], SegmentState.COMPLETE)
+        self.assertEqual(segment_map[2:5], [SegmentState.UNSENT,
+                                            SegmentState.COMPLETE,
+                                            SegmentState.COMPLETE])
+
+    def test_next_unsent(self):
+        segment_map = segments.SegmentMap(4)
+        for i in range(4):
+            n = segment_map.next_unsent()
+            self.assertEqual(n, i)
+            self.assertEqual(segment_map.index(SegmentState.UNSENT), i)
+            segment_map[n] = SegmentState.OUTGOING
+
+        with self.assertRaises(ValueError):
+            segment_map.next_unsent()
+
+        # Marking a segment as unsent again must move the cursor back.
+        segment_map[1] = SegmentState.UNSENT
+        self.assertEqual(segment_map.next_unsent(), 1)
+
+    def test_fill(self):
+        segment_map = segments.SegmentMap(10)
+        segment_map[8] = SegmentState.OUTGOING
+        segment_map.fill(0, 6, SegmentState.COMPLETE)
+        self.assertCounts(segment_map, 3, 1, 6)
+        self.assertEqual(segment_map.next_unsent(), 6)
+
+        segment_map.fill(2, 4, SegmentState.UNSENT)
+        self.assertCounts(segment_map, 5, 1, 4)
+        self.assertEqual(segment_map.next_unsent(), 2)
+
+    def test_is_complete(self):
+        segment_map = segments.SegmentMap(3)
+        for i in range(3):
+            self.assertFalse(segment_map.is_complete())
+            segment_map[i] = SegmentState.COMPLETE
+        self.assertTrue(segment_map.is_complete())
+
+
+class TestSegmentFile(unittest.TestCase):
+    """Test reading and writing .sgt files."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'file-name')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def build_segment_map(self, states):
+        segment_map = segments.SegmentMap(len(states))
+        for i, state in enumerate(states):
+            segment_map[i] = state
+        return segment_map
+
+    def assertRoundTrip(self, mode, states, expected_states):
+        segments_file = segments.File(self.filename, mode=mode)
+        segments_file.write(self.build_segment_map(states))
+        segments_file.close()
+
+        segments_file = segments.File(self.filename)
+        segment_map = segments_file.read()
+        segments_file.close(unlink=True)
+
+        self.assertIsInstance(segment_map, segments.SegmentMap)
+        self.assertEqual(list(segment_map), expected_states)
+
+    def test_mode0(self):
+        states = ([SegmentState.COMPLETE] * 9 + [SegmentState.OUTGOING] * 2 +
+                  [SegmentState.UNSENT] * 3 + [SegmentState.COMPLETE])
+        expected = [SegmentState.UNSENT if state == SegmentState.OUTGOING
+                    else state for state in states]
+        self.assertRoundTrip(0, states, expected)
+
+    def test_mode1(self):
+        states = ([SegmentState.COMPLETE] * 5 + [SegmentState.OUTGOING] +
+                  [SegmentState.COMPLETE] * 2 + [SegmentState.UNSENT] * 4)
+        expected = [SegmentState.UNSENT if state == SegmentState.OUTGOING
+                    else state for state in states]
+        self.assertRoundTrip(1, states, expected)
+
+    def test_mode2(self):
+        states = ([SegmentState.COMPLETE] * 9 + [SegmentState.OUTGOING] * 2 +
+                  [SegmentState.UNSENT] * 3 + [SegmentState.COMPLETE])
+        expected = [SegmentState.UNSENT if state == SegmentState.OUTGOING
+                    else state for state in states]
+        self.assertRoundTrip(2, states, expected)
+
+    def test_mode2_header(self):
+        segments_file = segments.File(self.filename)
+        segments_file.mark_complete([0], segments.SegmentMap(8))
+        segments_file.close()
+
+        # Mapped tables are recorded as mode 0 ones.
+        with open(self.filename + '.sgt', 'rb') as f:
+            f.seek(len(segments.SEGMENT_TABLE_MAGIC))
+            self.assertEqual(struct.unpack('<Q', f.read(8))[0], 0)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, segments.File, self.filename, mode=3)
+
+        with open(self.filename + '.sgt', 'wb') as f:
+            f.write(segments.SEGMENT_TABLE_MAGIC)
+            f.write(struct.pack('<QQ', 3, 8))
+            f.write(b'\xff')
+
+        segments_file = segments.File(self.filename)
+        self.assertRaises(ValueError, segments_file.read)
+        segments_file.close(unlink=True)
+
+    def test_mode2_mark_complete(self):
+        segment_map = segments.SegmentMap(20)
+        segments_file = segments.File(self.filename)
+        segments_file.mark_complete([0], segment_map)
+        segments_file.mark_complete([9, 19], segment_map)
+        size = os.path.getsize(self.filename + '.sgt')
+        segments_file.close()
+
+        # Marking segments complete must not grow the table.
+        self.assertEqual(size, segments.SEGMENT_TABLE_HEADER_SIZE + 3)
+
+        segments_file = segments.File(self.filename)
+        segment_map = segments_file.read()
+        segments_file.close(unlink=True)
+
+        self.assertEqual(
+            [i for i, state in enumerate(segment_map)
+             if state == SegmentState.COMPLETE], [0, 9, 19])
+
+    def test_mode2_mark_incomplete(self):
+        segment_map = segments.SegmentMap(12)
+        segments_file = segments.File(self.filename)
+        segments_file.mark_complete([0, 3, 11], segment_map)
+        segments_file.mark_incomplete([3], segment_map)
+        segments_file.close()
+
+        segments_file = segments.File(self.filename)
+        segment_map = segments_file.read()
+        segments_file.close(unlink=True)
+
+        self.assertEqual(
+            [i for i, state in enumerate(segment_map)
+             if state == SegmentState.COMPLETE], [0, 11])
+
+    def test_resume_mode0_as_mode2(self):
+        states = [SegmentState.COMPLETE] * 3 + [SegmentState.UNSENT] * 5
+        segments_file = segments.File(self.filename, mode=0)
+        segments_file.write(self.build_segment_map(states))
+        segments_file.close()
+
+        # Resuming an old table rewrites it in mapped mode on the first
+        # completed segment.
+        segments_file = segments.File(self.filename)
+        segment_map = segments_file.read()
+        segments_file.mark_complete([5], segment_map)
+        segments_file.close()
+
+        segments_file = segments.File(self.filename)
+        segment_map = segments_file.read()
+        segments_file.close(unlink=True)
+
+        states[5] = SegmentState.COMPLETE
+        self.assertEqual(list(segment_map), states)
+
+
+class TestCommitQueue(unittest.TestCase):
+    """Test group commit of completed segments."""
+
+    chunk_size = 4096
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'file-name')
+        self.part_filename = self.filename + '.part'
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @classmethod
+    def chunk_content(cls, n):
+        return chr(ord('a') + n % 26) * cls.chunk_size
+
+    def read_table(self):
+        segments_file = segments.File(self.filename)
+        try:
+            return segments_file.read()
+        except ValueError:
+            return None
+        finally:
+            segments_file.close()
+
+    def test_commit_batches(self):
+        segment_map = segments.SegmentMap(10)
+        segments_file = segments.File(self.filename)
+        part_fd = os.open(self.part_filename, os.O_CREAT | os.O_WRONLY, 0o600)
+        queue = segments.CommitQueue(segments_file, part_fd, 3)
+
+        self.assertFalse(queue.add(0, segment_map))
+        self.assertFalse(queue.add(1, segment_map))
+        self.assertEqual(len(queue), 2)
+        # Nothing has been recorded yet.
+        self.assertFalse(os.path.getsize(self.filename + '.sgt'))
+
+        self.assertTrue(queue.add(2, segment_map))
+        self.assertEqual(len(queue), 0)
+        queue.add(7, segment_map)
+        queue.commit(segment_map)
+
+        os.close(part_fd)
+        segments_file.close()
+
+        self.assertEqual(
+            [i for i, state in enumerate(self.read_table())
+             if state == SegmentState.COMPLETE], [0, 1, 2, 7])
+
+    def test_commit_only_written(self):
+        # Chunks still being verified are marked complete in the live map,
+        # but must not be recorded until they are written.
+        segment_map = segments.SegmentMap(10)
+        segments_file = segments.File(self.filename)
+        part_fd = os.open(self.part_filename, os.O_CREAT | os.O_WRONLY, 0o600)
+        queue = segments.CommitQueue(segments_file, part_fd, 10)
+
+        segment_map.fill(0, 6, SegmentState.COMPLETE)
+        queue.add(1, segment_map)
+        queue.add(4, segment_map)
+        queue.commit(segment_map)
+        queue.add(2, segment_map)
+        queue.commit(segment_map)
+
+        os.close(part_fd)
+        segments_file.close()
+
+        self.assertEqual(
+            [i for i, state in enumerate(self.read_table())
+             if state == SegmentState.COMPLETE], [1, 2, 4])
+
+    def write_until_killed(self, n_segments, io_pool=None):
+        # Write every chunk, in a random order, as file.Consumer does: with
+        # an io_pool, the writes and commits run on it while chunks keep
+        # being marked complete here.
+        segment_map = segments.SegmentMap(n_segments)
+        segments_file = segments.File(self.filename)
+        part_fd = os.open(self.part_filename, os.O_CREAT | os.O_WRONLY, 0o600)
+        writer = segments.ChunkWriter(part_fd, self.chunk_size,
+                                      16 * self.chunk_size)
+        queue = segments.CommitQueue(segments_file, part_fd, 8)
+
+        def write_out(writer, commit):
+            for written in writer.flush():
+                queue.add(written, segment_map)
+            if commit:
+                queue.commit(segment_map)
+
+        def run(func, *args):
+            if io_pool is None:
+                func(*args)
+            else:
+                io_pool.submit(func, args)
+
+        order = list(range(n_segments))
+        random.shuffle(order)
+        for n in order:
+            writer.put(n, self.chunk_content(n))
+            segment_map[n] = SegmentState.COMPLETE
+            if writer.is_full():
+                run(write_out, writer, False)
+                writer = segments.ChunkWriter(part_fd, self.chunk_size,
+                                              16 * self.chunk_size)
+        run(write_out, writer, True)
+
+        if io_pool is not None:
+            # Wait to be killed.
+            time.sleep(10)
+
+    def assertCrashConsistent(self, io_pool=False):
+        """Kill the writer at random points; no hole may be complete."""
+        n_segments = 2048
+
+        for attempt in range(20):
+            for path in (self.part_filename, self.filename + '.sgt'):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    # A single thread runs the jobs in order, as an IOQueue
+                    # does, without needing a main loop.
+                    self.write_until_killed(
+                        n_segments,
+                        iopool.IOPool(num_threads=1) if io_pool else None)
+                finally:
+                    os._exit(0)
+
+            time.sleep(random.uniform(0, 0.05))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+            segment_map = self.read_table()
+            if segment_map is None:
+                # Killed before the first commit.
+                continue
+
+            with open(self.part_filename, 'rb') as f:
+                for n, state in enumerate(segment_map):
+                    if state != SegmentState.COMPLETE:
+                        continue
+                    f.seek(n * self.chunk_size)
+                    self.assertEqual(f.read(self.chunk_size),
+                                     self.chunk_content(n),
+                                     'segment %d is complete but not written'
+                                     % n)
+
+    def test_crash_consistency(self):
+        self.assertCrashConsistent()
+
+    def test_crash_consistency_io_pool(self):
+        self.assertCrashConsistent(io_pool=True)
+
+
+class TestChunkWriter(unittest.TestCase):
+    """Test coalescing of chunk writes."""
+
+    chunk_size = 16
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'file-name.part')
+        self.fd = os.open(self.filename, os.O_CREAT | os.O_RDWR, 0o600)
+
+    def tearDown(self):
+        os.close(self.fd)
+        shutil.rmtree(self.test_dir)
+
+    @classmethod
+    def chunk_content(cls, n):
+        return chr(ord('a') + n % 26) * cls.chunk_size
+
+    def read_chunks(self, indexes):
+        with open(self.filename, 'rb') as f:
+            contents = []
+            for n in indexes:
+                f.seek(n * self.chunk_size)
+                contents.append(f.read(self.chunk_size))
+            return contents
+
+    def test_buffers_until_full(self):
+        writer = segments.ChunkWriter(self.fd, self.chunk_size,
+                                      3 * self.chunk_size)
+        self.assertEqual(writer.add(1, self.chunk_content(1)), [])
+        self.assertEqual(writer.add(0, self.chunk_content(0)), [])
+        self.assertEqual(len(writer), 2)
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+        self.assertEqual(writer.add(2, self.chunk_content(2)), [0, 1, 2])
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(self.read_chunks(range(3)),
+                         [self.chunk_content(n) for n in range(3)])
+
+    def test_contiguous_run_coalesced(self):
+        writer = segments.ChunkWriter(self.fd, self.chunk_size, 1024)
+        for n in [3, 1, 2, 0, 7, 8]:
+            writer.add(n, self.chunk_content(n))
+        self.assertEqual(writer.flush(), [0, 1, 2, 3, 7, 8])
+
+        # One write for 0-3 and one for 7-8.
+        self.assertEqual(writer.writes, 2)
+        self.assertEqual(self.read_chunks([0, 1, 2, 3, 7, 8]),
+                         [self.chunk_content(n) for n in [0, 1, 2, 3, 7, 8]])
+        self.assertEqual(self.read_chunks([5]), ['\0' * self.chunk_size])
+
+    def test_put(self):
+        writer = segments.ChunkWriter(self.fd, self.chunk_size,
+                                      2 * self.chunk_size)
+        writer.put(0, self.chunk_content(0))
+        self.assertFalse(writer.is_full())
+        writer.put(1, self.chunk_content(1))
+        self.assertTrue(writer.is_full())
+
+        # Nothing is written until the writer is flushed.
+        self.assertEqual(os.path.getsize(self.filename), 0)
+        self.assertEqual(writer.flush(), [0, 1])
+        self.assertFalse(writer.is_full())
+
+    def test_memoryview(self):
+        writer = segments.ChunkWriter(self.fd, self.chunk_size, 1024)
+        data = bytearray(self.chunk_content(4))
+        writer.add(4, memoryview(data))
+        # The writer must keep its own copy of the chunk.
+        data[:] = self.chunk_content(5)
+        writer.flush()
+        self.assertEqual(self.read_chunks([4]), [self.chunk_content(4)])
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# -*- Mode:python; coding: utf-8; c-file-style:"gnu"; indent-tabs-mode:nil -*- */
+#
+# Copyright © 2017 Endless Mobile, Inc.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# A copy of the GNU Lesser General Public License is in the file COPYING.
+
+"""
+Unit tests for ndn.stream
+"""
+
+
+# pylint: disable=missing-docstring
+
+
+from eos_data_distribution.ndn import stream
+from eos_data_distribution.ndn.tests import test_file
+from eos_data_distribution.ndn.tests.test_chunks import segment_name
+from gi.repository import GLib
+import logging
+import os
+import unittest
+
+
+class TestStreamConsumer(unittest.TestCase):
+    """Test in-order delivery by StreamConsumer."""
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+
+    segment_size = 16
+
+    def setUp(self):
+        self.face = test_file.MockFace()
+        self.n_segments = 8
+        self.segments = [
+            test_file.TestDirConsumer.build_segment(
+                '/file-name', i, self.n_segments,
+                raw_content=self.segment_content(i))
+            for i in range(0, self.n_segments)]
+        self.received = []
+        self.complete = False
+
+    def segment_content(self, n):
+        return chr(ord('a') + n) * self.segment_size
+
+    def _on_complete(self, consumer):
+        self.complete = True
+
+    def assertFaceNamesEqual(self, names):
+        self.assertEqual(self.face.getInterestNames(), set(names))
+
+    def reply(self, n):
+        name = '/file-name' if n == 0 else segment_name('/file-name', n)
+        self.face.callInterestDone(name, self.segments[n])
+
+    def test_in_order(self):
+        consumer = stream.StreamConsumer('/file-name', self.received.append,
+                                         face=self.face, pipeline=100,
+                                         chunk_size=self.segment_size)
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+        self.reply(0)
+        self.assertEqual(self.received, [self.segment_content(0)])
+
+        # Chunks after a gap are held back until it is filled.
+        self.reply(3)
+        self.reply(2)
+        self.assertEqual(len(self.received), 1)
+        self.reply(1)
+        self.assertEqual(self.received,
+                         [self.segment_content(i) for i in range(4)])
+
+        for i in range(4, self.n_segments):
+            self.reply(i)
+        self.assertEqual(b''.join(self.received),
+                         b''.join(self.segment_content(i)
+                                  for i in range(self.n_segments)))
+        self.assertTrue(self.complete)
+
+    def test_bounded_buffer(self):
+        consumer = stream.StreamConsumer('/file-name', self.received.append,
+                                         face=self.face, pipeline=100,
+                                         chunk_size=self.segment_size,
+                                         max_buffer=3 * self.segment_size)
+        consumer.start()
+        self.reply(0)
+
+        # Only as many chunks as fit in the buffer are requested.
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(1, 4)])
+
+        # Receiving chunks after the first missing one does not free any
+        # space, so nothing more is requested.
+        self.reply(3)
+        self.reply(2)
+        self.assertFaceNamesEqual([segment_name('/file-name', 1)])
+
+        # Once they can be delivered, the buffer moves on.
+        self.reply(1)
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in range(4, 7)])
+
+    def test_segment_ranges(self):
+        consumer = stream.StreamConsumer('/file-name', self.received.append,
+                                         face=self.face, pipeline=100,
+                                         chunk_size=self.segment_size,
+                                         max_buffer=3 * self.segment_size,
+                                         segment_ranges=[(2, 4), (6, 7)])
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+        self.reply(0)
+
+        # The buffer only has to hold the requested chunks.
+        self.assertEqual(self.received, [])
+        self.assertFaceNamesEqual(
+            [segment_name('/file-name', i) for i in [2, 3, 6]])
+
+        self.reply(6)
+        self.reply(3)
+        self.assertEqual(self.received, [])
+        self.reply(2)
+        self.assertEqual(self.received,
+                         [self.segment_content(i) for i in [2, 3, 6]])
+        self.assertTrue(self.complete)
+
+    def test_pipe(self):
+        read_fd, write_fd = os.pipe()
+        consumer = stream.StreamConsumer('/file-name', write_fd,
+                                         face=self.face, pipeline=100,
+                                         chunk_size=self.segment_size)
+        consumer.connect('complete', self._on_complete)
+        consumer.start()
+
+        for i in [0, 3, 2, 1] + list(range(4, self.n_segments)):
+            self.reply(i)
+
+        context = GLib.MainContext.default()
+        while not self.complete:
+            context.iteration(True)
+        os.close(write_fd)
+
+        with os.fdopen(read_fd, 'rb') as f:
+            self.assertEqual(f.read(),
+                             b''.join(self.segment_content(i)
+                                      for i in range(self.n_segments)))
+
+    def test_sink_error(self):
+        read_fd, write_fd = os.pipe()
+        os.close(read_fd)
+        consumer = stream.StreamConsumer('/file-name', write_fd,
+                                         face=self.face, pipeline=4,
+                                         chunk_size=self.segment_size)
+        failed = []
+        consumer.connect('failed', lambda c, error: failed.append(error))
+        consumer.start()
+        self.reply(0)
+
+        # Writing to a pipe nobody reads fails.
+        context = GLib.MainContext.default()
+        while not failed:
+            context.iteration(True)
+        os.close(write_fd)
+
+        self.assertIsInstance(failed[0], GLib.Error)
+        self.assertFaceNamesEqual([])
+        self.assertFalse(self.complete)
+
+
+if __name__ == '__main__':
+    # Run test suite
+    unittest.main()
@@ -18,18 +18,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 # A copy of the GNU Lesser General Public License is in the file COPYING.
 
+import argparse
+
 import gi
 gi.require_version('GLib', '2.0')
 
 from gi.repository import GLib
 
 from eos_data_distribution import utils
+from eos_data_distribution.ndn.disk_cache import get_default_disk_cache
 from eos_data_distribution.soma_subscription_fetcher import Fetcher
 
 
 def main():
-    utils.parse_args(include_name=False)
-    fetcher = Fetcher()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--disk-cache', action='store_true',
+                        help='cache the shards fetched on disk')
+    args = utils.parse_args(parser=parser, include_name=False)
+    fetcher = Fetcher(
+        disk_cache=get_default_disk_cache() if args.disk_cache else None)
     loop = GLib.MainLoop()
     loop.run()
 
@@ -51,7 +51,14 @@ def get_soma_server():
 
 class Fetcher(object):
 
-    def __init__(self):
+    """
+    Produce the manifests and shards of SOMA subscriptions, over HTTP.
+
+    If a `disk_cache` is given, the shards fetched are cached in it.
+    """
+
+    def __init__(self, disk_cache=None):
+        self._disk_cache = disk_cache
         self._producer = Producer(SUBSCRIPTIONS_SOMA)
         self._producer.connect('interest', self._on_interest)
         self._producer.registerPrefix()
@@ -89,7 +96,8 @@ class Fetcher(object):
         elif component == 'shard':
             shard_url = urllib.unquote(str(route.get(1)))
             self._subproducers[key] = http.Producer(
-                chunkless_name, shard_url, face=face)
+                chunkless_name, shard_url, disk_cache=self._disk_cache,
+                face=face)
             self._subproducers[key].start()
         else:
             logger.warning('ignoring request: %s', name)
@@ -22,6 +22,7 @@ from os import path, walk
 import logging
 
 from ..DirTools import Monitor
+from ..ndn.dispatch import get_dispatcher
 from ..ndn.file import FileProducer
 from ..names import Name
 
@@ -30,25 +31,38 @@ logger = logging.getLogger(__name__)
 
 class Producer(object):
 
+    """
+    Publish the files found under a directory, and any added to it later.
+
+    Rather than registering a name per file, a single ``Dispatcher`` is
+    registered for `prefix` (and shared with other stores on the same
+    prefix in the process); it routes requests to the file producers.
+    """
+
     def __init__(self, base, prefix='/',
-                 exts=('.shard', '.json'), cost=None):
+                 exts=('.shard', '.json'), cost=None, io_pool=None,
+                 publish_digests=False):
         assert base
         self.base = path.realpath(base)
         self.exts = exts
         self.prefix = prefix
         self.cost = cost
+        self.io_pool = io_pool
+        self.publish_digests = publish_digests
+        self._dispatcher = None
 
         # XXX(xaiki): this is a lot of bookeeping, can probably be reduced
         self.dirs = dict()
         self.dirpubs = defaultdict(lambda: {})
 
     def start (self):
+        self._dispatcher = get_dispatcher(self.prefix, cost=self.cost)
         self.publish_all_names(self.base)
 
     def _path_to_name(self, filename):
         assert filename.startswith(self.base)
         file_path = filename[len(self.base):].lstrip('/')
-        return Name('%s/%s' % (self.prefix.toUri(), file_path))
+        return Name('%s/%s' % (Name(self.prefix).toString(), file_path))
 
     def unpublish(self, basedir):
         [self.unpublish_name(n) for n in self.dirpubs[basedir]]
@@ -61,7 +75,7 @@ class Producer(object):
     def unpublish_name(self, name, basedir):
         producer = self.dirpubs[basedir][name]
         producer.removeRegisteredPrefix(name)
-        del self.dirpubs[basedir][n]
+        del self.dirpubs[basedir][name]
 
     def _publish_name(self, M, p, m, f, o, evt, e=None, d=None):
         return self.publish_name(f.get_path(), d)
@@ -72,7 +86,10 @@ class Producer(object):
 
         name = self._path_to_name(filename)
         file = open(filename, 'rb')
-        producer = FileProducer(name, file, cost=self.cost)
+        producer = FileProducer(name, file, cost=self.cost,
+                                io_pool=self.io_pool,
+                                publish_digests=self.publish_digests,
+                                dispatcher=self._dispatcher)
         producer.start()
         self.dirpubs[basedir].update({name: producer})
 
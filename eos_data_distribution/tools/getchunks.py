@@ -36,6 +36,7 @@ def main():
 
     def check(consumer, pct):
         if args.limit and consumer._callbackCount > args.limit:
+            consumer.close()
             complete()
 
     consumer.connect('progress', check)